@@ -2,8 +2,9 @@ import asyncio
 import threading
 import logging
 from dataclasses import dataclass
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import Response
 from typing import Dict
 import uvicorn
 import sys
@@ -20,15 +21,14 @@ logging.basicConfig(
 import os
 import time
 import json
-from aliyunsdkcore.client import AcsClient
-from aliyunsdkcore.request import CommonRequest
-import numpy as np
-import soundfile as sf
 import jwt
-import requests
+import aiohttp
 
 
 import config as gloabl_config
+from wav_capture import AudioCapture
+from vad import gate_from_config, totals_stats as vad_stats
+from aliyun_credentials import AliyunTokenManager, get_credentials
 
 
 ALGORITHM = "HS256"
@@ -49,275 +49,78 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_sche
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-class AliyunTokenManager:
-    def __init__(self, region="cn-shanghai"):
-        self.client = AcsClient(
-            gloabl_config.ALIYUN_APP_ID,
-            gloabl_config.ALIYUN_APP_KEY,
-            region
-        )
-        self.token = None
-        self.expire_time = 0
-        self.refresh_threshold = 300  # 刷新阈值，单位为秒，这里设置为5分钟
-
-    def _create_token(self):
-        request = CommonRequest()
-        request.set_method('POST')
-        request.set_domain('nls-meta.cn-shanghai.aliyuncs.com')
-        request.set_version('2019-02-28')
-        request.set_action_name('CreateToken')
-
-        try:
-            response = self.client.do_action_with_exception(request)
-            jss = json.loads(response)
-            if 'Token' in jss and 'Id' in jss['Token']:
-                self.token = jss['Token']['Id']
-                self.expire_time = jss['Token']['ExpireTime']
-                print(f"New token created: {self.token}")
-                print(f"Expire time: {self.expire_time}")
-            else:
-                raise Exception("Failed to create token: Invalid response format")
-        except Exception as e:
-            print(f"Error creating token: {e}")
-            raise
-
-    def get_token(self):
-        current_time = int(time.time())
-        
-        # 如果 token 不存在或者即将过期，则刷新 token
-        if self.token is None or (self.expire_time - current_time) <= self.refresh_threshold:
-            self._create_token()
-        
-        return self.token
-
+# 后台提前刷新，创建 transcriber 时直接拿缓存
 token_manager = AliyunTokenManager()
 
-import nls
+from nls_session import SessionStats
+from ws_sender import SenderStats
+from stt_engine import StreamingEngine
+from stt_providers import AliyunProvider
+from speculation import StableInterims
+import metrics
+from metrics import REGISTRY
+
+nls_stats = SessionStats()
+sender_stats = SenderStats()
 
 CONFIDENCE_MIN = 0.5
 SENTENCE_COMPLETE_SEC = 1 # SECONDS
+NLS_IDLE_WINDOW = getattr(gloabl_config, 'NLS_IDLE_WINDOW', 30)  # 停顿多久才关 nls 会话
+NLS_KEEPALIVE_SEC = getattr(gloabl_config, 'NLS_KEEPALIVE_SEC', 5)  # 服务端 10 秒收不到音频就断开
+CAPTURE_MEMORY_BYTES = getattr(gloabl_config, 'CAPTURE_MEMORY_BYTES', 64 * 1024)
+CAPTURE_SEGMENTS = getattr(gloabl_config, 'CAPTURE_SEGMENTS', False)  # 每句话另存一个 wav
+SEND_MAX_QUEUE = getattr(gloabl_config, 'SEND_MAX_QUEUE', 32)  # 每个连接下行最多排多少条
+
+# 每个连接的收音频、vad、切帧、发结果都在 stt_engine 里，这里只剩 nls 的配置
+aliyun_provider = AliyunProvider(
+    appkey=gloabl_config.ALIYUN_STT_APP_KEY,
+    url=getattr(gloabl_config, 'ALIYUN_NLS_URL', "wss://nls-gateway-cn-shanghai.aliyuncs.com/ws/v1"),
+    token_manager=token_manager,
+    session_stats=nls_stats,
+    idle_window=NLS_IDLE_WINDOW,
+    flush_after=SENTENCE_COMPLETE_SEC,
+    keepalive_interval=NLS_KEEPALIVE_SEC,
+    confidence_min=CONFIDENCE_MIN,
+)
+engine = StreamingEngine(
+    {'aliyun': aliyun_provider},
+    # vad 把静音挡在本地，不发给 nls（不计费），一句话说完马上让 nls 断句
+    gate_factory=lambda: gate_from_config(gloabl_config),
+    sender_stats=sender_stats,
+    send_max_queue=SEND_MAX_QUEUE,
+    packet_gap=SENTENCE_COMPLETE_SEC,
+)
 
-@dataclass
-class Config:
-    APPKEY: str = gloabl_config.ALIYUN_STT_APP_KEY
-    URL: str = "wss://nls-gateway-cn-shanghai.aliyuncs.com/ws/v1"
-    CHUNK_SIZE: int = 1280*2
-
-class SpeechRecognitionCallback:
-    def __init__(self, phone, websocket, speech_recog_ref):
-        self.phone = phone
-        self.websocket = websocket
-        self.speech_recog_ref = speech_recog_ref
-        self.loop = asyncio.get_event_loop()
-
-    def on_sentence_begin(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_sentence_begin(message), self.loop)
-
-    def on_sentence_end(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_sentence_end(message), self.loop)
-
-    def on_start(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_start(message), self.loop)
-
-    def on_error(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_error(message), self.loop)
-
-    def on_close(self, *args):
-        asyncio.run_coroutine_threadsafe(self._on_close(), self.loop)
-
-    def on_result_changed(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_result_changed(message), self.loop)
-
-    def on_completed(self, message, *args):
-        asyncio.run_coroutine_threadsafe(self._on_completed(message), self.loop)
-
-    async def _on_sentence_begin(self, message):
-        logging.info(f'{self.phone} - 识别开始: {message}')
-        # if self.websocket:
-        #     await self.websocket.send_text(f"识别开始: {message}")
-
-# 识别结束 消息格式
-# {
-#     "header": {
-#         "namespace": "SpeechTranscriber",
-#         "name": "SentenceEnd",
-#         "status": 20000000,
-#         "message_id": "866a68591b924556bb0f3ed59af09fdb",
-#         "task_id": "c71740af276548e9b9f0b606491bfd91",
-#         "status_text": "Gateway:SUCCESS:Success."
-#     },
-#     "payload": {
-#         "index": 1,
-#         "time": 2500,
-#         "result": "Hello hello hello 3 hello 4。Hello. ",
-#         "confidence": 0.827,
-#         "words": [],
-#         "status": 0,
-#         "gender": "",
-#         "begin_time": 0,
-#         "fixed_result": "",
-#         "unfixed_result": "",
-#         "stash_result": {
-#             "sentenceId": 2,
-#             "beginTime": 2500,
-#             "text": "",
-#             "fixedText": "",
-#             "unfixedText": "",
-#             "currentTime": 2500,
-#             "words": []
-#         },
-#         "audio_extra_info": "",
-#         "sentence_id": "02a151e50b8c46838a07add2de97559f",
-#         "gender_score": 0.0
-#     }
-# }
-    async def _on_sentence_end(self, message):
-        logging.info(f'{self.phone} - 识别结束')
-        try:
-            message = json.loads(message)
-            if message.get('payload', {}).get('confidence', 0) > 0.5:
-                message_result = message.get('payload', {}).get('result', '')
-                message_result = '<|final|>' + message_result
-                logging.info(f'sending to websocket: {message_result}')
-                await self.websocket.send_text(f"{message_result}")
-                speech_recognizer = self.speech_recog_ref()
-                if speech_recognizer is not None:
-                    speech_recognizer.start_save_wav()
-
-            else:
-                logging.info('confidence is toooo low')
-        except:
-            logging.exception(f'ops, _on_sentence_end')
-
-    async def _on_start(self, message):
-        logging.info(f'{self.phone} - 识别启动: {message}')
-        # if self.websocket:
-        #     await self.websocket.send_text(f"识别启动: {message}")
-
-    async def _on_error(self, message):
-        logging.info(f'{self.phone} - 识别错误: {message}')
-        # if self.websocket:
-        #     await self.websocket.send_text(f"识别错误: {message}")
-
-    async def _on_close(self):
-        try:
-            speech_recognizer = self.speech_recog_ref()
-            if speech_recognizer is not None:
-                logging.info(f'{self.phone} - 识别通道关闭')
-                speech_recognizer.started = False
-            else:
-                logging.info("SpeechRecognizer object no longer exists")
-            # if self.websocket:
-            #     await self.websocket.send_text("识别通道关闭")
-        except:
-            logging.exception(f'ops, _on_close')
-
-
-# 中间识别结果
-# {
-#     "header": {
-#         "namespace": "SpeechTranscriber",
-#         "name": "TranscriptionResultChanged",
-#         "status": 20000000,
-#         "message_id": "08c115289c214f18876d121ecf68f8a7",
-#         "task_id": "c71740af276548e9b9f0b606491bfd91",
-#         "status_text": "Gateway:SUCCESS:Success."
-#     },
-#     "payload": {
-#         "index": 1,
-#         "time": 2200,
-#         "result": "Hello hello hello hello. ",
-#         "confidence": 0.86,
-#         "words": [],
-#         "status": 0,
-#         "fixed_result": "",
-#         "unfixed_result": ""
-#     }
-# }
-
-    async def _on_result_changed(self, message):
-        logging.info(f'{self.phone} - 中间识别结果')
-        try:
-            message = json.loads(message)
-            if message.get('payload', {}).get('confidence', 0) > 0.5:
-                message_result = message.get('payload', {}).get('result', '')
-                logging.info(f'sending to websocket: {message_result}')
-                await self.websocket.send_text(f"{message_result}")
-            else:
-                logging.info('confidence is toooo low')
-        except:
-            logging.exception(f'ops, _on_result_changed')
-
-
-    async def _on_completed(self, message):
-        logging.info(f'{self.phone} - 识别完成: {message}')
-        # if self.websocket:
-        #     await self.websocket.send_text(f"识别完成: {message}")
-
-class SpeechRecognizer:
-    def __init__(self, config: Config, phone: str, msg_id: str, websocket: WebSocket):
-        self.config = config
-        self.phone = phone
-        self.msg_id = msg_id
-        self.websocket = websocket
-        self.callback = SpeechRecognitionCallback(phone, websocket, weakref.ref(self))
-        self.sr = None
-        self.executor = ThreadPoolExecutor(max_workers=1)
-        self.started = False
-        self.all_audio_buffer = bytearray()
-
-    def create_transcriber(self):
-        return nls.NlsSpeechTranscriber(
-            url=self.config.URL,
-            token=token_manager.get_token(),
-            appkey=self.config.APPKEY,
-            on_sentence_begin=self.callback.on_sentence_begin,
-            on_sentence_end=self.callback.on_sentence_end,
-            on_start=self.callback.on_start,
-            on_result_changed=self.callback.on_result_changed,
-            on_completed=self.callback.on_completed,
-            on_error=self.callback.on_error,
-            on_close=self.callback.on_close,
-            callback_args=[self.phone]
-        )
-
-    def start_transcriber_sync(self):
-        self.sr.start(
-            aformat="pcm",
-            enable_intermediate_result=True,
-            enable_punctuation_prediction=True,
-            enable_inverse_text_normalization=True
-        )
-
-    async def start_transcriber(self):
-        if self.started:
-            return
-        loop = asyncio.get_event_loop()
-        self.sr = await loop.run_in_executor(self.executor, self.create_transcriber)
-        logging.info(f'sr created')
-
-        await loop.run_in_executor(self.executor, self.start_transcriber_sync)
-        logging.info(f'sr.started')
-        self.started = True
-
-    async def stop_transcriber(self):
-        if self.sr:
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(self.executor, self.sr.stop)
-
-    async def send_audio(self, audio_chunk):
-        await self.start_transcriber()
-        if self.sr:
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(self.executor, self.sr.send_audio, audio_chunk)
-        
-    def start_save_wav(self):
-        asyncio.create_task(audio_tofile(self.phone, self.msg_id, self.all_audio_buffer)) # 启动一个任务然后不管他
+
+async def save_wav(phone, capture):
+    # 句子结束：把攒着的录音写下去并修正 wav 头，开了分段就顺便切出这一句
+    try:
+        if capture.segment_path is None:
+            await capture.checkpoint()
+        else:
+            segment = await capture.cut_segment()
+            logging.info(f'{phone} - audio segment saved as {segment}')
+    except:
+        logging.exception('save_wav')
 
 app = FastAPI()
 
 active_connections: Dict[str, WebSocket] = {}
 user_bytes = {}
+# 还在录的连接的录音，re_recognize 直接从这里取，连接结束后自动消失
+live_captures = weakref.WeakValueDictionary()
+
+REGISTRY.configure(getattr(gloabl_config, 'METRICS_MODE', 'light'))
+stats_guard = metrics.scrape_guard(getattr(gloabl_config, 'METRICS_TOKEN', None))  # 统计接口和 /metrics 一样的访问控制
+REGISTRY.gauge('stt_websockets', 'Open STT websockets', lambda: len(active_connections))
+REGISTRY.gauge('stt_live_captures', 'Recordings still being captured', lambda: len(live_captures))
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not metrics.scrape_allowed(request, getattr(gloabl_config, 'METRICS_TOKEN', None)):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.websocket("/api_16/ws/{msg_id}")
@@ -345,113 +148,144 @@ async def websocket_endpoint(websocket: WebSocket, msg_id: str):
     active_users = list(active_connections.keys())
     logging.info(f'active_users.cnt={len(active_users)}, active_users={active_users[:10]}')
 
-    config = Config()
-    recognizer = SpeechRecognizer(config, phone, msg_id, websocket)
-    try:
-        async def audio_receiver():
-            temp_audio_buffer = bytearray()
-            last_received_time = 0
-            while True:
-                try:
-                    audio_content = await asyncio.wait_for(websocket.receive_bytes(), timeout=0.1)
-                    user_bytes[phone] = user_bytes.get(phone, 0) + len(audio_content)
-                    last_received_time = time.time()
-                    temp_audio_buffer.extend(audio_content)
-                    recognizer.all_audio_buffer.extend(audio_content)
-                    while len(temp_audio_buffer) >= config.CHUNK_SIZE:
-                        await recognizer.send_audio(temp_audio_buffer[:config.CHUNK_SIZE])
-                        temp_audio_buffer = temp_audio_buffer[config.CHUNK_SIZE:]
-                except asyncio.TimeoutError:
-                    if last_received_time and time.time() - last_received_time > 1:
-                        last_received_time = 0
-                        await recognizer.stop_transcriber()
-                    pass
-                except WebSocketDisconnect:
-                    logging.info(f"WebSocket disconnected for user {phone}")
-                    await recognizer.stop_transcriber()
-                    break
-                except Exception as e:
-                    logging.error(f"Error receiving audio for user {phone}: {e}")
-                    break
-            temp_audio_buffer.clear()
-            temp_audio_buffer = None
+    # 录音边收边写到文件，内存里最多攒 CAPTURE_MEMORY_BYTES
+    key = f'{phone}_{msg_id}'
+    capture = AudioCapture(
+        os.path.join('static', phone, f'{key}.wav'),
+        segment_path=os.path.join('static', phone, key + '_{}.wav') if CAPTURE_SEGMENTS else None,
+        memory_max_bytes=CAPTURE_MEMORY_BYTES,
+    )
+    live_captures[key] = capture
+
+    async def on_audio(audio_content):
+        user_bytes[phone] = user_bytes.get(phone, 0) + len(audio_content)
+        await capture.write(audio_content)
+
+    # 中间结果稳定一段时间就让 web 服务按它提前开始回复，最终结果出来时再确认
+    stable = StableInterims(SPECULATE_STABLE_MS, lambda text: speculate(phone, text)) if SPECULATE_URL else None
+
+    async def on_final(text):
+        if stable is not None:
+            stable.reset()
+            speculate(phone, text, final=True)
+        await save_wav(phone, capture)
 
+    try:
         # 持续接收直到用户关闭 websocket
-        receiver_task = asyncio.create_task(audio_receiver())
-        await asyncio.gather(receiver_task)
-    
-    except WebSocketDisconnect:
-        logging.info(f"WebSocket disconnected for user {phone}")
-    except Exception as e:
-        logging.info(f"Error: {e}")
+        await engine.serve(websocket, phone, provider='aliyun', on_audio=on_audio, on_final=on_final,
+                           on_interim=stable.update if stable is not None else None, trace_id=msg_id)
     finally:
+        if stable is not None:
+            stable.reset()
+        await capture.close()
         users_to_file()
-        if phone in active_connections:
+        if active_connections.get(phone) is websocket:
             del active_connections[phone]
         logging.info(f"Cleaned up connection for user {phone}")
 
-from collections import defaultdict
-# 为每个唯一的 key 创建一个锁
-file_locks = defaultdict(asyncio.Lock)
-
-async def async_write_wav(wav_file, audio_data, sample_rate):
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(
-        None, 
-        lambda: sf.write(wav_file, audio_data, sample_rate, subtype='PCM_16')
-    )
-
-async def audio_tofile(phone, msg_id, all_audio_buffer):
-    key = f"{phone}_{msg_id}"
-    filename = f"{key}.wav"
-    # 获取或创建这个 key 的锁
-    lock = file_locks[key]
-    # 使用这个 key 的锁来控制对文件的访问
-    async with lock:
-        try:
-            audio_data = np.frombuffer(all_audio_buffer, dtype=np.int16)
-            sample_rate=16000
-            wav_file = os.path.join('static', phone, filename)
-            os.makedirs(os.path.join('static', phone), exist_ok=True)
-            await async_write_wav(wav_file, audio_data, sample_rate)
-            logging.info(f"Audio saved as {wav_file}")
-            return True
-        except:
-            logging.exception("audio_tofile")
-
-import ffmpeg
-
-async def async_convert_wav_to_mp3(wav_file, mp3_file):
-    await asyncio.to_thread(
-        ffmpeg.input(wav_file)
-        .output(mp3_file, acodec='libmp3lame')
-        .global_args('-loglevel', 'error', '-y')
-        .run
-    )
+@app.on_event("startup")
+async def startup():
+    await engine.start()
+    await http_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await engine.stop()
+    await http_pool.close()
+
+@app.get("/api_16/nls_sessions", dependencies=[Depends(stats_guard)])
+async def get_nls_sessions():
+    stats = nls_stats.stats()
+    stats['websockets'] = len(active_connections)
+    stats['vad'] = vad_stats()
+    stats['sender'] = sender_stats.stats()
+    stats['engine'] = engine.stats()
+    stats['token'] = token_manager.stats()
+    stats['openapi'] = get_credentials().stats()
+    stats['transcoder'] = transcoder.stats()
+    stats['http_pool'] = http_pool.stats()
+    return stats
+
+from transcoder import CONTENT_TYPES, TranscodeError, get_transcoder
+transcoder = get_transcoder()
+
+from http_pool import HttpPool
+http_pool = HttpPool(
+    limit_per_host=getattr(gloabl_config, 'HTTP_LIMIT_PER_HOST', 20),
+    connect_timeout=getattr(gloabl_config, 'HTTP_CONNECT_TIMEOUT', 10),
+    sock_read_timeout=getattr(gloabl_config, 'HTTP_READ_TIMEOUT', 60),
+)
+FILE_STT_TIMEOUT = getattr(gloabl_config, 'FILE_STT_TIMEOUT', 120)
 
 @app.get("/api_16/re_recognize/{msg_id}")
 async def get_re_recognize(msg_id: str, phone: str = Depends(verify_token)):
     return await re_recognize(phone, msg_id)
 
 async def re_recognize(phone, msg_id):
-    wav_file = os.path.join('static', phone, f'{phone}_{msg_id}.wav')
-    mp3_file = os.path.join('static', phone, f'{phone}_{msg_id}.mp3')
-
-    await async_convert_wav_to_mp3(wav_file, mp3_file)
-    logging.info(f"Audio saved as {mp3_file}")
-
-    with open(mp3_file, 'rb') as file:
-        files = {'file': file}
-        response = requests.post(gloabl_config.INTERNAL_FILE_STT_URL, files=files)
-        
-        if response.status_code == 200:
-            logging.info(f"remote file stt successed, response={response.json()}")
-            return response.json()
-        else:
-            logging.info(f"Failed to remote file stt . Status code: {response.status_code}")
-            logging.info(f"Response: {response.text}")
+    # 直接用会话的录音：连接还在就取内存里的 / 刚 checkpoint 的，断开了就是关闭时写好的 wav；
+    # 文件识别服务收 wav，不再转 mp3，文件按块流式上传
+    key = f'{phone}_{msg_id}'
+    capture = live_captures.get(key)
+    if capture is not None:
+        wav_file, wav_data = await capture.snapshot()
+    else:
+        wav_file, wav_data = os.path.join('static', phone, f'{key}.wav'), None
+        if not os.path.exists(wav_file):
+            logging.info(f'no capture for {key}')
             return {"text": ""}
 
+    try:
+        if wav_data is not None:
+            data, fmt, content_type = await transcoder.prepare(wav_data, 'file_stt')
+            return await post_file_stt(data, f'{key}.{fmt}', content_type)
+        path = await transcoder.prepare_file(wav_file, 'file_stt')
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1][1:], 'application/octet-stream')
+        with open(path, 'rb') as file:
+            return await post_file_stt(file, os.path.basename(path), content_type)
+    except TranscodeError as e:
+        logging.error(f'{key} - convert failed: {e}')
+        return {"text": ""}
+
+async def post_file_stt(data, filename, content_type):
+    form = aiohttp.FormData()
+    form.add_field('file', data, filename=filename, content_type=content_type)
+    session = await http_pool.get_session()
+    try:
+        async with session.post(gloabl_config.INTERNAL_FILE_STT_URL, data=form,
+                                timeout=aiohttp.ClientTimeout(total=FILE_STT_TIMEOUT)) as response:
+            if response.status == 200:
+                result = await response.json(content_type=None)
+                logging.info(f"remote file stt successed, response={result}")
+                return result
+            logging.info(f"Failed to remote file stt . Status code: {response.status}")
+            logging.info(f"Response: {await response.text()}")
+            return {"text": ""}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error(f'remote file stt failed, file={filename}: {e!r}')
+        return {"text": ""}
+
+
+# web 服务的 /api_12/speculate，不配就不推测
+SPECULATE_URL = getattr(gloabl_config, 'SPECULATE_URL', None)
+SPECULATE_STABLE_MS = getattr(gloabl_config, 'SPECULATE_STABLE_MS', 400)
+speculate_tasks = set()
+
+def speculate(phone, text, final=False):
+    # 不等结果，失败了也只是少一次提前
+    task = asyncio.create_task(post_speculate(phone, text, final))
+    speculate_tasks.add(task)
+    task.add_done_callback(speculate_tasks.discard)
+
+async def post_speculate(phone, text, final):
+    token = jwt.encode({'sub': phone}, gloabl_config.JWT_SECRET_KEY, algorithm=ALGORITHM)
+    session = await http_pool.get_session()
+    try:
+        async with session.post(SPECULATE_URL, json={'token': token, 'text': text, 'final': final},
+                                timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status != 200:
+                logging.info(f'{phone} - speculate failed, status={response.status}')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.info(f'{phone} - speculate failed: {e!r}')
 
 
 def users_to_file():
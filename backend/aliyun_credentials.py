@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
+from aliyunsdkcore.request import CommonRequest
+
+import config
+
+
+def retryable(e):
+    # 网络错误、限流、服务端 5xx 可以重试；参数、鉴权之类的错误重试也没用
+    if isinstance(e, ClientException):
+        return e.get_error_code() in ('SDK.HttpError', 'SDK.TimeoutError')
+    if isinstance(e, ServerException):
+        return (e.http_status or 0) >= 500 or 'Throttling' in (e.get_error_code() or '')
+    return False
+
+
+class AliyunCredentials:
+    """进程内共用的阿里云 AccessKey：按 region 缓存 AcsClient，所有 openapi 调用都走 call()，
+    在线程里执行不阻塞事件循环，按 action 统计次数、错误和耗时"""
+
+    def __init__(self, access_key_id, access_key_secret):
+        self._access_key_id = access_key_id
+        self._access_key_secret = access_key_secret
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.counters = {}
+
+    def client(self, region):
+        client = self._clients.get(region)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(region)
+                if client is None:
+                    client = AcsClient(self._access_key_id, self._access_key_secret, region)
+                    self._clients[region] = client
+        return client
+
+    def _count(self, action, ms, error=None):
+        counter = self.counters.setdefault(action, {'calls': 0, 'errors': 0, 'ms_total': 0.0, 'ms_max': 0.0})
+        counter['calls'] += 1
+        counter['ms_total'] += ms
+        counter['ms_max'] = max(counter['ms_max'], ms)
+        if error is not None:
+            counter['errors'] += 1
+            counter['last_error'] = str(error)
+
+    def call_sync(self, request, region):
+        action = request.get_action_name()
+        start = time.perf_counter()
+        try:
+            response = self.client(region).do_action_with_exception(request)
+        except Exception as e:
+            self._count(action, (time.perf_counter() - start) * 1000, e)
+            raise
+        self._count(action, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def call(self, request, region, retries=0, backoff=0.5):
+        """retries 只给幂等的调用用（比如 CreateToken），发短信这种重试了可能发两遍"""
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.to_thread(self.call_sync, request, region)
+            except Exception as e:
+                if attempt >= retries or not retryable(e):
+                    raise
+                attempt += 1
+                delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logging.warning(f'{request.get_action_name()} failed: {e}, retry in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        stats = {}
+        for action, counter in self.counters.items():
+            stats[action] = dict(counter, ms_total=round(counter['ms_total'], 1), ms_max=round(counter['ms_max'], 1),
+                                 ms_avg=round(counter['ms_total'] / counter['calls'], 1))
+        return stats
+
+
+_credentials = None
+
+
+def get_credentials():
+    global _credentials
+    if _credentials is None:
+        _credentials = AliyunCredentials(config.ALIYUN_APP_ID, config.ALIYUN_APP_KEY)
+    return _credentials
+
+
+class AliyunTokenManager:
+    """nls 的访问 token。
+
+    start() 之后后台任务在过期前 refresh_ahead 秒（再减一点随机抖动，多个进程别同时刷）换新 token，
+    失败按指数退避加抖动重试；get_token() 平时直接返回缓存，不会碰到网络。
+    缓存失效时（还没 start、后台一直刷新失败）同时来的请求只会触发一次 CreateToken，其余的等同一个结果。
+    """
+
+    def __init__(self, credentials=None, region='cn-shanghai', domain='nls-meta.cn-shanghai.aliyuncs.com',
+                 refresh_ahead=300, retry_base=1.0, retry_max=60.0):
+        self.credentials = credentials or get_credentials()
+        self.region = region
+        self.domain = domain
+        self.refresh_ahead = refresh_ahead
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.token = None
+        self.expire_time = 0
+        self._inflight = None
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._sync_lock = threading.Lock()
+        self.counters = {'hits': 0, 'waits': 0, 'coalesced': 0, 'refreshes': 0, 'refresh_errors': 0}
+        self.last_refresh_ms = None
+        self.last_error = None
+
+    def _request(self):
+        request = CommonRequest()
+        request.set_method('POST')
+        request.set_domain(self.domain)
+        request.set_version('2019-02-28')
+        request.set_action_name('CreateToken')
+        return request
+
+    def _apply(self, response, ms):
+        jss = json.loads(response)
+        if 'Token' not in jss or 'Id' not in jss['Token']:
+            raise Exception(f'Failed to create token: Invalid response format: {jss}')
+        self.token = jss['Token']['Id']
+        self.expire_time = jss['Token']['ExpireTime']
+        self.counters['refreshes'] += 1
+        self.last_refresh_ms = round(ms, 1)
+        logging.info(f'nls token refreshed in {ms:.0f}ms, expire in {self.expire_time - time.time():.0f}s')
+        return self.token
+
+    async def _create_token(self):
+        start = time.perf_counter()
+        try:
+            response = await self.credentials.call(self._request(), self.region, retries=2, backoff=self.retry_base)
+        except Exception as e:
+            self.counters['refresh_errors'] += 1
+            self.last_error = str(e)
+            raise
+        return self._apply(response, (time.perf_counter() - start) * 1000)
+
+    def valid(self, margin=10):
+        return self.token is not None and self.expire_time - time.time() > margin
+
+    async def refresh(self):
+        """换一次 token；已经有一个在换的话等它的结果"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._create_token())
+        else:
+            self.counters['coalesced'] += 1
+        # shield：某个等待方被取消不影响其他人
+        return await asyncio.shield(self._inflight)
+
+    async def get_token(self):
+        if self.valid():
+            self.counters['hits'] += 1
+            return self.token
+        self.counters['waits'] += 1
+        return await self.refresh()
+
+    def get_token_sync(self):
+        """给在线程里跑的代码用（比如创建 nls transcriber）：缓存有效直接返回，
+        否则交给事件循环里的 refresh，和其他请求合并成一次"""
+        if self.valid():
+            self.counters['hits'] += 1
+            return self.token
+        self.counters['waits'] += 1
+        if self._loop is not None and self._loop.is_running():
+            if threading.get_ident() == self._loop_thread:
+                raise RuntimeError('get_token_sync() called from the event loop, use await get_token()')
+            return asyncio.run_coroutine_threadsafe(self.refresh(), self._loop).result(timeout=30)
+        # 没有事件循环（脚本里直接用）
+        with self._sync_lock:
+            if not self.valid():
+                start = time.perf_counter()
+                response = self.credentials.call_sync(self._request(), self.region)
+                self._apply(response, (time.perf_counter() - start) * 1000)
+            return self.token
+
+    async def _refresh_forever(self):
+        failures = 0
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(self.retry_max, self.retry_base * 2 ** failures) * random.uniform(0.5, 1.5)
+                logging.error(f'nls token refresh failed ({failures}): {e}, retry in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            jitter = random.uniform(0, min(60.0, self.refresh_ahead / 5))
+            await asyncio.sleep(max(1.0, self.expire_time - time.time() - self.refresh_ahead - jitter))
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(
+            expires_in=round(self.expire_time - time.time()) if self.token else None,
+            last_refresh_ms=self.last_refresh_ms,
+            last_error=self.last_error,
+            refreshing=self._inflight is not None and not self._inflight.done(),
+        )
+        return stats
@@ -0,0 +1,102 @@
+# 音频切帧微基准：旧的 bytearray 切片 vs AudioRingBuffer
+#
+# 模拟几百路同时在说话的连接，每路按 websocket 消息大小收 16k 16bit pcm，切成固定大小的帧交给 sdk。
+# 统计每秒音频要拷贝多少字节（收到数据那一次也算），以及切帧本身的 cpu 时间。
+#
+# python bench_ring_buffer.py
+# python bench_ring_buffer.py --streams 500 --seconds 20 --message 640 4096 32000
+
+import argparse
+import asyncio
+import os
+import time
+
+from ring_buffer import AudioRingBuffer
+
+BYTES_PER_SEC = 16000 * 2
+
+
+class LegacyChunker:
+    # aliyun-stt-ws.py / google-stt-ws.py 原来的写法，顺便数一下拷贝的字节数
+    def __init__(self, frame_size):
+        self.frame_size = frame_size
+        self.buffer = bytearray()
+        self.copied = 0
+
+    async def feed(self, data, send):
+        self.buffer.extend(data)
+        self.copied += len(data)
+        while len(self.buffer) >= self.frame_size:
+            frame = self.buffer[:self.frame_size]
+            self.buffer = self.buffer[self.frame_size:]
+            self.copied += self.frame_size + len(self.buffer)
+            await send(frame)
+
+
+class RingChunker:
+    def __init__(self, frame_size):
+        self.ring = AudioRingBuffer(frame_size)
+
+    @property
+    def copied(self):
+        return self.ring.bytes_in
+
+    async def feed(self, data, send):
+        await self.ring.feed(data, send)
+
+
+async def send_view(frame):
+    # aliyun：sdk 在 send 里同步把帧发完
+    pass
+
+
+class CopyingSend:
+    # google：帧要排队，交出去时拷成 bytes
+    def __init__(self):
+        self.copied = 0
+
+    async def __call__(self, frame):
+        self.copied += len(bytes(frame))
+
+
+async def run(chunker_cls, streams, seconds, message, frame_size, copy_on_send):
+    payload = os.urandom(message)
+    chunkers = [chunker_cls(frame_size) for _ in range(streams)]
+    sends = [CopyingSend() if copy_on_send else send_view for _ in range(streams)]
+    rounds = seconds * BYTES_PER_SEC // message
+    start = time.process_time()
+    for _ in range(rounds):
+        # 各路轮流收到一条消息，跟事件循环里几百个连接交替处理差不多
+        for chunker, send in zip(chunkers, sends):
+            await chunker.feed(payload, send)
+    cpu = time.process_time() - start
+    copied = sum(c.copied for c in chunkers)
+    if copy_on_send:
+        copied += sum(s.copied for s in sends)
+    audio_seconds = streams * rounds * message / BYTES_PER_SEC
+    return copied / audio_seconds, cpu / audio_seconds
+
+
+def main(args):
+    print(f'streams={args.streams}, seconds={args.seconds}, 16kHz 16bit, '
+          f'copied = 每秒音频拷贝的字节数（音频本身 {BYTES_PER_SEC} B/s）')
+    print(f'{"server":>7} {"frame":>6} {"message":>8} {"legacy B/s":>11} {"ring B/s":>9} '
+          f'{"legacy us/s":>12} {"ring us/s":>10} {"copies":>7}')
+    for server, frame_size, copy_on_send in (('aliyun', 2560, False), ('google', 3200, True)):
+        for message in args.message:
+            legacy_copied, legacy_cpu = asyncio.run(
+                run(LegacyChunker, args.streams, args.seconds, message, frame_size, copy_on_send))
+            ring_copied, ring_cpu = asyncio.run(
+                run(RingChunker, args.streams, args.seconds, message, frame_size, copy_on_send))
+            print(f'{server:>7} {frame_size:>6} {message:>8} {legacy_copied:>11.0f} {ring_copied:>9.0f} '
+                  f'{legacy_cpu * 1e6:>12.1f} {ring_cpu * 1e6:>10.1f} {legacy_copied / ring_copied:>6.1f}x')
+    print(f'{args.streams} 路实时音频，每秒总拷贝量按上表 B/s 乘 {args.streams}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=300)
+    parser.add_argument('--seconds', type=int, default=10)
+    # 前端每次发的大小：20ms、128ms、整秒
+    parser.add_argument('--message', type=int, nargs='+', default=[640, 4096, 32000])
+    main(parser.parse_args())
@@ -0,0 +1,132 @@
+# 断句微基准：旧的 contains_sep 循环 vs SentenceSegmenter
+#
+# python bench_segmenter.py
+# python bench_segmenter.py --chars 20000 50000 --chunk 6
+
+import argparse
+import random
+import time
+
+from segmenter import SentenceSegmenter, SEPERATORS
+
+
+def contains_sep(text):
+    # web.py 里原来的实现，原样保留做对比
+    if len(text.strip()) == 1:
+        return False, None, None
+    left_size = len(text)
+    left = ''
+    for SEP in SEPERATORS:
+        if SEP in text:
+            arr = text.split(SEP, 1)
+            if left_size > len(arr[0]):
+                left = arr[0] + SEP
+                right = arr[1]
+                left_size = len(arr[0])
+    if left:
+        return True, left, right
+    return False, None, None
+
+
+def legacy(chunks):
+    sentences = []
+    remains = ''
+    for data in chunks:
+        data = data.replace('\n\n', '\n')
+        data = remains + data
+        exist, left, right = contains_sep(data)
+        while exist:
+            if left.strip():
+                sentences.append(left)
+            data = right
+            exist, left, right = contains_sep(data)
+        remains = data
+    if remains.strip():
+        sentences.append(remains)
+    return sentences
+
+
+def segmented(chunks, min_length):
+    segmenter = SentenceSegmenter(SEPERATORS, min_length=min_length)
+    sentences = [s for chunk in chunks for s in segmenter.feed(chunk) if s.strip()]
+    remains = segmenter.flush()
+    if remains.strip():
+        sentences.append(remains)
+    return sentences
+
+
+def make_text(kind, chars, rng):
+    if kind == 'cjk':
+        words = ['今天', '天气', '不错', '我们', '一起', '去', '公园', '散步', '好的', '谢谢']
+        puncts = ['，', '。', '！', '？']
+    elif kind == 'en':
+        words = ['today ', 'the ', 'weather ', 'is ', 'nice ', 'let ', 'us ', 'go ', 'for ', 'a ', 'walk ']
+        puncts = [', ', '. ', '! ', '? ']
+    else:  # 一整段不带标点，旧实现最差的情况
+        words = ['没有标点的长段落', 'no punctuation at all ']
+        puncts = []
+    out = []
+    size = 0
+    while size < chars:
+        word = rng.choice(words)
+        if puncts and rng.random() < 0.12:
+            word += rng.choice(puncts)
+        out.append(word)
+        size += len(word)
+    return ''.join(out)
+
+
+def split_chars(text, chunk, rng):
+    # llm 流式输出一般每次几个字
+    chunks = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, chunk)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def split_bytes(text, chunk, rng):
+    # 按字节随机切，多字节字符会被切开，旧实现 decode 会直接报错
+    data = text.encode('utf-8')
+    chunks = []
+    i = 0
+    while i < len(data):
+        n = rng.randint(1, chunk * 3)
+        chunks.append(data[i:i + n])
+        i += n
+    return chunks
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args):
+    rng = random.Random(42)
+    print(f'{"text":>6} {"chars":>8} {"legacy ms":>10} {"segmenter ms":>13} {"bytes-split ms":>15} {"speedup":>8}')
+    for kind in ('cjk', 'en', 'nopunct'):
+        for chars in args.chars:
+            text = make_text(kind, chars, rng)
+            char_chunks = split_chars(text, args.chunk, rng)
+            byte_chunks = split_bytes(text, args.chunk, rng)
+            legacy_s, expected = timeit(lambda: legacy(char_chunks), args.repeat)
+            seg_s, got = timeit(lambda: segmented(char_chunks, 0), args.repeat)
+            bytes_s, got_bytes = timeit(lambda: segmented(byte_chunks, 0), args.repeat)
+            assert ''.join(got) == ''.join(got_bytes)
+            print(f'{kind:>6} {chars:>8} {legacy_s * 1000:>10.2f} {seg_s * 1000:>13.2f} {bytes_s * 1000:>15.2f} '
+                  f'{legacy_s / seg_s:>7.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chars', type=int, nargs='+', default=[2000, 20000, 100000])
+    parser.add_argument('--chunk', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
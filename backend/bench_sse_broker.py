@@ -0,0 +1,156 @@
+# SSE 并发压测：一个 uvicorn worker 能同时挂住多少条 /sse 流
+#
+# python bench_sse_broker.py                 # 默认 broker 模式
+# python bench_sse_broker.py --mode queue    # 旧的 Queue.get(timeout) + 线程池方式，对比用
+# python bench_sse_broker.py --streams 100 500 1000 2000 --sentences 20
+
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import time
+from queue import Queue, Empty
+
+import aiohttp
+
+HOST = '127.0.0.1'
+
+
+def serve(mode, port):
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from sse_broker import MessageBroker
+
+    app = FastAPI()
+    broker = MessageBroker()
+    queues = {}
+
+    @app.get("/sse/{msg_id}")
+    async def sse(msg_id: str):
+        if mode == 'queue':
+            def event_stream():
+                if msg_id not in queues:
+                    queues[msg_id] = Queue()
+                while True:
+                    try:
+                        sentence = queues[msg_id].get(timeout=60)
+                    except Empty:
+                        break
+                    if sentence == '':
+                        break
+                    yield f"data: {sentence} \n\n"
+                yield "data: done\n\n"
+        else:
+            async def event_stream():
+                try:
+                    async for sentence in broker.subscribe(msg_id, timeout=60):
+                        yield f"data: {sentence} \n\n"
+                except asyncio.TimeoutError:
+                    pass
+                broker.discard(msg_id)
+                yield "data: done\n\n"
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    @app.post("/publish/{prefix}/{streams}/{sentences}")
+    async def publish(prefix: str, streams: int, sentences: int):
+        for i in range(sentences):
+            for n in range(streams):
+                msg_id = f'{prefix}_{n}'
+                if mode == 'queue':
+                    queues.setdefault(msg_id, Queue()).put(f'sentence {i}')
+                else:
+                    broker.publish(msg_id, f'sentence {i}')
+            await asyncio.sleep(0)
+        for n in range(streams):
+            msg_id = f'{prefix}_{n}'
+            if mode == 'queue':
+                queues.setdefault(msg_id, Queue()).put('')
+            else:
+                broker.close(msg_id)
+        return {}
+
+    @app.get("/ping")
+    def ping():
+        # 同步接口，和旧 SSE 生成器共用 starlette 线程池，用来观察线程池是否被占满
+        return {}
+
+    @app.get("/rss")
+    async def rss():
+        return {"rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    uvicorn.run(app, host=HOST, port=port, log_level='warning', backlog=4096)
+
+
+async def one_stream(session, base, msg_id, deadline, ready):
+    received = 0
+    async with session.get(f'{base}/sse/{msg_id}', timeout=aiohttp.ClientTimeout(total=deadline)) as resp:
+        ready.set()
+        async for line in resp.content:
+            if line.startswith(b'data: done'):
+                return received
+            if line.startswith(b'data: '):
+                received += 1
+    return received
+
+
+async def run_level(base, prefix, streams, sentences, deadline):
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        readies = [asyncio.Event() for _ in range(streams)]
+        tasks = [asyncio.create_task(one_stream(session, base, f'{prefix}_{n}', deadline, readies[n]))
+                 for n in range(streams)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(r.wait() for r in readies)), timeout=10)
+            held = streams
+        except asyncio.TimeoutError:
+            held = sum(r.is_set() for r in readies)
+        # 流都挂着的时候，一个普通同步接口要等多久
+        ping_start = time.perf_counter()
+        try:
+            async with session.get(f'{base}/ping', timeout=aiohttp.ClientTimeout(total=deadline)) as resp:
+                await resp.read()
+            ping_ms = (time.perf_counter() - ping_start) * 1000
+        except asyncio.TimeoutError:
+            ping_ms = float('inf')
+        start = time.perf_counter()
+        await session.post(f'{base}/publish/{prefix}/{streams}/{sentences}')
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        elapsed = time.perf_counter() - start
+        for t in pending:
+            t.cancel()
+        complete = sum(1 for t in done if not t.exception() and t.result() == sentences)
+        async with session.get(f'{base}/rss') as resp:
+            rss_kb = (await resp.json())['rss_kb']
+    return held, complete, elapsed, ping_ms, rss_kb
+
+
+async def main(args):
+    base = f'http://{HOST}:{args.port}'
+    print(f'mode={args.mode}, sentences/stream={args.sentences}')
+    print(f'{"streams":>8} {"held":>8} {"complete":>9} {"seconds":>8} {"msgs/s":>9} {"ping ms":>8} {"rss MB":>8}')
+    for i, streams in enumerate(args.streams):
+        held, complete, elapsed, ping_ms, rss_kb = await run_level(base, f'l{i}', streams, args.sentences, args.deadline)
+        rate = complete * args.sentences / elapsed if elapsed else 0
+        print(f'{streams:>8} {held:>8} {complete:>9} {elapsed:>8.2f} {rate:>9.0f} {ping_ms:>8.1f} {rss_kb / 1024:>8.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['broker', 'queue'], default='broker')
+    parser.add_argument('--streams', type=int, nargs='+', default=[50, 200, 1000, 2000])
+    parser.add_argument('--sentences', type=int, default=20)
+    parser.add_argument('--deadline', type=float, default=30)
+    parser.add_argument('--port', type=int, default=18012)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = multiprocessing.Process(target=serve, args=(args.mode, args.port), daemon=True)
+    server.start()
+    time.sleep(2)
+    try:
+        asyncio.run(main(args))
+    finally:
+        server.terminate()
@@ -0,0 +1,109 @@
+# 转码基准：原来的 ffmpeg-python 按文件转 vs Transcoder（管道、限并发），以及不起 ffmpeg 的快速路径
+#
+# 一次提交 --jobs 个任务（模拟一波上传同时到），统计每秒转完几个和单个任务的 p50 / p99 延迟（从提交算起）。
+# 需要 PATH 里有 ffmpeg。
+#
+# python bench_transcoder.py
+# python bench_transcoder.py --jobs 200 --seconds 10 --workers 2 4
+
+import argparse
+import asyncio
+import os
+import subprocess
+import tempfile
+import time
+
+import ffmpeg
+import numpy as np
+
+from transcoder import Transcoder, pcm_to_wav
+
+
+def make_inputs(seconds, directory):
+    rng = np.random.default_rng(1)
+    t = np.arange(seconds * 16000) / 16000
+    pcm = (np.sin(2 * np.pi * 220 * t) * 8000 + rng.normal(0, 300, len(t))).astype(np.int16).tobytes()
+    wav = pcm_to_wav(pcm)
+    aac = subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 's16le', '-ar', '16000', '-ac', '1', '-i', 'pipe:0',
+                          '-c:a', 'aac', '-f', 'adts', 'pipe:1'], input=pcm, stdout=subprocess.PIPE, check=True).stdout
+    return pcm, wav, aac
+
+
+def legacy_convert(src, dst, codec_args):
+    # web_tick_file.py / aliyun-stt-ws.py 原来的写法：文件进文件出，每次一个 ffmpeg，不限并发
+    ffmpeg.input(src).output(dst, **codec_args).global_args('-loglevel', 'error', '-y').run()
+
+
+async def run_legacy(data, suffix, target, codec_args, jobs, directory):
+    async def one(i):
+        start = time.perf_counter()
+        src = os.path.join(directory, f'legacy_{i}{suffix}')
+        dst = os.path.join(directory, f'legacy_{i}.{target}')
+
+        def work():
+            with open(src, 'wb') as f:
+                f.write(data)
+            legacy_convert(src, dst, codec_args)
+            with open(dst, 'rb') as f:
+                f.read()
+        await asyncio.to_thread(work)
+        return (time.perf_counter() - start) * 1000
+    return await asyncio.gather(*(one(i) for i in range(jobs)))
+
+
+async def run_pool(transcoder, data, target, jobs):
+    async def one():
+        start = time.perf_counter()
+        await transcoder.transcode(data, target)
+        return (time.perf_counter() - start) * 1000
+    return await asyncio.gather(*(one() for _ in range(jobs)))
+
+
+async def run_fast(transcoder, data, provider, source_format, jobs):
+    async def one():
+        start = time.perf_counter()
+        await transcoder.prepare(data, provider, source_format=source_format)
+        return (time.perf_counter() - start) * 1000
+    return await asyncio.gather(*(one() for _ in range(jobs)))
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{name:>34} {len(latencies) / elapsed:>9.1f} {p50:>9.1f} {p99:>9.1f}')
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    latencies = await coro
+    return latencies, time.perf_counter() - start
+
+
+async def main(args):
+    directory = tempfile.mkdtemp(prefix='bench_transcoder_')
+    pcm, wav, aac = make_inputs(args.seconds, directory)
+    print(f'{args.jobs} jobs submitted at once, {args.seconds}s clips, {os.cpu_count()} cpus')
+    print(f'{"":>34} {"conv/s":>9} {"p50 ms":>9} {"p99 ms":>9}')
+
+    cases = [
+        ('wav->mp3', wav, '.wav', 'mp3', {'acodec': 'libmp3lame'}),
+        ('aac->m4a (remux)', aac, '.aac', 'm4a', {'c': 'copy'}),
+    ]
+    for name, data, suffix, target, codec_args in cases:
+        report(f'{name} legacy', *await timed(run_legacy(data, suffix, target, codec_args, args.jobs, directory)))
+        for workers in args.workers:
+            transcoder = Transcoder(max_workers=workers, max_waiting=args.jobs)
+            report(f'{name} pool workers={workers}', *await timed(run_pool(transcoder, data, target, args.jobs)))
+
+    transcoder = Transcoder(max_workers=args.workers[0], max_waiting=args.jobs)
+    report('pcm->wav fast path', *await timed(run_fast(transcoder, pcm, 'whisper', 'pcm', args.jobs)))
+    report('wav passthrough', *await timed(run_fast(transcoder, wav, 'whisper', None, args.jobs)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    asyncio.run(main(parser.parse_args()))
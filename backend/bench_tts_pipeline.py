@@ -0,0 +1,86 @@
+# 流水线 tts 压测：本地假 tts 服务 + 假 llm 句子流，对比不同 look-ahead 深度的首字节时间和整段回复时间
+#
+# python bench_tts_pipeline.py
+# python bench_tts_pipeline.py --depths 1 2 3 5 --sentences 12 --tts-first-byte 0.4
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from tts_pipeline import ordered_prefetch
+
+HOST = '127.0.0.1'
+
+
+def make_fake_tts(first_byte, chunks, chunk_interval, chunk_size):
+    async def speech(request):
+        body = await request.json()
+        resp = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        await asyncio.sleep(first_byte)  # 模拟 tts 首包延迟
+        await resp.prepare(request)
+        for _ in range(chunks):
+            await resp.write(body['input'].encode('utf-8')[:1] * chunk_size)
+            await asyncio.sleep(chunk_interval)
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_post('/v1/audio/speech', speech)
+    return app
+
+
+async def fake_sentences(count, interval):
+    # 模拟 llm 按一定速度吐出句子
+    for i in range(count):
+        await asyncio.sleep(interval)
+        yield f'第{i}句话。'
+
+
+async def run_once(session, url, depth, args):
+    async def speech(sentence):
+        async with session.post(url, json={"input": sentence, "model": "tts-1", "voice": "shimmer"}) as response:
+            async for data in response.content.iter_any():
+                yield data
+
+    start = time.perf_counter()
+    first_byte = None
+    total_bytes = 0
+    async for chunk in ordered_prefetch(fake_sentences(args.sentences, args.llm_interval), speech, depth):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total_bytes += len(chunk)
+    return first_byte, time.perf_counter() - start, total_bytes
+
+
+async def main(args):
+    runner = web.AppRunner(make_fake_tts(args.tts_first_byte, args.chunks, args.chunk_interval, args.chunk_size))
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, args.port)
+    await site.start()
+    url = f'http://{HOST}:{args.port}/v1/audio/speech'
+    print(f'sentences={args.sentences}, llm interval={args.llm_interval}s, '
+          f'tts first byte={args.tts_first_byte}s, tts stream={args.chunks}x{args.chunk_interval}s')
+    print(f'{"depth":>6} {"ttfb s":>8} {"total s":>8} {"bytes":>8}')
+    try:
+        async with aiohttp.ClientSession() as session:
+            for depth in args.depths:
+                ttfb, total, nbytes = await run_once(session, url, depth, args)
+                print(f'{depth:>6} {ttfb:>8.3f} {total:>8.3f} {nbytes:>8}')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 3, 4, 6])
+    parser.add_argument('--sentences', type=int, default=10)
+    parser.add_argument('--llm-interval', type=float, default=0.15)
+    parser.add_argument('--tts-first-byte', type=float, default=0.35)
+    parser.add_argument('--chunks', type=int, default=5)
+    parser.add_argument('--chunk-interval', type=float, default=0.05)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--port', type=int, default=18013)
+    asyncio.run(main(parser.parse_args()))
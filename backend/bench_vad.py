@@ -0,0 +1,106 @@
+# vad 吞吐基准：单核每秒能判断多少个 20ms 帧
+#
+# 对比逐帧 python 循环的写法和 VoiceActivityDetector 的整批 numpy 写法，
+# 流式按 websocket 消息大小喂（每次几帧），也测一次性喂一大段（文件场景）。
+#
+# python bench_vad.py
+# python bench_vad.py --seconds 120 --message 640 2560 32000
+
+import argparse
+import time
+
+import numpy as np
+
+from vad import VoiceActivityDetector, FULL_SCALE
+
+SAMPLE_RATE = 16000
+
+
+def make_audio(seconds, rng):
+    # 一段段的“说话”（带谐波和抖动的浊音）中间夹着底噪
+    out = []
+    total = 0
+    while total < seconds * SAMPLE_RATE:
+        n = int(rng.uniform(0.3, 2.0) * SAMPLE_RATE)
+        t = np.arange(n) / SAMPLE_RATE
+        f0 = rng.uniform(100, 250)
+        voiced = np.sin(2 * np.pi * f0 * t) + 0.5 * np.sin(4 * np.pi * f0 * t)
+        out.append(voiced * rng.uniform(2000, 10000) * (1 + 0.3 * np.sin(2 * np.pi * 4 * t)))
+        gap = int(rng.uniform(0.2, 1.5) * SAMPLE_RATE)
+        out.append(rng.normal(0, 30, gap))
+        total += n + gap
+    return np.clip(np.concatenate(out), -32768, 32767).astype(np.int16).tobytes()
+
+
+class LoopVad:
+    # 逐帧算的写法，判断规则和 VoiceActivityDetector 一样
+    def __init__(self, frame_size=320, threshold_db=-45.0, zcr_max=0.35, loud_db=15.0, onset_frames=2,
+                 hangover_frames=15):
+        self.frame_size = frame_size
+        self.threshold_db = threshold_db
+        self.zcr_max = zcr_max
+        self.loud_db = loud_db
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+        self.rest = b''
+        self.run = 0
+        self.since = 1 << 30
+
+    def process(self, pcm):
+        data = self.rest + pcm
+        fb = self.frame_size * 2
+        n = len(data) // fb
+        self.rest = data[n * fb:]
+        flags = []
+        for i in range(n):
+            x = np.frombuffer(data, dtype=np.int16, count=self.frame_size, offset=i * fb).astype(np.float32)
+            db = 10 * np.log10(float(np.dot(x, x)) / (self.frame_size * FULL_SCALE * FULL_SCALE) + 1e-12)
+            signs = np.signbit(x)
+            zcr = np.count_nonzero(signs[1:] != signs[:-1]) / (self.frame_size - 1)
+            speech = db > self.threshold_db and (zcr <= self.zcr_max or db > self.threshold_db + self.loud_db)
+            self.run = self.run + 1 if speech else 0
+            self.since = 0 if self.run >= self.onset_frames else self.since + 1
+            flags.append(self.since <= self.hangover_frames)
+        return flags
+
+
+def bench(vad, audio, message, repeat):
+    best = float('inf')
+    flags = None
+    for _ in range(repeat):
+        detector = vad()
+        start = time.process_time()
+        out = []
+        for i in range(0, len(audio), message):
+            out.append(np.asarray(detector.process(audio[i:i + message])[0]
+                                  if isinstance(detector, VoiceActivityDetector)
+                                  else detector.process(audio[i:i + message]), dtype=bool))
+        best = min(best, time.process_time() - start)
+        flags = np.concatenate(out)
+    return best, flags
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    audio = make_audio(args.seconds, rng)
+    frames = len(audio) // 640
+    print(f'{args.seconds}s audio, {frames} frames of 20ms, process_time on one core')
+    print(f'{"message":>8} {"loop frames/s":>14} {"numpy frames/s":>15} {"speedup":>8} {"realtime streams":>17}')
+    for message in args.message:
+        loop_s, loop_flags = bench(LoopVad, audio, message, args.repeat)
+        vec_s, vec_flags = bench(VoiceActivityDetector, audio, message, args.repeat)
+        assert (loop_flags == vec_flags).all()
+        # 一路实时音频每秒 50 帧
+        print(f'{message:>8} {frames / loop_s:>14.0f} {frames / vec_s:>15.0f} {loop_s / vec_s:>7.1f}x '
+              f'{frames / vec_s / 50:>17.0f}')
+    speech = np.count_nonzero(vec_flags) / len(vec_flags)
+    print(f'speech frames: {speech:.0%}（gate 之后只发这部分，加上 preroll）')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=60)
+    # 20ms、80ms（aliyun 的帧）、整秒
+    parser.add_argument('--message', type=int, nargs='+', default=[640, 2560, 32000])
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
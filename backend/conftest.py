@@ -0,0 +1,28 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+# python -m pytest -q（在 backend 目录下）
+# test_*_file.py 是手动跑的转写脚本，要真的 key 和 sdk，不是单元测试
+collect_ignore = ['test_google_file.py', 'test_deepgram_file.py', 'test_openai_file.py']
+
+
+@pytest.fixture
+def stub_config(monkeypatch, tmp_path):
+    """服务模块 import 时要读 config.py（不进仓库），给一个最小的；工作目录换到临时目录，
+    模块建的 static/、任务目录都落在这里"""
+    config = types.ModuleType('config')
+    config.API_KEY = 'test'
+    config.JWT_SECRET_KEY = 'test'
+    config.PROXY_CHAT_HOST_PORT = 'http://127.0.0.1:9'
+    monkeypatch.setitem(sys.modules, 'config', config)
+    monkeypatch.chdir(tmp_path)
+    return config
+
+
+@pytest.fixture
+def run():
+    """同步的用例里跑协程：run(coro)，每次一个新的事件循环（没装 pytest-asyncio）"""
+    return asyncio.run
@@ -0,0 +1,192 @@
+# 本地假的阿里云 nls 实时转写服务，测 aliyun-stt-ws.py 的会话管理用，不识别内容，只按能量判断有没有说话。
+#
+# python fake_nls_server.py --port 18101
+#   然后 config.py 里 ALIYUN_NLS_URL = 'ws://127.0.0.1:18101/ws/v1'
+# python fake_nls_server.py --demo
+#   起一个假服务，用 nls sdk 分别跑“每次停顿都关会话”和 WarmTranscriber，对比重连次数和耗时
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from aiohttp import web, WSMsgType
+
+BYTES_PER_MS = 32  # 16k 16bit
+
+
+def message(name, task_id, payload=None, status=20000000, status_text='Gateway:SUCCESS:Success.'):
+    msg = {'header': {'namespace': 'SpeechTranscriber', 'name': name, 'status': status,
+                      'message_id': uuid.uuid4().hex, 'task_id': task_id, 'status_text': status_text}}
+    if payload is not None:
+        msg['payload'] = payload
+    return json.dumps(msg, ensure_ascii=False)
+
+
+class FakeNlsServer:
+    def __init__(self, start_delay=0.3, idle_timeout=10, max_session=0, sentence_silence_ms=800):
+        self.start_delay = start_delay  # 模拟建连 + StartTranscription 的往返
+        self.idle_timeout = idle_timeout  # 真服务 10 秒收不到音频就 IDLE_TIMEOUT
+        self.max_session = max_session  # >0 时会话到时间服务端主动关
+        self.sentence_silence_ms = sentence_silence_ms
+        self.counters = {'connections': 0, 'audio_bytes': 0, 'sentences': 0, 'idle_timeouts': 0}
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.counters['connections'] += 1
+        start = await ws.receive()
+        if start.type != WSMsgType.TEXT:
+            await ws.close()
+            return ws
+        task_id = json.loads(start.data)['header']['task_id']
+        await asyncio.sleep(self.start_delay)
+        await ws.send_str(message('TranscriptionStarted', task_id, {'session_id': uuid.uuid4().hex}))
+
+        started_at = time.monotonic()
+        index = 0
+        speech_ms = silence_ms = 0
+        in_sentence = False
+
+        async def sentence_end():
+            nonlocal index, speech_ms, in_sentence
+            self.counters['sentences'] += 1
+            await ws.send_str(message('SentenceEnd', task_id, {
+                'index': index, 'time': int((time.monotonic() - started_at) * 1000),
+                'result': f'第{index}句，{speech_ms}毫秒。', 'confidence': 0.9}))
+            speech_ms = 0
+            in_sentence = False
+
+        while True:
+            timeout = self.idle_timeout
+            if self.max_session:
+                timeout = min(timeout, max(0.0, started_at + self.max_session - time.monotonic()))
+            try:
+                msg = await ws.receive(timeout=timeout)
+            except asyncio.TimeoutError:
+                if self.max_session and time.monotonic() - started_at >= self.max_session:
+                    await ws.send_str(message('TaskFailed', task_id, status=41010105,
+                                              status_text='Gateway:MAX_SESSION_TIME'))
+                else:
+                    self.counters['idle_timeouts'] += 1
+                    await ws.send_str(message('TaskFailed', task_id, status=40000004,
+                                              status_text='Gateway:IDLE_TIMEOUT:Websocket session is idle for too long time'))
+                break
+            if msg.type == WSMsgType.BINARY:
+                self.counters['audio_bytes'] += len(msg.data)
+                ms = len(msg.data) // BYTES_PER_MS
+                if msg.data.strip(b'\0'):
+                    if not in_sentence:
+                        index += 1
+                        in_sentence = True
+                        await ws.send_str(message('SentenceBegin', task_id, {'index': index, 'time': 0}))
+                    silence_ms = 0
+                    before = speech_ms
+                    speech_ms += ms
+                    if speech_ms // 500 > before // 500:
+                        await ws.send_str(message('TranscriptionResultChanged', task_id, {
+                            'index': index, 'result': f'说了{speech_ms}毫秒', 'confidence': 0.9}))
+                elif in_sentence:
+                    silence_ms += ms
+                    if silence_ms >= self.sentence_silence_ms:
+                        await sentence_end()
+            elif msg.type == WSMsgType.TEXT:
+                if json.loads(msg.data)['header']['name'] == 'StopTranscription':
+                    if in_sentence:
+                        await sentence_end()
+                    await ws.send_str(message('TranscriptionCompleted', task_id))
+                    break
+            else:
+                break
+        await ws.close()
+        return ws
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/ws/v1', self.handle)
+        return app
+
+
+async def serve(server, port):
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def demo(args):
+    # 说 1.5 秒，停 3 秒，重复几次，最后停 12 秒（超过服务端的 idle 超时）再说一句
+    import nls
+    from concurrent.futures import ThreadPoolExecutor
+    from nls_session import SessionStats, WarmTranscriber
+
+    server = FakeNlsServer(start_delay=args.start_delay, idle_timeout=args.idle_timeout)
+    runner = await serve(server, args.port)
+    url = f'ws://127.0.0.1:{args.port}/ws/v1'
+    frame = b'\1\0' * 1280  # 80ms
+    frame_sec = len(frame) / BYTES_PER_MS / 1000
+    pauses = [3, 3, 3, 12]
+
+    for mode in ('stop-on-pause', 'warm'):
+        finals = []
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        def create(on_close):
+            def closed(*args):
+                on_close()
+            return nls.NlsSpeechTranscriber(
+                url=url, token='fake', appkey='fake',
+                on_sentence_end=lambda msg, *a: finals.append(json.loads(msg)['payload']['result']),
+                on_close=closed)
+
+        stats = SessionStats()
+        session = WarmTranscriber(create, executor, stats, start_kwargs={'aformat': 'pcm'}, name=mode,
+                                  idle_window=30 if mode == 'warm' else 1, flush_after=1,
+                                  keepalive_interval=args.idle_timeout / 2)
+        stalled = 0.0
+        begin = time.perf_counter()
+        for pause in pauses + [0]:
+            for _ in range(int(1.5 / frame_sec)):
+                t = time.perf_counter()
+                await session.send(frame)
+                stalled += max(0.0, time.perf_counter() - t - 0.05)
+                await asyncio.sleep(frame_sec)
+            if mode == 'stop-on-pause':
+                # 原来 aliyun-stt-ws.py 的做法：停顿 1 秒就 stop
+                await asyncio.sleep(1)
+                await session.stop()
+                await asyncio.sleep(max(0, pause - 1))
+            else:
+                await asyncio.sleep(pause)
+        await asyncio.sleep(1.5)
+        await session.close()
+        executor.shutdown()
+        print(f'{mode:>14}: {time.perf_counter() - begin:.1f}s, finals={len(finals)}, '
+              f'audio stalled {stalled * 1000:.0f}ms waiting for sessions, stats={stats.stats()}')
+    print(f'server: {server.counters}')
+    await runner.cleanup()
+
+
+async def main(args):
+    if args.demo:
+        await demo(args)
+        return
+    server = FakeNlsServer(start_delay=args.start_delay, idle_timeout=args.idle_timeout,
+                           max_session=args.max_session)
+    await serve(server, args.port)
+    logging.info(f'fake nls listening on ws://127.0.0.1:{args.port}/ws/v1')
+    while True:
+        await asyncio.sleep(3600)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=18101)
+    parser.add_argument('--start-delay', type=float, default=0.3)
+    parser.add_argument('--idle-timeout', type=float, default=10)
+    parser.add_argument('--max-session', type=float, default=0)
+    parser.add_argument('--demo', action='store_true')
+    asyncio.run(main(parser.parse_args()))
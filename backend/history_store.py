@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+SUFFIX = '.jsonl'
+LEGACY_SUFFIX = '.json'
+INDEX_SUFFIX = '.idx'
+
+
+def valid_date(date):
+    """YYYYMMDD，只有 ascii 数字；日期会拼进文件路径，进来的都要先过这里"""
+    return len(date) == 8 and date.isascii() and date.isdigit()
+
+
+def parse_cursor(cursor):
+    """'YYYYMMDD:行号' -> (date, pos)，格式不对抛 ValueError"""
+    date, _, pos = cursor.partition(':')
+    if not valid_date(date) or not (pos.isascii() and pos.isdigit()):
+        raise ValueError(f'invalid cursor {cursor}')
+    return date, int(pos)
+
+
+@dataclass
+class HistoryPage:
+    order: str
+    spans: List[Tuple[str, int, int]] = field(default_factory=list)  # (date, 起始行, 结束行)，不含结束行
+    next_cursor: Optional[str] = None
+
+
+class HistoryStore:
+    """聊天记录按天追加写 JSON Lines：static/<phone>/<ym>/<date>.jsonl，一行一条消息。
+
+    每条消息只追加一行，不再读出整天的文件再整体重写；同一个用户的写入用一把 asyncio.Lock 串行，
+    文件 I/O 都交给线程（asyncio.to_thread），不阻塞事件循环。
+    每个 .jsonl 旁边有一个 .idx，按行存每条消息结束位置的字节偏移（8 字节一条），
+    分页时只看 .idx 就能算出要读哪几段字节，不用解析整天的消息。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._locks = defaultdict(asyncio.Lock)
+
+    def day_path(self, phone, day: datetime, suffix=SUFFIX):
+        return self._day_file(phone, day.strftime("%Y%m%d"), suffix)
+
+    def _day_file(self, phone, date, suffix=SUFFIX):
+        return os.path.join(self.root, phone, date[:6], date + suffix)
+
+    async def append(self, phone, sentbyme, content, now: datetime = None):
+        now = now or datetime.now()
+        record = {'time': now.strftime('%Y-%m-%d %H:%M:%S'), 'sentbyme': sentbyme, 'content': content}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        file_path = self.day_path(phone, now)
+        async with self._locks[phone]:
+            # 整个追加（建目录、写 .jsonl、核对并写 .idx）一次交给线程，不在事件循环里做文件操作
+            await asyncio.to_thread(self._append, file_path, line)
+        return record
+
+    def _append(self, file_path, line):
+        index_path = file_path[:-len(SUFFIX)] + INDEX_SUFFIX
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # 没有 .idx 的旧文件不在这里补，第一次分页读的时候整体重建
+        track_index = os.path.exists(index_path) or not os.path.exists(file_path)
+        with open(file_path, 'ab') as f:
+            f.write(line)
+            end = f.tell()
+        if not track_index:
+            return
+        if self._index_end(index_path) == end - len(line):
+            with open(index_path, 'ab') as f:
+                f.write(array('Q', [end]).tobytes())
+        else:
+            # 上次写完 .jsonl 没来得及写 .idx 进程就退出了，.idx 对不上，整体重建
+            logging.warning(f'{index_path} out of date, rebuild')
+            os.remove(index_path)
+            self._index(file_path)
+
+    @staticmethod
+    def _index_end(index_path):
+        """.idx 里最后一条的偏移，没有文件是 0，最后一条写了一半返回 None"""
+        if not os.path.exists(index_path):
+            return 0
+        size = os.path.getsize(index_path)
+        if size % array('Q').itemsize:
+            return None
+        if not size:
+            return 0
+        with open(index_path, 'rb') as f:
+            f.seek(size - array('Q').itemsize)
+            return array('Q', f.read()).pop()
+
+    # ---------- 分页 ----------
+
+    def _index(self, file_path, repair=True):
+        """读 .idx；落后于 .jsonl（旧文件、写到一半进程退出）时从最后一个偏移往后扫描补齐，
+        repair=False 时只在内存里补，不写回文件（不持有用户锁的时候用）"""
+        index_path = file_path[:-len(SUFFIX)] + INDEX_SUFFIX
+        ends = array('Q')
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            ends.frombytes(data[:len(data) - len(data) % ends.itemsize])
+        size = os.path.getsize(file_path)
+        last = ends[-1] if ends else 0
+        if size > last:
+            added = array('Q')
+            with open(file_path, 'rb') as f:
+                f.seek(last)
+                pos = last
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    pos += len(line)
+                    added.append(pos)
+            if added and repair:
+                with open(index_path, 'ab' if ends else 'wb') as f:
+                    f.write(added.tobytes())
+            ends.extend(added)
+        return ends
+
+    def _legacy(self, phone, date):
+        legacy_path = self._day_file(phone, date, LEGACY_SUFFIX)
+        if not os.path.exists(legacy_path):
+            return []
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _count(self, phone, date):
+        count = len(self._legacy(phone, date))
+        file_path = self._day_file(phone, date)
+        if os.path.exists(file_path):
+            count += len(self._index(file_path))
+        return count
+
+    def _days(self, phone, start, end):
+        user_dir = os.path.join(self.root, phone)
+        if not os.path.isdir(user_dir):
+            return []
+        days = set()
+        for ym in os.listdir(user_dir):
+            if not (len(ym) == 6 and ym.isdigit() and start[:6] <= ym <= end[:6]):
+                continue
+            for filename in os.listdir(os.path.join(user_dir, ym)):
+                date, _, suffix = filename.partition('.')
+                if '.' + suffix in (SUFFIX, LEGACY_SUFFIX) and len(date) == 8 and start <= date <= end:
+                    days.add(date)
+        return sorted(days)
+
+    def _plan(self, phone, start, end, cursor, limit, order):
+        page = HistoryPage(order)
+        days = self._days(phone, start, end)
+        if order == 'desc':
+            days.reverse()
+        cursor_date, cursor_pos = cursor if cursor else (None, None)
+        remaining = limit
+        for i, date in enumerate(days):
+            if cursor_date is not None and (date < cursor_date if order == 'asc' else date > cursor_date):
+                continue
+            count = self._count(phone, date)
+            at_cursor = date == cursor_date
+            if order == 'asc':
+                first = min(cursor_pos, count) if at_cursor else 0
+                last = count if remaining is None else min(count, first + remaining)
+                next_pos, has_more = last, last < count
+            else:
+                last = min(cursor_pos, count) if at_cursor else count
+                first = 0 if remaining is None else max(0, last - remaining)
+                next_pos, has_more = first, first > 0
+            if first < last:
+                page.spans.append((date, first, last))
+                if remaining is not None:
+                    remaining -= last - first
+            if remaining == 0:
+                if has_more or i + 1 < len(days):
+                    page.next_cursor = f'{date}:{next_pos}'
+                break
+        return page
+
+    async def page(self, phone, start, end, cursor=None, limit=None, order='asc'):
+        """start/end 是 YYYYMMDD（含两端），cursor 是上一页返回的 next_cursor"""
+        if cursor is not None:
+            cursor = parse_cursor(cursor)
+        async with self._locks[phone]:
+            # 补 .idx 要写文件，和 append 互斥
+            return await asyncio.to_thread(self._plan, phone, start, end, cursor, limit, order)
+
+    def _read_span(self, phone, date, first, last):
+        legacy = self._legacy(phone, date)
+        lines = [json.dumps(msg, ensure_ascii=False) for msg in legacy[first:last]]
+        first, last = max(0, first - len(legacy)), max(0, last - len(legacy))
+        if first < last:
+            file_path = self._day_file(phone, date)
+            ends = self._index(file_path, repair=False)
+            begin = ends[first - 1] if first else 0
+            with open(file_path, 'rb') as f:
+                f.seek(begin)
+                data = f.read(ends[last - 1] - begin)
+            lines.extend(line.decode('utf-8') for line in data.split(b'\n')[:-1])
+        return lines
+
+    async def iter_page(self, phone, page: HistoryPage):
+        """按页产出每条消息原始的 JSON 文本，一天一段地读，不把整页拼在内存里"""
+        for date, first, last in page.spans:
+            lines = await asyncio.to_thread(self._read_span, phone, date, first, last)
+            if page.order == 'desc':
+                lines.reverse()
+            for line in lines:
+                yield line
+
+
+def migrate(root):
+    """一次性把旧的 <date>.json（整个数组）转成 <date>.jsonl，旧文件改名为 .json.migrated 保留。
+    迁移时先停掉 web 服务，避免和在线追加同时写一个文件。"""
+    migrated = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.endswith(LEGACY_SUFFIX):
+                continue
+            stem = filename[:-len(LEGACY_SUFFIX)]
+            if not (len(stem) == 8 and stem.isdigit()):
+                continue
+            legacy_path = os.path.join(dirpath, filename)
+            target_path = os.path.join(dirpath, stem + SUFFIX)
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                msgs = json.load(f)
+            existing = ''
+            if os.path.exists(target_path):
+                # 迁移前新代码已经写进来的消息排在旧消息后面
+                with open(target_path, 'r', encoding='utf-8') as f:
+                    existing = f.read()
+            tmp_path = target_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for msg in msgs:
+                    f.write(json.dumps(msg, ensure_ascii=False) + '\n')
+                f.write(existing)
+            os.replace(tmp_path, target_path)
+            # 偏移全变了，旧的 .idx 作废，下次分页时重建
+            index_path = os.path.join(dirpath, stem + INDEX_SUFFIX)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            os.rename(legacy_path, legacy_path + '.migrated')
+            migrated += 1
+            logging.info(f'migrated {legacy_path}, messages={len(msgs)}')
+    return migrated
+
+
+if __name__ == '__main__':
+    # python history_store.py migrate [static]
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('usage: python history_store.py migrate [static_dir]')
+        sys.exit(1)
+    count = migrate(sys.argv[2] if len(sys.argv) > 2 else 'static')
+    print(f'migrated {count} files')
@@ -0,0 +1,87 @@
+import logging
+
+import aiohttp
+
+
+class HttpPool:
+    """进程内共享的 aiohttp 连接池，跟随 app 的 startup/shutdown 创建和关闭。
+
+    每个上游 host 限制连接数，连接 keep-alive 复用，DNS 结果缓存，
+    并通过 TraceConfig 统计新建连接和复用连接的次数。
+    """
+
+    def __init__(self, limit=100, limit_per_host=20, keepalive_timeout=60, ttl_dns_cache=300,
+                 connect_timeout=10, sock_read_timeout=60, total_timeout=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=sock_read_timeout)
+        self._session = None
+        self.counters = {
+            'requests': 0,
+            'request_errors': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+        }
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def inc(session, ctx, params):
+                self.counters[name] += 1
+            return inc
+
+        trace.on_request_start.append(counter('requests'))
+        trace.on_request_exception.append(counter('request_errors'))
+        trace.on_connection_create_end.append(counter('connections_created'))
+        trace.on_connection_reuseconn.append(counter('connections_reused'))
+        trace.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                              trace_configs=[self._trace_config()])
+        logging.info(f'http pool started, limit={self.limit}, limit_per_host={self.limit_per_host}')
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logging.info(f'http pool closed, stats={self.stats()}')
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # 没走 startup 钩子（比如脚本里直接调用）时按需创建
+            await self.start()
+        return self._session
+
+    def stats(self):
+        stats = dict(self.counters)
+        connected = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_rate'] = round(stats['connections_reused'] / connected, 4) if connected else 0.0
+        connector = self._session.connector if self._session is not None else None
+        if connector is not None and not connector.closed:
+            # aiohttp 没有公开的池状态接口，这里读内部字段，取不到就不报
+            acquired = getattr(connector, '_acquired', None)
+            idle = getattr(connector, '_conns', None)
+            if acquired is not None:
+                stats['in_use'] = len(acquired)
+            if idle is not None:
+                stats['idle'] = sum(len(conns) for conns in idle.values())
+            stats['limit'] = connector.limit
+            stats['limit_per_host'] = connector.limit_per_host
+        return stats
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+_END = object()
+
+
+class InflightReplies:
+    """正在回传的回复，按 message_id 登记，可以随时取消。
+
+    run() 把回复的生成器放到单独的任务里跑，经一个有界队列交给 StreamingResponse：
+    客户端断开时 StreamingResponse 关掉 run() 的生成器，任务立即取消，上游的 chat / tts 请求跟着断开；
+    cancel() 给客户端打断时用，同样取消任务，已经排队的数据发完后响应正常结束。
+    """
+
+    def __init__(self, max_buffer=16):
+        self.max_buffer = max_buffer
+        self._replies = {}  # message_id -> (user, task)
+        self.counters = {'started': 0, 'completed': 0, 'cancelled': 0, 'disconnected': 0, 'errors': 0}
+
+    def __contains__(self, message_id):
+        return message_id in self._replies
+
+    def __len__(self):
+        return len(self._replies)
+
+    async def run(self, message_id, user, source):
+        queue = asyncio.Queue(self.max_buffer)
+
+        async def pump():
+            try:
+                async for chunk in source:
+                    await queue.put(chunk)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.counters['errors'] += 1
+                logging.exception(f'message_id={message_id}, reply failed')
+            finally:
+                await source.aclose()
+                # 取消时队列可能是满的，不能再 await
+                try:
+                    queue.put_nowait(_END)
+                except asyncio.QueueFull:
+                    pass
+
+        previous = self._replies.get(message_id)
+        if previous is not None:
+            previous[1].cancel()
+        task = asyncio.create_task(pump())
+        self._replies[message_id] = (user, task)
+        self.counters['started'] += 1
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    break
+                yield chunk
+                if task.cancelled() and queue.empty():
+                    break
+            if not task.cancelled():
+                self.counters['completed'] += 1
+        finally:
+            if not task.done():
+                task.cancel()
+                self.counters['disconnected'] += 1
+                logging.info(f'message_id={message_id}, client gone, reply cancelled')
+            await asyncio.gather(task, return_exceptions=True)
+            if self._replies.get(message_id, (None, None))[1] is task:
+                del self._replies[message_id]
+
+    def cancel(self, message_id, user=None):
+        """取消 message_id 的回复，user 不为空时只能取消自己的；返回是否真的取消了"""
+        entry = self._replies.get(message_id)
+        if entry is None or (user is not None and entry[0] != user):
+            return False
+        if entry[1].done():
+            return False
+        entry[1].cancel()
+        self.counters['cancelled'] += 1
+        logging.info(f'message_id={message_id}, reply cancelled by client')
+        return True
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['inflight'] = len(self._replies)
+        return stats
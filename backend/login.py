@@ -6,23 +6,24 @@ from datetime import datetime, timedelta
 import jwt
 import random
 import string
-from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import RpcRequest
 import logging
 import os
 
 import config
+from aliyun_credentials import get_credentials
 
 router = APIRouter()
 
-aliyun_client = AcsClient(config.ALIYUN_APP_ID, config.ALIYUN_APP_KEY, 'cn-hangzhou')
+# 和 stt 共用一份 AccessKey，调用在线程里跑，不阻塞事件循环
+aliyun_credentials = get_credentials()
 
 verification_codes = {}
 
 def generate_verification_code(length=6):
     return ''.join(random.choices(string.digits, k=length))
 
-def send_sms(phone_number, code):
+async def send_sms(phone_number, code):
     request = RpcRequest('Dysmsapi', '2017-05-25', 'SendSms')
     request.set_accept_format('json')
     request.set_method('POST')
@@ -34,7 +35,8 @@ def send_sms(phone_number, code):
     request.add_query_param('SignName', config.ALIYUN_SMS_SIGN_NAME)
     request.add_query_param('TemplateCode', config.ALIYUN_SMS_TEMPLATE_CODE)
     request.add_query_param('TemplateParam', f'{{"code":"{code}"}}')
-    response = aliyun_client.do_action_with_exception(request)
+    # 发短信不幂等，不重试
+    response = await aliyun_credentials.call(request, 'cn-hangzhou')
     return response
 
 class PhoneNumber(BaseModel):
@@ -47,7 +49,7 @@ async def send_code(data: PhoneNumber):
     verification_codes[phone] = code
     try:
         logging.info(f'send_sms({phone}, {code})')
-        send_sms(phone, code)
+        await send_sms(phone, code)
     except Exception as e:
         logging.exception('发送短信验证码失败')
         raise HTTPException(status_code=500, detail=f"发送短信验证码失败: {e}")
@@ -98,6 +100,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_sche
         raise HTTPException(status_code=401, detail="Invalid token")
     
 
+def verify_token_optional(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))):
+    """带了 token 就和 verify_token 一样校验，返回手机号；没带返回 None"""
+    if credentials is None:
+        return None
+    return verify_token(credentials)
+
+
 class ErrorRequest(BaseModel):
     error: str
 
@@ -0,0 +1,255 @@
+import bisect
+import contextvars
+import hmac
+import json
+import logging
+import time
+from collections import deque
+
+from fastapi import HTTPException, Request
+
+# 进程内的指标和按轮次的耗时追踪，/metrics 按 prometheus 的文本格式输出，不依赖 prometheus_client。
+#
+# 模式（config.py 里 METRICS_MODE，各服务启动时 REGISTRY.configure()）：
+#   off   所有记录直接返回
+#   light 只记计数器和直方图（一次 bisect 加几次加法），线上常开
+#   full  另外每一轮 / 每句话的各阶段耗时打一行日志，最近的留在内存里查
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+MODES = ('off', 'light', 'full')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def lines(self):
+        return []
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def lines(self):
+        return [f'{self.name}{_labels(self.labelnames, key)} {value}' for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [每个桶（不累计）的计数..., +Inf 桶, sum]
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def lines(self):
+        lines = []
+        for key, counts in self._values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, (("le", bound),))} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {round(counts[-1], 6)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {total}')
+        return lines
+
+
+class Gauge(_Metric):
+    """取值时调用 fn()：返回一个数，或者 {标签值元组: 数}"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, labelnames=(), fn=None):
+        super().__init__(registry, name, help, labelnames)
+        self.fn = fn
+
+    def lines(self):
+        try:
+            value = self.fn()
+        except Exception:
+            logging.exception(f'gauge {self.name}')
+            return []
+        if isinstance(value, dict):
+            return [f'{self.name}{_labels(self.labelnames, key)} {v}' for key, v in value.items()]
+        return [f'{self.name} {value}']
+
+
+class Registry:
+    def __init__(self, mode='light'):
+        self._metrics = {}
+        self.configure(mode)
+
+    def configure(self, mode):
+        if mode not in MODES:
+            logging.warning(f'unknown METRICS_MODE {mode}, use light')
+            mode = 'light'
+        self.mode = mode
+        self.enabled = mode != 'off'
+        self.tracing = mode == 'full'
+
+    def _get(self, cls, name, *args, **kwargs):
+        # 同名重复声明返回同一个，模块被多个服务 import 也没关系
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(self, name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name, help, fn, labelnames=()) -> Gauge:
+        gauge = self._get(Gauge, name, help, labelnames, fn)
+        gauge.fn = fn
+        return gauge
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LOCAL_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+
+def scrape_allowed(request, token=None):
+    """/metrics 的访问控制：配了 token（config.py 里 METRICS_TOKEN）要带 Authorization: Bearer {token}，
+    没配只允许本机抓取"""
+    if token:
+        authorization = request.headers.get('authorization', '')
+        return hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    return request.client is not None and request.client.host in LOCAL_HOSTS
+
+
+def scrape_guard(token=None):
+    """统计接口用的 FastAPI 依赖，和 /metrics 同样的访问控制：
+    @app.get('/api_12/xxx_stats', dependencies=[Depends(stats_guard)])，stats_guard = scrape_guard(METRICS_TOKEN)"""
+    async def check(request: Request):
+        if not scrape_allowed(request, token):
+            raise HTTPException(status_code=403, detail="Forbidden")
+    return check
+
+# 一轮对话（收到用户的话到回复说完）的指标，think_and_reply 和语音会话共用，api 标签区分
+TURN_FIRST_TEXT = REGISTRY.histogram('voice_turn_first_text_seconds',
+                                     'From the user message to the first reply sentence', ('api', 'speculative'))
+TURN_FIRST_AUDIO = REGISTRY.histogram('voice_turn_first_audio_seconds',
+                                      'From the user message to the first reply audio byte', ('api', 'speculative'))
+TURN_SECONDS = REGISTRY.histogram('voice_turn_seconds', 'Whole reply duration', ('api',),
+                                  buckets=(1, 2, 5, 10, 20, 30, 60, 120))
+TURNS = REGISTRY.counter('voice_turns_total', 'Reply turns by outcome', ('api', 'outcome'))
+
+
+# ---------------------------------- 追踪
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """一轮（或一句话）的各阶段耗时，trace_id 用 message_id，在同一轮的各个阶段里都一样"""
+
+    __slots__ = ('trace_id', 'kind', 'user', 'started', 'stages')
+
+    def __init__(self, trace_id, kind, user=None):
+        self.trace_id = trace_id
+        self.kind = kind
+        self.user = user
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def mark(self, stage):
+        # 同一阶段只记第一次
+        if stage not in self.stages:
+            self.stages[stage] = round(self.elapsed() * 1000, 1)
+
+
+class Tracer:
+    def __init__(self, registry: Registry = REGISTRY, recent=200):
+        self.registry = registry
+        self._recent = deque(maxlen=recent)
+
+    def start(self, trace_id, kind, user=None, bind=True):
+        """开始一轮；bind=True 时设为当前任务的 trace，之后创建的子任务都能用 mark() 记阶段。
+        不是 full 模式时返回 None，mark() 什么也不做"""
+        if not self.registry.tracing:
+            return None
+        trace = Trace(trace_id, kind, user)
+        if bind:
+            _current.set(trace)
+        return trace
+
+    def finish(self, trace, outcome='completed'):
+        if trace is None:
+            return
+        trace.mark(outcome)
+        if self.registry.tracing:
+            record = {'trace_id': trace.trace_id, 'kind': trace.kind, 'user': trace.user, 'outcome': outcome,
+                      'stages_ms': trace.stages}
+            self._recent.append(record)
+            logging.info(f'trace {json.dumps(record, ensure_ascii=False)}')
+
+    def recent(self, trace_id=None):
+        return [record for record in self._recent if trace_id is None or record['trace_id'] == trace_id]
+
+
+TRACER = Tracer()
+
+
+def current_trace():
+    return _current.get()
+
+
+def mark(stage):
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(stage)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class SessionStats:
+    """进程内所有 nls 会话共用的计数和启动耗时"""
+
+    def __init__(self, recent=200):
+        self.counters = {
+            'starts': 0,             # 建连 + StartTranscription 的次数
+            'cold_starts': 0,        # 有音频要发时会话没准备好，只能等
+            'background_starts': 0,  # 会话被服务端关掉后在后台提前重连
+            'start_failures': 0,
+            'warm_sends': 0,         # 音频到的时候会话已经是热的
+            'flushes': 0,            # 停顿后补一段静音让服务端出句末结果
+            'keepalive_frames': 0,
+            'idle_stops': 0,
+            'server_closes': 0,
+        }
+        self._start_ms = deque(maxlen=recent)
+        self.start_ms_max = 0.0
+
+    def record_start(self, ms):
+        self._start_ms.append(ms)
+        self.start_ms_max = max(self.start_ms_max, ms)
+
+    def stats(self):
+        stats = dict(self.counters)
+        recent = sorted(self._start_ms)
+        if recent:
+            stats['start_ms'] = {
+                'last': round(self._start_ms[-1], 1),
+                'avg': round(sum(recent) / len(recent), 1),
+                'p50': round(recent[len(recent) // 2], 1),
+                'p95': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1),
+                'max': round(self.start_ms_max, 1),
+            }
+        return stats
+
+
+class WarmTranscriber:
+    """一个 websocket 连接的 nls 实时转写会话，说话的间隙不关，一直保持热的。
+
+    - 停顿超过 flush_after 秒：补 flush_bytes 的静音，服务端据此断句、推 SentenceEnd
+      （原来是直接 stop 会话来拿最后一句）
+    - 之后每 keepalive_interval 秒补一小段静音，免得服务端因为收不到音频把会话关掉
+    - 停顿超过 idle_window 秒才真正 stop，下次说话再重新建连
+    - 还在 idle_window 内会话被服务端关了（超时、出错），马上在后台重连，用户开口时已经连好
+
+    create(on_close) 在线程里调用，返回一个新的 NlsSpeechTranscriber，on_close 要挂到它的关闭回调上；
+    所有 sdk 的阻塞调用都走 executor（单线程，保证发送顺序）。
+    """
+
+    def __init__(self, create, executor, stats: SessionStats, start_kwargs=None, idle_window=30,
+                 flush_after=1.0, flush_bytes=32000, keepalive_interval=5.0, keepalive_bytes=3200, name=''):
+        self.create = create
+        self.executor = executor
+        self.stats = stats
+        self.start_kwargs = start_kwargs or {}
+        self.idle_window = idle_window
+        self.flush_after = flush_after
+        self.flush_silence = bytes(flush_bytes)
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_silence = bytes(keepalive_bytes)
+        self.name = name
+        self.sr = None
+        self.ready = False
+        self._generation = 0
+        self._starting = None
+        self._keepalive_task = None
+        self._closed = False
+        self._flushed = True
+        self.last_audio = 0.0
+        self.last_send = 0.0
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        self._generation += 1
+        generation = self._generation
+
+        def on_close(*args):
+            # sdk 的线程里回调
+            loop.call_soon_threadsafe(self._on_close, generation)
+
+        start = time.perf_counter()
+        try:
+            sr = await self._run(self.create, on_close)
+            await self._run(lambda: sr.start(**self.start_kwargs))
+        except Exception:
+            self.stats.counters['start_failures'] += 1
+            raise
+        ms = (time.perf_counter() - start) * 1000
+        self.stats.counters['starts'] += 1
+        self.stats.record_start(ms)
+        logging.info(f'{self.name} - nls session started in {ms:.0f}ms')
+        if generation != self._generation or self._closed:
+            # 启动期间连接已经关了
+            await self._run(sr.shutdown)
+            return
+        self.sr = sr
+        self.ready = True
+        self.last_send = time.monotonic()
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    def _start_task(self):
+        if self._starting is None or self._starting.done():
+            self._starting = asyncio.create_task(self._start())
+        return self._starting
+
+    def _on_close(self, generation):
+        if generation != self._generation or not self.ready:
+            return  # 之前那个会话的关闭回调，或者是自己 stop 的
+        self.ready = False
+        self.sr = None
+        self.stats.counters['server_closes'] += 1
+        logging.info(f'{self.name} - nls session closed by server')
+        if not self._closed and time.monotonic() - self.last_audio < self.idle_window:
+            self.stats.counters['background_starts'] += 1
+            self._start_task().add_done_callback(self._log_start_failure)
+
+    def _log_start_failure(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f'{self.name} - nls background start failed: {task.exception()!r}')
+
+    async def send(self, frame):
+        if self.ready:
+            self.stats.counters['warm_sends'] += 1
+        else:
+            if self._starting is None or self._starting.done():
+                self.stats.counters['cold_starts'] += 1
+            await self._start_task()
+        self.last_audio = self.last_send = time.monotonic()
+        self._flushed = False
+        if self.sr is not None:
+            await self._run(self.sr.send_audio, frame)
+
+    async def end_utterance(self):
+        """vad 判断一句话说完了：马上补静音让服务端断句，不用等 flush_after"""
+        if self.ready and not self._flushed:
+            self._flushed = True
+            self.stats.counters['flushes'] += 1
+            await self._send_silence(self.flush_silence)
+
+    async def _send_silence(self, silence):
+        sr = self.sr
+        if sr is None:
+            return
+        self.last_send = time.monotonic()
+
+        def send():
+            # 和正常音频一样按小帧发
+            step = len(self.keepalive_silence)
+            for i in range(0, len(silence), step):
+                sr.send_audio(silence[i:i + step])
+
+        await self._run(send)
+
+    async def _keepalive(self):
+        tick = min(self.flush_after, self.keepalive_interval) / 2
+        while not self._closed:
+            await asyncio.sleep(tick)
+            if not self.ready:
+                continue
+            now = time.monotonic()
+            try:
+                if now - self.last_audio >= self.idle_window:
+                    self.stats.counters['idle_stops'] += 1
+                    logging.info(f'{self.name} - nls session idle for {now - self.last_audio:.0f}s, stop')
+                    await self.stop()
+                elif not self._flushed and now - self.last_audio >= self.flush_after:
+                    self._flushed = True
+                    self.stats.counters['flushes'] += 1
+                    await self._send_silence(self.flush_silence)
+                elif now - self.last_send >= self.keepalive_interval:
+                    self.stats.counters['keepalive_frames'] += 1
+                    await self._send_silence(self.keepalive_silence)
+            except Exception:
+                logging.exception(f'{self.name} - nls keepalive')
+
+    async def stop(self):
+        """结束当前会话（服务端会推完剩下的结果），下次 send 时重新建连"""
+        self._generation += 1
+        sr, self.sr, self.ready = self.sr, None, False
+        if sr is not None:
+            await self._run(sr.stop)
+
+    async def close(self):
+        self._closed = True
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        await self.stop()
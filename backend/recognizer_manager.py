@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """带计数的线程池：排队中、执行中、已完成的任务数和每个任务的排队耗时"""
+
+    def __init__(self, max_workers, thread_name_prefix=''):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_wait = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        submitted_at = time.monotonic()
+        with self._stats_lock:
+            self.queued += 1
+
+        def run():
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+                self.max_queue_wait = max(self.max_queue_wait, time.monotonic() - submitted_at)
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                with self._stats_lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return super().submit(run)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_workers': self._max_workers,
+                'threads': len(self._threads),
+                'queue_depth': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'max_queue_wait': round(self.max_queue_wait, 3),
+            }
+
+
+class CapacityError(Exception):
+    pass
+
+
+class RecognizerManager:
+    """进程内所有流式识别共用的管理器。
+
+    每个 websocket 连接先 admit() 占一个名额，断开时 release()；同时最多 max_streams 个连接，
+    满了之后最多 max_waiting 个新连接排队等 admit_timeout 秒，再多或等超时就抛 CapacityError。
+    一个连接同一时刻最多只有一个 streaming_recognize 在跑，所以线程池也只开 max_streams 个线程，
+    线程数不会跟着连接数涨。
+    """
+
+    def __init__(self, max_streams=50, max_waiting=10, admit_timeout=5):
+        self.max_streams = max_streams
+        self.max_waiting = max_waiting
+        self.admit_timeout = admit_timeout
+        self.executor = InstrumentedExecutor(max_streams, thread_name_prefix='recognize')
+        self._slots = None
+        self.connections = 0
+        self.waiting = 0
+        self.active_streams = 0
+        self.counters = {'admitted': 0, 'rejected': 0, 'timeouts': 0, 'streams': 0}
+
+    async def admit(self):
+        if self._slots is None:
+            # 在事件循环里再建，兼容 python 3.9 以前 Semaphore 绑定创建时 loop 的行为
+            self._slots = asyncio.Semaphore(self.max_streams)
+        # waiting 包括还没拿到名额的，同步计数，不依赖 Semaphore 的状态
+        if self.connections + self.waiting >= self.max_streams + self.max_waiting:
+            self.counters['rejected'] += 1
+            raise CapacityError(f'too many connections, active={self.connections}, waiting={self.waiting}')
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.admit_timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            self.counters['rejected'] += 1
+            raise CapacityError(f'wait for recognizer timeout, active={self.connections}')
+        finally:
+            self.waiting -= 1
+        self.connections += 1
+        self.counters['admitted'] += 1
+
+    def release(self):
+        self.connections -= 1
+        self._slots.release()
+
+    async def run_stream(self, fn, *args):
+        """在共享线程池里跑一路识别流（阻塞到流结束的同步函数）"""
+        self.active_streams += 1
+        self.counters['streams'] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.active_streams -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(
+            max_streams=self.max_streams,
+            connections=self.connections,
+            waiting=self.waiting,
+            active_streams=self.active_streams,
+            executor=self.executor.stats(),
+        )
+        return stats
+
+
+if __name__ == '__main__':
+    # 用假的识别流跑一遍：python recognizer_manager.py
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    async def _main():
+        manager = RecognizerManager(max_streams=4, max_waiting=2, admit_timeout=0.5)
+
+        async def connection(i):
+            try:
+                await manager.admit()
+            except CapacityError as e:
+                return f'{i}: rejected, {e}'
+            try:
+                await manager.run_stream(time.sleep, 0.3)
+                return f'{i}: done'
+            finally:
+                manager.release()
+
+        results = await asyncio.gather(*(connection(i) for i in range(10)))
+        for result in results:
+            logging.info(result)
+        logging.info(manager.stats())
+        manager.shutdown()
+
+    asyncio.run(_main())
@@ -0,0 +1,102 @@
+class AudioRingBuffer:
+    """每个 websocket 连接一个的定长环形缓冲区，把收到的音频按固定大小的帧切给识别 SDK。
+
+    容量是 frame_size 的整数倍，读位置总是对齐到帧，所以一帧在底层 bytearray 里一定是连续的，
+    acquire() 直接返回这段的 memoryview，不拷贝。收到的数据只在 write() 时拷贝一次。
+
+    所有权：acquire() 拿到的帧在 release() 之前归调用方，这段空间不会被 write() 覆盖；
+    release() 之后帧的内容随时会被改写，不能再用。所以只能把帧交给同步读完它的调用
+    （比如在线程里跑的 nls send_audio，返回时已经发出去了），要排队晚点用的（google 的请求生成器）
+    得先 bytes(frame) 拷一份再 release。
+    """
+
+    def __init__(self, frame_size, frames=32):
+        self.frame_size = frame_size
+        self.capacity = frame_size * frames
+        self._buf = bytearray(self.capacity)
+        self._view = memoryview(self._buf)
+        self._head = 0  # 已经 release 的总字节数
+        self._tail = 0  # 已经写入的总字节数
+        self._acquired = False
+        self.bytes_in = 0
+        self.frames_out = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def space(self):
+        return self.capacity - len(self)
+
+    def write(self, data):
+        """尽量写入 data（bytes 或 bytearray），返回写进去的字节数；满了就少写，调用方先取走几帧再写剩下的"""
+        n = min(len(data), self.capacity - (self._tail - self._head))
+        if n < len(data):
+            data = memoryview(data)[:n]
+        pos = self._tail % self.capacity
+        if pos + n <= self.capacity:
+            self._buf[pos:pos + n] = data
+        else:
+            # 绕回开头
+            first = self.capacity - pos
+            data = memoryview(data)
+            self._buf[pos:] = data[:first]
+            self._buf[:n - first] = data[first:]
+        self._tail += n
+        self.bytes_in += n
+        return n
+
+    def has_frame(self):
+        return len(self) >= self.frame_size
+
+    def acquire(self):
+        """返回下一整帧的 memoryview，不够一帧返回 None；用完必须 release()"""
+        if self._acquired:
+            raise RuntimeError('previous frame not released')
+        if not self.has_frame():
+            return None
+        self._acquired = True
+        pos = self._head % self.capacity
+        return self._view[pos:pos + self.frame_size]
+
+    def release(self):
+        if not self._acquired:
+            raise RuntimeError('no frame acquired')
+        self._acquired = False
+        self._head += self.frame_size
+        self.frames_out += 1
+
+    async def feed(self, data, send):
+        """写入 data，每凑满一帧就 await send(frame)；send 返回后帧立即被 release，
+        所以 send 不能把 memoryview 留到返回之后再用（这个 memoryview 也会被 release，之后访问直接报错）"""
+        written = self.write(data)
+        while True:
+            while self._tail - self._head >= self.frame_size:
+                frame = self.acquire()
+                try:
+                    await send(frame)
+                finally:
+                    frame.release()
+                    self.release()
+            if written >= len(data):
+                break
+            # 一条消息比整个缓冲区还大，腾出空间后接着写
+            written += self.write(memoryview(data)[written:])
+
+    async def flush(self, send):
+        """把不够一帧的尾巴也发出去（一句话说完的时候用），之后缓冲区是空的"""
+        n = len(self)
+        if not n or self._acquired:
+            return
+        pos = self._head % self.capacity
+        frame = self._view[pos:pos + n]
+        try:
+            await send(frame)
+        finally:
+            frame.release()
+            # 缓冲区空了，读写位置一起归零，帧重新对齐
+            self._head = self._tail = 0
+
+    def clear(self):
+        """丢掉没凑够一帧的尾巴和所有没取走的帧"""
+        self._head = self._tail
+        self._acquired = False
@@ -0,0 +1,83 @@
+import codecs
+import re
+
+SEPERATORS = [
+    "\n",
+    "。","！","？",
+    ".", "!", "?",
+    "；", ";",
+    "，", ","
+]
+
+
+class SentenceSegmenter:
+    """流式断句：每个新 chunk 只扫描一遍，已扫过的文本不会再扫。
+
+    feed() 接收 bytes（按 utf-8 增量解码，多字节字符被 chunk 切开也没关系）或 str，
+    返回这次新切出来的完整句子（带句末标点）；flush() 返回最后剩下的没有标点的部分。
+    去掉空白后短于 min_length 的句子不单独输出，并到下一句里，免得 tts 收到 "。" 这种碎片；
+    纯空白的句子直接丢掉。
+    """
+
+    def __init__(self, separators=SEPERATORS, min_length=0):
+        # 长的分隔符放前面，同一位置优先匹配长的
+        ordered = sorted(separators, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(sep) for sep in ordered))
+        self._overlap = max(len(sep) for sep in separators) - 1
+        self.min_length = min_length
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._parts = []  # 还没遇到句末标点的文本
+
+    def _tail(self):
+        # 多字符分隔符可能跨 chunk，拿上一段末尾几个字符和新 chunk 拼起来找
+        if not self._overlap:
+            return ''
+        tail = ''
+        for part in reversed(self._parts):
+            tail = part + tail
+            if len(tail) >= self._overlap:
+                break
+        return tail[-self._overlap:]
+
+    def feed(self, data):
+        text = data if isinstance(data, str) else self._decoder.decode(data)
+        if self._overlap:
+            tail = self._tail()
+            window = tail + text
+            cur = len(tail)  # window 里 cur 之前的部分已经在 _parts 里
+        else:
+            window = text
+            cur = 0
+        match = self._pattern.search(window)
+        if match is None:
+            # 大部分 chunk 只有几个字、不带标点，走这里
+            if text:
+                self._parts.append(text)
+            return []
+        sentences = []
+        while match is not None:
+            end = match.end()
+            if end > cur:
+                self._parts.append(window[cur:end])
+                cur = end
+                sentence = ''.join(self._parts)
+                stripped = sentence.strip()
+                if not stripped:
+                    self._parts = []
+                elif len(stripped) < self.min_length:
+                    self._parts = [sentence]
+                else:
+                    self._parts = []
+                    sentences.append(sentence)
+            match = self._pattern.search(window, end)
+        if cur < len(window):
+            self._parts.append(window[cur:])
+        return sentences
+
+    def flush(self):
+        rest = self._decoder.decode(b'', final=True)
+        if rest:
+            self._parts.append(rest)
+        remains = ''.join(self._parts)
+        self._parts = []
+        return remains
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+
+def normalize(text):
+    """比较识别文本用：去掉标点和空白，中间结果和最终结果常常只差一个句号"""
+    return re.sub(r'[\W_]+', '', text or '').lower()
+
+
+class StableInterims:
+    """stt 端：一句话的中间结果 stable_ms 毫秒没有变化就调用 on_stable(text)，每句最多触发一次同样的文本。
+    update() / reset() 在事件循环线程里调。"""
+
+    def __init__(self, stable_ms, on_stable):
+        self.stable_ms = stable_ms
+        self.on_stable = on_stable
+        self._text = None
+        self._fired = None
+        self._timer = None
+
+    def update(self, text):
+        if normalize(text) == normalize(self._text):
+            return
+        self._text = text
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self.stable_ms / 1000, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        if self._text and normalize(self._text) != normalize(self._fired):
+            self._fired = self._text
+            self.on_stable(self._text)
+
+    def reset(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._text = None
+        self._fired = None
+
+
+class Speculation:
+    """按还没定稿的文本提前跑的一次回复：句子攒在 sentences 里，第一句的 tts 在 first_audio 里提前合成"""
+
+    def __init__(self, user, text):
+        self.user = user
+        self.text = text
+        self.key = normalize(text)
+        self.started = time.perf_counter()
+        self.first_sentence_at = None
+        self.head_start = None  # 被取走时已经提前跑了多少秒
+        self.sentences = []
+        self.done = False
+        self.task = None
+        self.first_audio = None
+        self._event = asyncio.Event()
+
+    def _notify(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def append(self, sentence):
+        self.sentences.append(sentence)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def cancel(self):
+        for task in (self.task, self.first_audio):
+            if task is not None and not task.done():
+                task.cancel()
+
+    async def replay(self):
+        """已经攒下的句子先全部给出，之后跟着 llm 继续给，直到结束"""
+        pos = 0
+        while True:
+            if pos < len(self.sentences):
+                pos += 1
+                yield self.sentences[pos - 1]
+                continue
+            if self.done:
+                return
+            await self._event.wait()
+
+    def speech(self, speech_fn):
+        """包一层 speech_fn：第一句用提前合成好的语音，其余照常合成"""
+        async def run(sentence):
+            first_audio, self.first_audio = self.first_audio, None
+            if first_audio is not None and not (self.sentences and sentence is self.sentences[0]):
+                first_audio.cancel()
+                first_audio = None
+            if first_audio is not None:
+                try:
+                    data = await first_audio
+                except Exception:
+                    data = None
+                if data:
+                    yield data
+                    return
+            async for data in speech_fn(sentence):
+                yield data
+        return run
+
+
+class SpeculativeReplies:
+    """llm 端：每个用户最多一个推测中的回复。
+
+    start(user, text) 在 stt 中间结果稳定时调用，按这段文本提前跑 chat_fn(user, text)，
+    第一句出来时顺便用 speech_fn(user, sentence) 合成语音缓存起来；
+    final(user, text) 最终结果和推测的文本不同就马上取消；
+    take(user, text) 在正式请求时调用，文本一致（忽略标点空白）就把推测交给调用方继续用（命中），否则取消返回 None。
+    超过 ttl 秒没被取走的推测由后台清理。
+    """
+
+    def __init__(self, chat_fn, speech_fn=None, ttl=15, max_pending=100, sweep_interval=5, recent=1000):
+        self.chat_fn = chat_fn
+        self.speech_fn = speech_fn
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.sweep_interval = sweep_interval
+        self._pending = {}
+        self._sweeper = None
+        self.counters = {
+            'started': 0,
+            'hits': 0,
+            'misses': 0,       # 正式请求的文本和推测不一样
+            'changed': 0,      # 最终结果出来就发现不一样，提前取消
+            'superseded': 0,   # 中间结果又稳定成了别的文本，换一次推测
+            'expired': 0,
+            'rejected': 0,
+            'errors': 0,
+        }
+        self._saved_ms = deque(maxlen=recent)  # 命中时第一句回复提前了多少
+        self._ready_sentences = deque(maxlen=recent)  # 命中时已经准备好的句子数
+
+    def start(self, user, text):
+        key = normalize(text)
+        if not key:
+            return None
+        current = self._pending.get(user)
+        if current is not None:
+            if current.key == key:
+                return current
+            self._drop(user, 'superseded')
+        if len(self._pending) >= self.max_pending:
+            self.counters['rejected'] += 1
+            return None
+        spec = self._pending[user] = Speculation(user, text)
+        spec.task = asyncio.create_task(self._run(spec))
+        self.counters['started'] += 1
+        logging.info(f'{user} - speculate on "{text}"')
+        return spec
+
+    async def _run(self, spec):
+        try:
+            async for sentence in self.chat_fn(spec.user, spec.text):
+                if not spec.sentences:
+                    spec.first_sentence_at = time.perf_counter()
+                    if spec.head_start is not None:
+                        self._record_saved(spec)
+                    if self.speech_fn is not None:
+                        spec.first_audio = asyncio.create_task(self._collect(spec.user, sentence))
+                spec.append(sentence)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.counters['errors'] += 1
+            logging.exception(f'{spec.user} - speculative chat')
+        finally:
+            spec.finish()
+
+    async def _collect(self, user, sentence):
+        data = bytearray()
+        async for chunk in self.speech_fn(user, sentence):
+            data.extend(chunk)
+        return bytes(data)
+
+    def _record_saved(self, spec):
+        # 不推测的话第一句要等 llm 跑完首句那么久；推测提前了 head_start，最多省下这么多
+        first_sentence = spec.first_sentence_at - spec.started
+        self._saved_ms.append(min(spec.head_start, first_sentence) * 1000)
+
+    def _drop(self, user, reason):
+        spec = self._pending.pop(user, None)
+        if spec is not None:
+            spec.cancel()
+            self.counters[reason] += 1
+            logging.info(f'{user} - speculation dropped ({reason}): "{spec.text}"')
+
+    def final(self, user, text):
+        spec = self._pending.get(user)
+        if spec is not None and spec.key != normalize(text):
+            self._drop(user, 'changed')
+
+    def take(self, user, text):
+        spec = self._pending.get(user)
+        if spec is None:
+            return None
+        if spec.key != normalize(text):
+            self._drop(user, 'misses')
+            return None
+        del self._pending[user]
+        self.counters['hits'] += 1
+        spec.head_start = time.perf_counter() - spec.started
+        if spec.first_sentence_at is not None:
+            self._record_saved(spec)
+        # 第一句还没出来的，等出来时再记
+        self._ready_sentences.append(len(spec.sentences))
+        return spec
+
+    def sweep(self):
+        now = time.perf_counter()
+        expired = [user for user, spec in self._pending.items() if now - spec.started > self.ttl]
+        for user in expired:
+            self._drop(user, 'expired')
+        return len(expired)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception('speculation sweep')
+
+    def start_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for user in list(self._pending):
+            self._drop(user, 'expired')
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['pending'] = len(self._pending)
+        decided = stats['hits'] + stats['misses'] + stats['changed']
+        stats['hit_rate'] = round(stats['hits'] / decided, 3) if decided else None
+        recent = sorted(self._saved_ms)
+        if recent:
+            # 命中时第一句回复省下的时间：min(提前跑了多久, llm 出第一句要多久)
+            stats['saved_ms'] = {
+                'avg': round(sum(recent) / len(recent), 1),
+                'p50': round(recent[len(recent) // 2], 1),
+                'p99': round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 1),
+            }
+        ready = list(self._ready_sentences)
+        if ready:
+            stats['first_sentence_ready_rate'] = round(sum(1 for n in ready if n) / len(ready), 3)
+        return stats
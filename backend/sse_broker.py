@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+
+class _Topic:
+    __slots__ = ('buffer', 'dropped', 'closed', 'event', 'subscribers', 'touched')
+
+    def __init__(self, max_buffer):
+        self.buffer = deque(maxlen=max_buffer)
+        self.dropped = 0  # 被挤出 buffer 的条数，buffer[0] 的全局序号
+        self.closed = False
+        self.event = asyncio.Event()
+        self.subscribers = 0
+        self.touched = time.monotonic()
+
+    def notify(self):
+        # 每次发布换一个新的 event，等待者各自持有旧 event，set 一次全部唤醒
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+        self.touched = time.monotonic()
+
+
+class MessageBroker:
+    """每个 msg_id 一个有界缓冲的发布/订阅通道，全部跑在事件循环里，不占线程池。
+
+    订阅者可以晚于发布者到达，从 offset 开始回放缓冲里还留着的消息；
+    没有订阅者且超过 ttl 没有动静的 msg_id 会被后台清理掉。
+    """
+
+    def __init__(self, max_buffer=256, ttl=120, sweep_interval=30):
+        self.max_buffer = max_buffer
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._topics = {}
+        self._sweeper = None
+
+    def _topic(self, msg_id):
+        topic = self._topics.get(msg_id)
+        if topic is None:
+            topic = self._topics[msg_id] = _Topic(self.max_buffer)
+        return topic
+
+    def __contains__(self, msg_id):
+        return msg_id in self._topics
+
+    def __len__(self):
+        return len(self._topics)
+
+    def depth(self):
+        """所有通道里还缓冲着的消息数"""
+        return sum(len(topic.buffer) for topic in self._topics.values())
+
+    def closed(self, msg_id):
+        topic = self._topics.get(msg_id)
+        return topic is not None and topic.closed
+
+    def publish(self, msg_id, item):
+        topic = self._topic(msg_id)
+        if topic.closed:
+            logging.warning(f'msg_id={msg_id} already closed, drop {item}')
+            return
+        if len(topic.buffer) == topic.buffer.maxlen:
+            topic.dropped += 1
+        topic.buffer.append(item)
+        topic.notify()
+
+    def close(self, msg_id):
+        topic = self._topic(msg_id)
+        topic.closed = True
+        topic.notify()
+
+    def discard(self, msg_id):
+        topic = self._topics.pop(msg_id, None)
+        if topic is not None:
+            topic.closed = True
+            topic.notify()
+
+    async def subscribe(self, msg_id, timeout=60, offset=0):
+        """依次产出 msg_id 上的消息直到 close；超过 timeout 秒没有新消息抛 asyncio.TimeoutError"""
+        topic = self._topic(msg_id)
+        topic.subscribers += 1
+        topic.touched = time.monotonic()
+        pos = offset
+        try:
+            while True:
+                if pos < topic.dropped:
+                    logging.warning(f'msg_id={msg_id}, subscriber lagged, skip {topic.dropped - pos} messages')
+                    pos = topic.dropped
+                items = list(itertools.islice(topic.buffer, pos - topic.dropped, None))
+                if items:
+                    pos += len(items)
+                    for item in items:
+                        yield item
+                    continue
+                if topic.closed:
+                    return
+                await asyncio.wait_for(topic.event.wait(), timeout)
+        finally:
+            topic.subscribers -= 1
+            topic.touched = time.monotonic()
+
+    def sweep(self):
+        now = time.monotonic()
+        expired = [msg_id for msg_id, topic in self._topics.items()
+                   if topic.subscribers == 0 and now - topic.touched > self.ttl]
+        for msg_id in expired:
+            del self._topics[msg_id]
+        if expired:
+            logging.info(f'expired {len(expired)} msg_ids, remains={len(self._topics)}')
+        return len(expired)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception('broker sweep')
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
@@ -0,0 +1,114 @@
+import logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s",
+    level=logging.INFO
+)
+from typing import Dict
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, WebSocket, HTTPException, Request, Depends
+from fastapi.responses import Response
+
+import config as gloabl_config
+from vad import gate_from_config, totals_stats as vad_stats
+from ws_sender import SenderStats
+from stt_engine import StreamingEngine, ProviderRouter
+from stt_providers import providers_from_config
+import metrics
+from metrics import REGISTRY
+
+# 一个进程同时接几家识别服务，按请求路由：
+#   /api_16/stt/{msg_id}?provider=aliyun             指定服务
+#   /api_16/stt/{msg_id}?language=en-US&strategy=fastest   按语言从 STT_ROUTES 里挑
+# config.py 里配了哪家的 key 就启用哪家，STT_FAKE_PROVIDER = True 时多一个 fake（不花钱，测客户端用）：
+#   STT_ROUTES = {'zh': ['aliyun', 'google'], 'en': ['deepgram', 'google']}
+#   STT_PROVIDER_COST = {'aliyun': 0.0125, 'google': 0.024, 'deepgram': 0.0043}  # 美元/分钟
+#   STT_DEFAULT_PROVIDER = 'aliyun'
+#   STT_ROUTE_STRATEGY = 'cheapest'  # cheapest / fastest / least_loaded
+
+ALGORITHM = "HS256"
+CONFIDENCE_MIN = 0.5
+SENTENCE_COMPLETE_SEC = 1  # SECONDS
+SEND_MAX_QUEUE = getattr(gloabl_config, 'SEND_MAX_QUEUE', 32)
+
+
+providers = providers_from_config(gloabl_config, confidence_min=CONFIDENCE_MIN,
+                                  sentence_complete_sec=SENTENCE_COMPLETE_SEC)
+router = ProviderRouter(
+    providers,
+    routes=getattr(gloabl_config, 'STT_ROUTES', {}),
+    default=getattr(gloabl_config, 'STT_DEFAULT_PROVIDER', None),
+    strategy=getattr(gloabl_config, 'STT_ROUTE_STRATEGY', 'cheapest'),
+)
+sender_stats = SenderStats()
+engine = StreamingEngine(
+    providers,
+    router,
+    gate_factory=lambda: gate_from_config(gloabl_config),
+    sender_stats=sender_stats,
+    send_max_queue=SEND_MAX_QUEUE,
+    packet_gap=SENTENCE_COMPLETE_SEC,
+)
+
+app = FastAPI()
+
+active_connections: Dict[str, WebSocket] = {}
+
+REGISTRY.configure(getattr(gloabl_config, 'METRICS_MODE', 'light'))
+stats_guard = metrics.scrape_guard(getattr(gloabl_config, 'METRICS_TOKEN', None))  # 统计接口和 /metrics 一样的访问控制
+REGISTRY.gauge('stt_websockets', 'Open STT websockets', lambda: len(active_connections))
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not metrics.scrape_allowed(request, getattr(gloabl_config, 'METRICS_TOKEN', None)):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.websocket("/api_16/stt/{msg_id}")
+async def websocket_endpoint(websocket: WebSocket, msg_id: str, provider: str = None, language: str = None,
+                             strategy: str = None):
+    await websocket.accept()
+    try:
+        token = await websocket.receive_text()
+        payload = jwt.decode(token, gloabl_config.JWT_SECRET_KEY, algorithms=[ALGORITHM])
+        phone = payload.get("sub")
+    except jwt.PyJWTError:
+        phone = None
+    if phone is None:
+        await websocket.send_text("TOKEN_INVALID")
+        await websocket.close()
+        return
+
+    logging.info(f'/stt/, msg_id={msg_id}, phone={phone}, provider={provider}, language={language}')
+    active_connections[phone] = websocket
+    try:
+        await engine.serve(websocket, phone, provider=provider, language=language, strategy=strategy,
+                           trace_id=msg_id)
+    finally:
+        if active_connections.get(phone) is websocket:
+            del active_connections[phone]
+
+
+@app.get("/api_16/stt_stats", dependencies=[Depends(stats_guard)])
+async def get_stats():
+    stats = engine.stats()
+    stats['websockets'] = len(active_connections)
+    stats['vad'] = vad_stats()
+    return stats
+
+
+@app.on_event("startup")
+async def startup():
+    await engine.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await engine.stop()
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8000)
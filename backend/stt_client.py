@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+WHISPER_URL = 'https://api.openai.com/v1/audio/transcriptions'
+
+
+class TranscriptionError(Exception):
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class WhisperClient:
+    """异步的 whisper 文件转写：走共享连接池，multipart 直接从上传的临时文件流式读，
+    用信号量限制同时在转写的数量，每个请求有超时，慢请求不会卡住事件循环。"""
+
+    def __init__(self, pool, api_key, max_concurrency=4, timeout=60, url=WHISPER_URL,
+                 model='whisper-1', temperature='0.7', prompt=None):
+        self.pool = pool
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.temperature = temperature
+        self.prompt = prompt
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.counters = {'requests': 0, 'errors': 0, 'timeouts': 0, 'waiting': 0}
+
+    def _form(self, file, filename, content_type):
+        form = aiohttp.FormData()
+        form.add_field('model', self.model)
+        form.add_field('temperature', self.temperature)
+        if self.prompt:
+            form.add_field('prompt', self.prompt)
+        # 文件对象交给 aiohttp，按块在线程池里读，不整体读进内存
+        form.add_field('file', file, filename=filename, content_type=content_type)
+        return form
+
+    async def request(self, file, filename=None, content_type='application/octet-stream'):
+        """file 可以是路径或已打开的二进制文件对象；返回识别文本，失败抛 TranscriptionError"""
+        if isinstance(file, str):
+            filename = filename or os.path.basename(file)
+            with open(file, 'rb') as f:
+                return await self.request(f, filename, content_type)
+
+        headers = {'Authorization': f'Bearer sk-{self.api_key}'}
+        self.counters['waiting'] += 1
+        async with self._semaphore:
+            self.counters['waiting'] -= 1
+            self.counters['requests'] += 1
+            file.seek(0)
+            session = await self.pool.get_session()
+            try:
+                async with session.post(self.url, headers=headers, data=self._form(file, filename, content_type),
+                                        timeout=self.timeout) as response:
+                    dict1 = await response.json(content_type=None)
+                    logging.info(f'response={dict1}')
+                    if response.status == 200:
+                        return dict1['text']
+                    self.counters['errors'] += 1
+                    # 限流和服务端错误可以重试
+                    retryable = response.status == 429 or response.status >= 500
+                    raise TranscriptionError(dict1['error']['message'], status=response.status, retryable=retryable)
+            except asyncio.TimeoutError:
+                self.counters['timeouts'] += 1
+                raise TranscriptionError(f'transcribe timeout, file={filename}', retryable=True)
+            except aiohttp.ClientError as e:
+                self.counters['errors'] += 1
+                raise TranscriptionError(f'transcribe failed, file={filename}: {e}', retryable=True)
+            except (ValueError, KeyError) as e:
+                self.counters['errors'] += 1
+                raise TranscriptionError(f'unexpected response, file={filename}: {e!r}')
+
+    async def transcribe(self, file, filename=None, content_type='application/octet-stream'):
+        """同 request，但不抛异常：接口报错时返回错误信息，超时或网络错误返回空串"""
+        try:
+            return await self.request(file, filename, content_type)
+        except TranscriptionError as e:
+            logging.error(str(e))
+            return str(e) if e.status is not None else ''
+
+
+class FakeTranscriber:
+    """本地假转写，测试用：固定延迟，前 fail_times 次抛可重试的错误"""
+
+    def __init__(self, delay=0.1, fail_times=0, text='fake transcript'):
+        self.delay = delay
+        self.fail_times = fail_times
+        self.text = text
+        self.calls = 0
+
+    async def request(self, file, filename=None, content_type=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls <= self.fail_times:
+            raise TranscriptionError(f'fake failure {self.calls}', status=503, retryable=True)
+        name = filename or (file if isinstance(file, str) else getattr(file, 'name', ''))
+        return f'{self.text}: {os.path.basename(str(name))}'
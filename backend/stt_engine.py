@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from fastapi import WebSocketDisconnect
+
+from metrics import REGISTRY, TRACER
+from recognizer_manager import CapacityError
+from ring_buffer import AudioRingBuffer
+from ws_sender import SenderStats, TranscriptSender
+
+FINAL_PREFIX = '<|final|>'
+
+STT_FIRST_RESULT = REGISTRY.histogram('stt_first_result_seconds',
+                                      'From the first audio of an utterance to its first result', ('provider',))
+STT_FINAL_LATENCY = REGISTRY.histogram('stt_final_latency_seconds',
+                                       'From the end of speech to the final result', ('provider',))
+STT_RESULTS = REGISTRY.counter('stt_results_total', 'Recognition results emitted', ('provider', 'kind'))
+STT_CONNECTIONS = REGISTRY.counter('stt_connections_total', 'Streaming connections by outcome',
+                                   ('provider', 'outcome'))
+
+
+class StreamingSession:
+    """一个 websocket 连接在某个识别服务上的会话，由 StreamingProvider.open() 创建。
+
+    send(frame) 发一帧 pcm（16k 16bit 单声道，provider.frame_size 字节，最后一帧可能更短）；
+    end_utterance() 表示一句话说完了，让服务端尽快出这一句的最终结果；close() 结束会话。
+    识别结果通过 open() 时给的 emitter 交回：emitter.interim(text) / emitter.final(text)。
+    """
+
+    async def send(self, frame):
+        raise NotImplementedError
+
+    async def end_utterance(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class StreamingProvider:
+    """一种流式识别服务的适配器，进程内一个实例，所有连接共用。
+
+    name: 路由、统计里用的名字
+    frame_size: 每次 send 的字节数
+    copy_frames: send() 返回之后还要用到这帧（比如先进队列晚点发）就设 True，引擎交出 bytes；
+                 send() 里同步发完的设 False，直接拿环形缓冲区的 memoryview，不拷贝
+    cost: 每分钟多少钱，路由按最便宜选时用
+    max_sessions: 同时最多多少个会话，0 表示不限；load() 按它算负载
+    """
+
+    name = ''
+    frame_size = 3200
+    copy_frames = True
+
+    def __init__(self, cost=0.0, max_sessions=0):
+        self.cost = cost
+        self.max_sessions = max_sessions
+        self.active = 0
+        self.counters = {'sessions': 0, 'rejected': 0, 'errors': 0, 'finals': 0, 'interims': 0}
+        self.first_result_ms = deque(maxlen=200)
+
+    async def start(self):
+        """app startup 时调用"""
+
+    async def stop(self):
+        """app shutdown 时调用"""
+
+    async def open(self, emitter, name, language=None) -> StreamingSession:
+        raise NotImplementedError
+
+    def acquire(self):
+        """一个会话开好了，计入负载；和 release() 成对调用"""
+        self.active += 1
+        self.counters['sessions'] += 1
+
+    def release(self):
+        self.active -= 1
+
+    def load(self):
+        if not self.max_sessions:
+            return 0.0
+        return self.active / self.max_sessions
+
+    def latency_ms(self):
+        """最近每句话从开始发音频到第一个识别结果的中位数，还没有数据时返回 None"""
+        recent = sorted(self.first_result_ms)
+        return recent[len(recent) // 2] if recent else None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(active=self.active, max_sessions=self.max_sessions, cost=self.cost,
+                     load=round(self.load(), 3))
+        latency = self.latency_ms()
+        if latency is not None:
+            stats['first_result_ms_p50'] = round(latency, 1)
+        return stats
+
+
+class Emitter:
+    """provider 交回识别结果的地方：转给连接的 TranscriptSender，顺便统计首个结果的延迟。
+    interim() / final() 在事件循环线程里调；sdk 线程里用 interim_threadsafe() / final_threadsafe()。"""
+
+    def __init__(self, sender: TranscriptSender, provider: StreamingProvider, on_final=None, on_interim=None,
+                 trace_id=None):
+        self.sender = sender
+        self.provider = provider
+        self.on_final = on_final  # async fn(text)，比如句子结束时把录音落盘
+        self.on_interim = on_interim  # fn(text)，不能阻塞
+        self.trace_id = trace_id
+        self.loop = asyncio.get_running_loop()
+        self._utterance_start = None
+        self._utterance_end = None
+        self._answered = False
+        self._trace = None
+        self._tasks = set()
+
+    def audio(self):
+        if self._utterance_start is None:
+            self._utterance_start = time.perf_counter()
+            self._utterance_end = None
+            self._answered = False
+            self._trace = TRACER.start(self.trace_id, 'stt', bind=False)
+
+    def end(self):
+        """一句话的音频发完了（vad 判断说完，或者客户端停发）"""
+        if self._utterance_start is not None and self._utterance_end is None:
+            self._utterance_end = time.perf_counter()
+            if self._trace is not None:
+                self._trace.mark('end_of_speech')
+
+    def _result(self):
+        if self._utterance_start is not None and not self._answered:
+            self._answered = True
+            elapsed = time.perf_counter() - self._utterance_start
+            self.provider.first_result_ms.append(elapsed * 1000)
+            STT_FIRST_RESULT.observe(elapsed, provider=self.provider.name)
+            if self._trace is not None:
+                self._trace.mark('first_result')
+
+    def interim(self, text):
+        self._result()
+        self.provider.counters['interims'] += 1
+        STT_RESULTS.inc(provider=self.provider.name, kind='interim')
+        self.sender.interim(text)
+        if self.on_interim is not None:
+            self.on_interim(text)
+
+    def final(self, text):
+        self._result()
+        if self._utterance_end is not None:
+            STT_FINAL_LATENCY.observe(time.perf_counter() - self._utterance_end, provider=self.provider.name)
+        TRACER.finish(self._trace, 'final')
+        self._trace = None
+        self._utterance_start = None
+        self.provider.counters['finals'] += 1
+        STT_RESULTS.inc(provider=self.provider.name, kind='final')
+        self.sender.final(FINAL_PREFIX + text)
+        if self.on_final is not None:
+            task = asyncio.create_task(self.on_final(text))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def interim_threadsafe(self, text):
+        self.loop.call_soon_threadsafe(self.interim, text)
+
+    def final_threadsafe(self, text):
+        self.loop.call_soon_threadsafe(self.final, text)
+
+
+class ProviderRouter:
+    """按请求选识别服务。
+
+    请求指定了 provider 就用它（不存在抛 ValueError）；否则按 language 在 routes 里找候选列表
+    （先精确匹配 'zh-CN'，再匹配 'zh'，都没有用 default），去掉满载的，
+    按 strategy 选：cheapest 最便宜、fastest 最近首个结果最快（没数据的先试）、least_loaded 负载最低。
+    """
+
+    def __init__(self, providers, routes=None, default=None, strategy='cheapest'):
+        self.providers = providers
+        self.routes = routes or {}
+        self.default = default or next(iter(providers), None)
+        self.strategy = strategy
+        self.counters = {}
+
+    def candidates(self, language=None):
+        names = None
+        if language:
+            names = self.routes.get(language) or self.routes.get(language.split('-')[0])
+        names = [name for name in (names or [self.default]) if name in self.providers]
+        return [self.providers[name] for name in names] or [self.providers[self.default]]
+
+    def choose(self, provider=None, language=None, strategy=None):
+        if not self.providers:
+            raise ValueError('no provider configured')
+        if provider:
+            if provider not in self.providers:
+                raise ValueError(f'unknown provider {provider}')
+            chosen = self.providers[provider]
+        else:
+            candidates = self.candidates(language)
+            available = [p for p in candidates if p.load() < 1] or candidates
+            strategy = strategy or self.strategy
+            if strategy == 'fastest':
+                key = lambda p: (p.latency_ms() or 0.0, p.load())
+            elif strategy == 'least_loaded':
+                key = lambda p: (p.load(), p.cost)
+            else:
+                key = lambda p: (p.cost, p.load())
+            chosen = min(available, key=key)
+        self.counters[chosen.name] = self.counters.get(chosen.name, 0) + 1
+        return chosen
+
+
+class StreamingEngine:
+    """流式识别的公共部分，各 provider 只实现适配器。
+
+    一个 websocket 连接：选 provider、开会话，收音频 -> (on_audio 钩子，比如录音) -> vad 挡掉静音 ->
+    环形缓冲区切成 provider 要的帧 -> session.send；一句话说完（vad 判断，或者客户端停发超过 packet_gap 秒）
+    把不满一帧的尾巴发掉再 end_utterance；识别结果经 Emitter 进 TranscriptSender 发回客户端。
+    """
+
+    def __init__(self, providers, router: ProviderRouter = None, gate_factory=None, sender_stats=None,
+                 send_max_queue=32, packet_gap=1.0):
+        self.providers = providers
+        self.router = router or ProviderRouter(providers)
+        self.gate_factory = gate_factory
+        self.sender_stats = sender_stats or SenderStats()
+        self.send_max_queue = send_max_queue
+        self.packet_gap = packet_gap
+        self.connections = 0
+        REGISTRY.gauge('stt_sessions_active', 'Open streaming sessions per provider',
+                       lambda: {(name,): provider.active for name, provider in self.providers.items()},
+                       ('provider',))
+
+    async def start(self):
+        for provider in self.providers.values():
+            await provider.start()
+
+    async def stop(self):
+        for provider in self.providers.values():
+            await provider.stop()
+
+    async def serve(self, websocket, name, provider=None, language=None, strategy=None, on_audio=None,
+                    on_final=None, on_interim=None, on_open=None, trace_id=None):
+        """websocket 已经 accept 并且鉴权过；一直跑到连接断开。trace_id（比如 msg_id）用来在追踪里对上这次会话。
+        on_open(sender) 在会话开好后调用，同一个连接上还要下发别的消息时都经这个 sender，和识别结果保持顺序"""
+        try:
+            chosen = self.router.choose(provider, language, strategy)
+        except ValueError as e:
+            logging.warning(f'{name} - {e}')
+            await websocket.send_text("PROVIDER_INVALID")
+            await websocket.close(code=1008)
+            return
+
+        sender = TranscriptSender(websocket, self.sender_stats, max_queue=self.send_max_queue, name=name)
+        sender.start()
+        emitter = Emitter(sender, chosen, on_final, on_interim, trace_id=trace_id or name)
+        try:
+            session = await chosen.open(emitter, name, language)
+        except CapacityError as e:
+            logging.warning(f'{name} - reject, {chosen.name}: {e}')
+            chosen.counters['rejected'] += 1
+            STT_CONNECTIONS.inc(provider=chosen.name, outcome='rejected')
+            await sender.close()
+            await websocket.send_text("SERVER_BUSY")
+            await websocket.close(code=1013)
+            return
+        except Exception:
+            logging.exception(f'{name} - open {chosen.name} session')
+            chosen.counters['errors'] += 1
+            STT_CONNECTIONS.inc(provider=chosen.name, outcome='error')
+            await sender.close()
+            try:
+                await websocket.send_text("SERVER_ERROR")
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+            return
+
+        logging.info(f'{name} - streaming to {chosen.name}, language={language}')
+        if on_open is not None:
+            on_open(sender)
+        chosen.acquire()
+        self.connections += 1
+        ring = AudioRingBuffer(chosen.frame_size)
+        gate = self.gate_factory() if self.gate_factory is not None else None
+        if chosen.copy_frames:
+            async def send(frame):
+                await session.send(bytes(frame))
+        else:
+            send = session.send
+
+        async def end_utterance():
+            emitter.end()
+            await ring.flush(send)
+            await session.end_utterance()
+
+        try:
+            pending = False  # 上一次 end_utterance 之后有没有发过音频
+            while True:
+                try:
+                    data = await asyncio.wait_for(websocket.receive_bytes(), timeout=self.packet_gap)
+                except asyncio.TimeoutError:
+                    # 客户端说到一半不发了，vad 看不到后面的静音，按一句话结束处理
+                    if pending:
+                        pending = False
+                        await end_utterance()
+                    continue
+                if on_audio is not None:
+                    await on_audio(data)
+                if gate is None:
+                    emitter.audio()
+                    await ring.feed(data, send)
+                    pending = True
+                    continue
+                for voiced, ended in gate.feed(data):
+                    emitter.audio()
+                    await ring.feed(voiced, send)
+                    pending = True
+                    if ended:
+                        pending = False
+                        await end_utterance()
+        except WebSocketDisconnect:
+            logging.info(f"WebSocket disconnected for user {name}")
+            STT_CONNECTIONS.inc(provider=chosen.name, outcome='closed')
+        except Exception:
+            chosen.counters['errors'] += 1
+            STT_CONNECTIONS.inc(provider=chosen.name, outcome='error')
+            logging.exception(f'{name} - streaming error')
+        finally:
+            chosen.release()
+            self.connections -= 1
+            try:
+                await session.close()
+            except Exception:
+                logging.exception(f'{name} - close {chosen.name} session')
+            await sender.close()
+            ring.clear()
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'providers': {name: provider.stats() for name, provider in self.providers.items()},
+            'routes': dict(self.router.counters),
+            'sender': self.sender_stats.stats(),
+        }
+
+
+class FakeProvider(StreamingProvider):
+    """本地假的识别服务，不连网、不识别内容：每收到 interim_ms 毫秒有声音的音频推一条中间结果，
+    end_utterance 时推最终结果。测引擎、路由和客户端用。"""
+
+    name = 'fake'
+    frame_size = 3200
+    copy_frames = False
+
+    def __init__(self, cost=0.0, max_sessions=0, interim_ms=500, delay=0.0):
+        super().__init__(cost=cost, max_sessions=max_sessions)
+        self.interim_ms = interim_ms
+        self.delay = delay  # 模拟服务端出结果的延迟
+
+    async def open(self, emitter, name, language=None):
+        return FakeSession(self, emitter)
+
+
+class FakeSession(StreamingSession):
+    def __init__(self, provider: FakeProvider, emitter: Emitter):
+        self.provider = provider
+        self.emitter = emitter
+        self.index = 0
+        self.speech_ms = 0
+
+    async def _emit(self, fn, text):
+        if self.provider.delay:
+            await asyncio.sleep(self.provider.delay)
+        fn(text)
+
+    async def send(self, frame):
+        ms = len(frame) // 32
+        if not any(frame):
+            return
+        before = self.speech_ms
+        self.speech_ms += ms
+        if self.speech_ms // self.provider.interim_ms > before // self.provider.interim_ms:
+            await self._emit(self.emitter.interim, f'说了{self.speech_ms}毫秒')
+
+    async def end_utterance(self):
+        if self.speech_ms:
+            self.index += 1
+            text = f'第{self.index}句，{self.speech_ms}毫秒。'
+            self.speech_ms = 0
+            await self._emit(self.emitter.final, text)
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TranscriptionJobs:
+    """进程内的文件转写任务队列。
+
+    submit 立即返回 job，固定数量的 worker 协程取任务执行，每个 provider 有自己的并发上限，
+    可重试的失败按指数退避加抖动重新排队。每个任务的状态写成 <directory>/<job_id>.json，
+    音频也放在 directory 里，进程重启后没跑完的任务会重新排队。
+    transcribers: provider -> async fn(path) -> text，失败时抛带 retryable 属性的异常。
+    """
+
+    def __init__(self, directory, transcribers, workers=4, provider_limits=None, max_attempts=3,
+                 backoff=1.0, ttl=3600, on_update=None):
+        self.directory = directory
+        self.transcribers = transcribers
+        self.workers = workers
+        self.provider_limits = provider_limits or {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.ttl = ttl
+        self.on_update = on_update  # fn(job)，状态变化时回调，比如推到 sse
+        self._jobs = {}
+        self._done_events = {}
+        self._queue = None
+        self._limits = {}
+        self._tasks = []
+        self.counters = {'submitted': 0, 'done': 0, 'failed': 0, 'retries': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _record_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.json')
+
+    def _save(self, job):
+        tmp_path = self._record_path(job['job_id']) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._record_path(job['job_id']))
+
+    def _load(self):
+        jobs = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                        jobs.append(json.load(f))
+                except (OSError, ValueError):
+                    logging.exception(f'broken job record {filename}')
+        return sorted(jobs, key=lambda job: job['created_at'])
+
+    def _remove(self, job):
+        for path in (self._record_path(job['job_id']), job['audio_path'] if job.get('owned') else None):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    async def _update(self, job, **changes):
+        job.update(changes, updated_at=time.time())
+        await asyncio.to_thread(self._save, job)
+        if self.on_update is not None:
+            try:
+                self.on_update(self.public(job))
+            except Exception:
+                logging.exception('stt job on_update')
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._limits = {provider: asyncio.Semaphore(n) for provider, n in self.provider_limits.items()}
+        requeued = 0
+        for job in await asyncio.to_thread(self._load):
+            self._jobs[job['job_id']] = job
+            if job['status'] in (QUEUED, RUNNING):
+                # 上次退出时没跑完的
+                job['status'] = QUEUED
+                self._queue.put_nowait(job['job_id'])
+                requeued += 1
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_forever()))
+        logging.info(f'stt jobs started, workers={self.workers}, loaded={len(self._jobs)}, requeued={requeued}')
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, src, filename=None, provider='whisper', copy=True, meta=None, user=None):
+        """src 是文件路径或二进制文件对象。copy=False 时直接引用 src 路径，任务结束也不删它。
+        user 是提交的人，查询结果的接口按它校验"""
+        if provider not in self.transcribers:
+            raise ValueError(f'unknown stt provider: {provider}')
+        job_id = uuid.uuid4().hex
+        filename = filename or (os.path.basename(src) if isinstance(src, str) else 'audio')
+        if copy:
+            audio_path = os.path.join(self.directory, job_id + os.path.splitext(filename)[1])
+            if isinstance(src, str):
+                await asyncio.to_thread(shutil.copyfile, src, audio_path)
+            else:
+                def copy_fileobj():
+                    src.seek(0)
+                    with open(audio_path, 'wb') as f:
+                        shutil.copyfileobj(src, f)
+                await asyncio.to_thread(copy_fileobj)
+        else:
+            audio_path = src
+        now = time.time()
+        job = {
+            'job_id': job_id,
+            'provider': provider,
+            'user': user,
+            'filename': filename,
+            'audio_path': audio_path,
+            'owned': copy,
+            'status': QUEUED,
+            'attempts': 0,
+            'result': None,
+            'error': None,
+            'meta': meta or {},
+            'created_at': now,
+            'updated_at': now,
+        }
+        self._jobs[job_id] = job
+        await asyncio.to_thread(self._save, job)
+        self._queue.put_nowait(job_id)
+        self.counters['submitted'] += 1
+        return self.public(job)
+
+    @staticmethod
+    def finished(job):
+        return job['status'] in (DONE, FAILED)
+
+    @staticmethod
+    def public(job):
+        return {k: v for k, v in job.items() if k not in ('audio_path', 'owned')}
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return self.public(job) if job is not None else None
+
+    async def wait(self, job_id, timeout=None):
+        job = self._jobs[job_id]
+        if not self.finished(job):
+            event = self._done_events.setdefault(job_id, asyncio.Event())
+            await asyncio.wait_for(event.wait(), timeout)
+        return self.public(job)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                continue
+            limit = self._limits.get(job['provider'])
+            try:
+                if limit is None:
+                    await self._run(job)
+                else:
+                    async with limit:
+                        await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f'stt job {job_id}')
+
+    async def _run(self, job):
+        await self._update(job, status=RUNNING, attempts=job['attempts'] + 1)
+        try:
+            text = await self.transcribers[job['provider']](job['audio_path'])
+        except Exception as e:
+            retryable = getattr(e, 'retryable', False)
+            if retryable and job['attempts'] < self.max_attempts:
+                delay = self.backoff * 2 ** (job['attempts'] - 1) * random.uniform(0.5, 1.5)
+                logging.info(f'stt job {job["job_id"]} failed: {e}, retry in {delay:.1f}s')
+                self.counters['retries'] += 1
+                await self._update(job, status=QUEUED, error=str(e))
+                asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job['job_id'])
+                return
+            logging.error(f'stt job {job["job_id"]} failed: {e}')
+            self.counters['failed'] += 1
+            await self._finish(job, status=FAILED, error=str(e))
+        else:
+            self.counters['done'] += 1
+            await self._finish(job, status=DONE, result=text, error=None)
+
+    async def _finish(self, job, **changes):
+        if job.get('owned') and os.path.exists(job['audio_path']):
+            await asyncio.to_thread(os.remove, job['audio_path'])
+        await self._update(job, **changes)
+        event = self._done_events.pop(job['job_id'], None)
+        if event is not None:
+            event.set()
+
+    def sweep(self):
+        now = time.time()
+        expired = [job for job in self._jobs.values()
+                   if self.finished(job) and now - job['updated_at'] > self.ttl]
+        for job in expired:
+            del self._jobs[job['job_id']]
+            self._remove(job)
+        return len(expired)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(60)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception:
+                logging.exception('stt jobs sweep')
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        stats['running'] = sum(1 for job in self._jobs.values() if job['status'] == RUNNING)
+        stats['jobs'] = len(self._jobs)
+        return stats
+
+
+if __name__ == '__main__':
+    # 用假转写跑一遍：python stt_jobs.py
+    import tempfile
+    from stt_client import FakeTranscriber
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    async def _main():
+        fake = FakeTranscriber(delay=0.2, fail_times=2)
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = TranscriptionJobs(directory, {'fake': fake.request}, workers=4,
+                                     provider_limits={'fake': 2}, backoff=0.1)
+            await jobs.start()
+            audio = os.path.join(directory, 'a.m4a')
+            with open(audio, 'wb') as f:
+                f.write(b'\0' * 1024)
+            start = time.time()
+            submitted = [await jobs.submit(audio, provider='fake') for _ in range(10)]
+            results = [await jobs.wait(job['job_id'], timeout=30) for job in submitted]
+            print(f'{len(results)} jobs in {time.time() - start:.2f}s, stats={jobs.stats()}')
+            await jobs.stop()
+
+    asyncio.run(_main())
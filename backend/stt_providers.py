@@ -0,0 +1,476 @@
+import asyncio
+import json
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from nls_session import SessionStats, WarmTranscriber
+from recognizer_manager import RecognizerManager
+from stt_engine import Emitter, FakeProvider, StreamingProvider, StreamingSession
+
+# 各家 sdk 只在用到的 provider 里 import，没装的 sdk 不影响其他 provider
+
+
+# ---------------------------------- aliyun nls 实时转写
+
+class AliyunProvider(StreamingProvider):
+    """阿里云 nls 实时转写。会话说话间隙不关（WarmTranscriber），sdk 的 send_audio 在单线程里同步发完，
+    帧直接以 memoryview 交出去不拷贝。"""
+
+    name = 'aliyun'
+    frame_size = 1280 * 2
+    copy_frames = False
+
+    def __init__(self, appkey, url, token_manager, session_stats=None, idle_window=30, flush_after=1.0,
+                 keepalive_interval=5.0, confidence_min=0.5, cost=0.0, max_sessions=0):
+        super().__init__(cost=cost, max_sessions=max_sessions)
+        self.appkey = appkey
+        self.url = url
+        self.token_manager = token_manager
+        self.session_stats = session_stats or SessionStats()
+        self.idle_window = idle_window
+        self.flush_after = flush_after
+        self.keepalive_interval = keepalive_interval
+        self.confidence_min = confidence_min
+
+    async def start(self):
+        await self.token_manager.start()
+
+    async def stop(self):
+        await self.token_manager.stop()
+
+    async def open(self, emitter, name, language=None):
+        return AliyunSession(self, emitter, name)
+
+    def stats(self):
+        stats = super().stats()
+        stats['nls'] = self.session_stats.stats()
+        stats['token'] = self.token_manager.stats()
+        return stats
+
+
+class AliyunSession(StreamingSession):
+    def __init__(self, provider: AliyunProvider, emitter: Emitter, name):
+        self.provider = provider
+        self.emitter = emitter
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # 说话间隙不关 nls 会话，见 nls_session.WarmTranscriber
+        self.warm = WarmTranscriber(
+            self.create_transcriber, self.executor, provider.session_stats,
+            start_kwargs=dict(
+                aformat="pcm",
+                enable_intermediate_result=True,
+                enable_punctuation_prediction=True,
+                enable_inverse_text_normalization=True
+            ),
+            idle_window=provider.idle_window,
+            flush_after=provider.flush_after,
+            keepalive_interval=provider.keepalive_interval,
+            name=name,
+        )
+
+    def create_transcriber(self, on_close):
+        import nls
+
+        def closed(*args):
+            logging.info(f'{self.name} - 识别通道关闭')
+            on_close()
+
+        return nls.NlsSpeechTranscriber(
+            url=self.provider.url,
+            token=self.provider.token_manager.get_token_sync(),
+            appkey=self.provider.appkey,
+            on_sentence_begin=self._on_sentence_begin,
+            on_sentence_end=self._on_sentence_end,
+            on_start=self._on_start,
+            on_result_changed=self._on_result_changed,
+            on_completed=self._on_completed,
+            on_error=self._on_error,
+            on_close=closed,
+        )
+
+    # 下面的回调都在 sdk 的线程里，解析好文本再交给事件循环
+
+    def _result(self, message):
+        try:
+            message = json.loads(message)
+            if message.get('payload', {}).get('confidence', 0) > self.provider.confidence_min:
+                return message.get('payload', {}).get('result', '')
+            logging.info('confidence is toooo low')
+        except Exception:
+            logging.exception(f'ops, parse nls result')
+        return None
+
+# 中间识别结果
+# {
+#     "header": {
+#         "namespace": "SpeechTranscriber",
+#         "name": "TranscriptionResultChanged",
+#         "status": 20000000,
+#         "message_id": "08c115289c214f18876d121ecf68f8a7",
+#         "task_id": "c71740af276548e9b9f0b606491bfd91",
+#         "status_text": "Gateway:SUCCESS:Success."
+#     },
+#     "payload": {
+#         "index": 1,
+#         "time": 2200,
+#         "result": "Hello hello hello hello. ",
+#         "confidence": 0.86,
+#         "words": [],
+#         "status": 0,
+#         "fixed_result": "",
+#         "unfixed_result": ""
+#     }
+# }
+    def _on_result_changed(self, message, *args):
+        text = self._result(message)
+        if text is not None:
+            self.emitter.interim_threadsafe(text)
+
+# 识别结束 消息格式
+# {
+#     "header": {
+#         "namespace": "SpeechTranscriber",
+#         "name": "SentenceEnd",
+#         ...
+#     },
+#     "payload": {
+#         "index": 1,
+#         "time": 2500,
+#         "result": "Hello hello hello 3 hello 4。Hello. ",
+#         "confidence": 0.827,
+#         "begin_time": 0,
+#         "sentence_id": "02a151e50b8c46838a07add2de97559f",
+#         ...
+#     }
+# }
+    def _on_sentence_end(self, message, *args):
+        logging.info(f'{self.name} - 识别结束')
+        text = self._result(message)
+        if text is not None:
+            self.emitter.final_threadsafe(text)
+
+    def _on_sentence_begin(self, message, *args):
+        logging.info(f'{self.name} - 识别开始: {message}')
+
+    def _on_start(self, message, *args):
+        logging.info(f'{self.name} - 识别启动: {message}')
+
+    def _on_error(self, message, *args):
+        logging.info(f'{self.name} - 识别错误: {message}')
+
+    def _on_completed(self, message, *args):
+        logging.info(f'{self.name} - 识别完成: {message}')
+
+    async def send(self, frame):
+        await self.warm.send(frame)
+
+    async def end_utterance(self):
+        await self.warm.end_utterance()
+
+    async def close(self):
+        await self.warm.close()
+        self.executor.shutdown(wait=False)
+
+
+# ---------------------------------- google streaming recognize
+
+class GoogleProvider(StreamingProvider):
+    """google 流式识别。每句话一个 streaming_recognize（single_utterance），句子结束后下一帧音频再开新的流；
+    所有连接共用 RecognizerManager 的名额和线程池。帧要先进队列等请求生成器读，所以拷成 bytes。"""
+
+    name = 'google'
+    frame_size = 3200
+    copy_frames = True
+
+    def __init__(self, client, streaming_config, manager: RecognizerManager, confidence_min=0.5, cost=0.0):
+        super().__init__(cost=cost, max_sessions=manager.max_streams)
+        from google.cloud import speech
+        self.speech = speech
+        self.client = client
+        self.streaming_config = streaming_config
+        self.manager = manager
+        self.confidence_min = confidence_min
+
+    async def stop(self):
+        self.manager.shutdown()
+
+    async def open(self, emitter, name, language=None):
+        await self.manager.admit()
+        return GoogleSession(self, emitter, name)
+
+    def stats(self):
+        stats = super().stats()
+        stats['recognizers'] = self.manager.stats()
+        return stats
+
+
+class GoogleSession(StreamingSession):
+    def __init__(self, provider: GoogleProvider, emitter: Emitter, name):
+        self.provider = provider
+        self.emitter = emitter
+        self.name = name
+        self.audio_async_queue = asyncio.Queue()
+        self.is_running = False
+        self.process_task = None
+
+    async def start(self):
+        self.is_running = True
+        logging.info(f'{self.name} - recog start')
+        self.process_task = asyncio.create_task(self._process_audio_data())
+
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            logging.info(f'{self.name} - recog stop')
+            await self.audio_async_queue.put(None)  # 发送终止信号
+            if self.process_task:
+                await self.process_task
+
+    async def send(self, frame):
+        if not self.is_running:
+            await self.start()
+        await self.audio_async_queue.put(frame)
+
+    async def end_utterance(self):
+        # 结束这个识别流拿最终结果，下一句话再开新的
+        await self.stop()
+
+    async def close(self):
+        try:
+            await self.stop()
+        finally:
+            self.provider.manager.release()
+
+    async def _process_audio_data(self):
+        speech = self.provider.speech
+        sync_queue = queue.Queue()
+        results = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def sync_generator():
+            while True:
+                try:
+                    chunk = sync_queue.get(timeout=1)
+                    if chunk is None:
+                        break
+                    yield speech.StreamingRecognizeRequest(audio_content=chunk)
+                except queue.Empty:
+                    continue
+
+        async def async_to_sync_queue():
+            # 一直转到终止信号为止；stop() 先把 is_running 置 False 再放 None，按 is_running 退出会把 None 漏掉
+            while True:
+                chunk = await self.audio_async_queue.get()
+                if chunk is None:
+                    sync_queue.put(None)
+                    break
+                sync_queue.put(chunk)
+
+        def recognize():
+            # 逐条读响应也会阻塞，整个流都放在线程池里跑，响应转回事件循环
+            try:
+                responses = self.provider.client.streaming_recognize(self.provider.streaming_config, sync_generator())
+                for response in responses:
+                    loop.call_soon_threadsafe(results.put_nowait, response)
+            finally:
+                loop.call_soon_threadsafe(results.put_nowait, None)
+
+        async_to_sync_queue_task = asyncio.create_task(async_to_sync_queue())
+
+        try:
+            recognize_task = asyncio.create_task(self.provider.manager.run_stream(recognize))
+            while True:
+                response = await results.get()
+                if response is None:
+                    break
+                for result in response.results:
+                    if result.is_final:
+                        # 选择置信度最高的替代结果
+                        best_alternative = max(result.alternatives, key=lambda alt: alt.confidence)
+                        if best_alternative.confidence > self.provider.confidence_min:
+                            self.emitter.final(best_alternative.transcript)
+                        else:
+                            logging.info(f'confidence is too low={best_alternative.confidence}')
+                    else:
+                        # 对于非最终结果，我们仍然可以只使用第一个替代结果
+                        self.emitter.interim(result.alternatives[0].transcript)
+            await recognize_task
+
+        except Exception:
+            logging.exception(f"Error in audio processing.")
+        finally:
+            self.is_running = False
+            sync_queue.put(None)  # 流被提前结束时让请求生成器退出
+            async_to_sync_queue_task.cancel()
+            try:
+                await async_to_sync_queue_task
+            except asyncio.CancelledError:
+                pass
+
+
+# ---------------------------------- deepgram live
+
+class DeepgramProvider(StreamingProvider):
+    """deepgram 实时转写（deepgram-sdk 3.x 的异步 websocket 客户端），linear16 直接发，不用转码。
+    encoding=None 时发的是带容器的音频（m4a/mp3/wav 文件的字节），由 deepgram 自己识别格式。
+    deepgram 的 is_final 是一小段一小段的，攒到 speech_final（或者我们 finalize）才作为一句话的最终结果。"""
+
+    name = 'deepgram'
+    frame_size = 3200
+    copy_frames = True
+
+    def __init__(self, api_key, model='nova-2', default_language='zh-CN', endpointing_ms=300, cost=0.0,
+                 max_sessions=0, encoding='linear16'):
+        super().__init__(cost=cost, max_sessions=max_sessions)
+        from deepgram import DeepgramClient
+        self.client = DeepgramClient(api_key)
+        self.model = model
+        self.default_language = default_language
+        self.endpointing_ms = endpointing_ms
+        self.encoding = encoding
+
+    def live_connection(self):
+        listen = self.client.listen
+        # 3.4 以前叫 asynclive
+        live = listen.asyncwebsocket if hasattr(listen, 'asyncwebsocket') else listen.asynclive
+        return live.v('1')
+
+    def options(self, language):
+        from deepgram import LiveOptions
+        raw = {}
+        if self.encoding is not None:
+            raw = dict(encoding=self.encoding, sample_rate=16000, channels=1)
+        return LiveOptions(
+            model=self.model,
+            language=language or self.default_language,
+            interim_results=True,
+            smart_format=True,
+            punctuate=True,
+            endpointing=self.endpointing_ms,
+            **raw,
+        )
+
+    async def open(self, emitter, name, language=None):
+        session = DeepgramSession(self, emitter, name, language or self.default_language)
+        await session.start()
+        return session
+
+
+class DeepgramSession(StreamingSession):
+    def __init__(self, provider: DeepgramProvider, emitter: Emitter, name, language):
+        self.provider = provider
+        self.emitter = emitter
+        self.name = name
+        self.language = language
+        # 中文不加空格
+        self.separator = ' ' if language.startswith('en') else ''
+        self.connection = None
+        self.finished = []  # 这句话里已经 is_final 的片段
+        self.finalizing = False
+
+    async def start(self):
+        from deepgram import LiveTranscriptionEvents
+        self.connection = self.provider.live_connection()
+        self.connection.on(LiveTranscriptionEvents.Transcript, self._on_transcript)
+        self.connection.on(LiveTranscriptionEvents.Error, self._on_error)
+        if await self.connection.start(self.provider.options(self.language)) is False:
+            raise ConnectionError('deepgram live connection failed to start')
+
+    async def _on_transcript(self, client, result=None, **kwargs):
+        text = result.channel.alternatives[0].transcript
+        if not result.is_final:
+            if text:
+                self.emitter.interim(self.separator.join(self.finished + [text]))
+            return
+        if text:
+            self.finished.append(text)
+        if result.speech_final or self.finalizing or getattr(result, 'from_finalize', False):
+            self.finalizing = False
+            if self.finished:
+                self.emitter.final(self.separator.join(self.finished))
+                self.finished = []
+        elif text:
+            self.emitter.interim(self.separator.join(self.finished))
+
+    async def _on_error(self, client, error=None, **kwargs):
+        logging.error(f'{self.name} - deepgram error: {error}')
+
+    async def send(self, frame):
+        await self.connection.send(frame)
+
+    async def end_utterance(self):
+        # 让服务端马上把缓冲的音频出结果，不等 endpointing
+        if hasattr(self.connection, 'finalize'):
+            self.finalizing = True
+            await self.connection.finalize()
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.finish()
+        if self.finished:
+            self.emitter.final(self.separator.join(self.finished))
+            self.finished = []
+
+
+# ---------------------------------- 按配置建 provider
+
+def providers_from_config(config, names=None, confidence_min=0.5, sentence_complete_sec=1):
+    """按 config.py 里配了哪家的 key 建 provider，names 不为空时只建其中的几家；
+    fake 要 STT_FAKE_PROVIDER = True 才有，线上别开"""
+    cost = getattr(config, 'STT_PROVIDER_COST', {})
+    wanted = lambda name: names is None or name in names
+    providers = {}
+    if wanted('aliyun') and getattr(config, 'ALIYUN_STT_APP_KEY', None):
+        from aliyun_credentials import AliyunTokenManager
+        providers['aliyun'] = AliyunProvider(
+            appkey=config.ALIYUN_STT_APP_KEY,
+            url=getattr(config, 'ALIYUN_NLS_URL', "wss://nls-gateway-cn-shanghai.aliyuncs.com/ws/v1"),
+            token_manager=AliyunTokenManager(),
+            session_stats=SessionStats(),
+            idle_window=getattr(config, 'NLS_IDLE_WINDOW', 30),
+            flush_after=sentence_complete_sec,
+            keepalive_interval=getattr(config, 'NLS_KEEPALIVE_SEC', 5),
+            confidence_min=confidence_min,
+            cost=cost.get('aliyun', 0.0),
+        )
+    if wanted('google') and getattr(config, 'CREDENTIALS_FILE', None):
+        from google.cloud import speech
+        from google.oauth2 import service_account
+        from google.protobuf import duration_pb2
+        credentials = service_account.Credentials.from_service_account_file(config.CREDENTIALS_FILE)
+        streaming_config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                sample_rate_hertz=16000,
+                language_code="zh-CN",
+                alternative_language_codes=["en-US",],
+                enable_automatic_punctuation=True,
+                model="command_and_search",
+            ),
+            interim_results=True,
+            single_utterance=True,
+            enable_voice_activity_events=True,
+            voice_activity_timeout=speech.StreamingRecognitionConfig.VoiceActivityTimeout(
+                speech_end_timeout=duration_pb2.Duration(seconds=1)
+            )
+        )
+        manager = RecognizerManager(
+            max_streams=getattr(config, 'GOOGLE_MAX_STREAMS', 50),
+            max_waiting=getattr(config, 'GOOGLE_MAX_WAITING', 10),
+            admit_timeout=getattr(config, 'GOOGLE_ADMIT_TIMEOUT', 5),
+        )
+        providers['google'] = GoogleProvider(speech.SpeechClient(credentials=credentials), streaming_config,
+                                             manager, confidence_min=confidence_min,
+                                             cost=cost.get('google', 0.0))
+    if wanted('deepgram') and getattr(config, 'DEEPGRAM_API_KEY', None):
+        providers['deepgram'] = DeepgramProvider(
+            config.DEEPGRAM_API_KEY,
+            model=getattr(config, 'DEEPGRAM_MODEL', 'nova-2'),
+            max_sessions=getattr(config, 'DEEPGRAM_MAX_SESSIONS', 0),
+            cost=cost.get('deepgram', 0.0),
+        )
+    if wanted('fake') and getattr(config, 'STT_FAKE_PROVIDER', False):
+        providers['fake'] = FakeProvider(cost=cost.get('fake', 0.0))
+    return providers
@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from history_store import HistoryStore, LEGACY_SUFFIX
+
+
+async def fill(store, days):
+    """days: {'YYYYMMDD': [content, ...]}"""
+    for date, contents in days.items():
+        for i, content in enumerate(contents):
+            now = datetime.strptime(date, '%Y%m%d').replace(hour=9, minute=i)
+            await store.append('138', i % 2 == 0, content, now)
+
+
+async def read_all(store, start, end, limit=None, order='asc'):
+    """按 next_cursor 一页一页读到底，返回每页的内容"""
+    pages = []
+    cursor = None
+    while True:
+        page = await store.page('138', start, end, cursor, limit, order)
+        pages.append([json.loads(line)['content'] async for line in store.iter_page('138', page)])
+        cursor = page.next_cursor
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip_across_days(tmp_path, run):
+    store = HistoryStore(str(tmp_path))
+    run(fill(store, {'20260101': ['a1', 'a2', 'a3'], '20260102': ['b1', 'b2']}))
+    pages = run(read_all(store, '20260101', '20260102', limit=2))
+    assert pages == [['a1', 'a2'], ['a3', 'b1'], ['b2']]
+
+
+def test_without_limit_returns_everything(tmp_path, run):
+    store = HistoryStore(str(tmp_path))
+    run(fill(store, {'20260101': ['a1', 'a2'], '20260103': ['c1']}))
+    assert run(read_all(store, '20260101', '20260103')) == [['a1', 'a2', 'c1']]
+
+
+def test_desc_order(tmp_path, run):
+    store = HistoryStore(str(tmp_path))
+    run(fill(store, {'20260101': ['a1', 'a2', 'a3'], '20260102': ['b1', 'b2']}))
+    pages = run(read_all(store, '20260101', '20260102', limit=2, order='desc'))
+    assert pages == [['b2', 'b1'], ['a3', 'a2'], ['a1']]
+
+
+def test_legacy_json_comes_first(tmp_path, run):
+    store = HistoryStore(str(tmp_path))
+    day = datetime(2026, 1, 1)
+    legacy_path = store.day_path('138', day, LEGACY_SUFFIX)
+    os.makedirs(os.path.dirname(legacy_path))
+    with open(legacy_path, 'w', encoding='utf-8') as f:
+        json.dump([{'time': '2026-01-01 08:00:00', 'sentbyme': True, 'content': 'old1'},
+                   {'time': '2026-01-01 08:01:00', 'sentbyme': False, 'content': 'old2'}], f)
+    run(fill(store, {'20260101': ['new1']}))
+    assert run(read_all(store, '20260101', '20260101', limit=2)) == [['old1', 'old2'], ['new1']]
+    assert run(read_all(store, '20260101', '20260101', order='desc')) == [['new1', 'old2', 'old1']]
+
+
+def test_stale_index_is_rebuilt_on_append(tmp_path, run):
+    store = HistoryStore(str(tmp_path))
+    run(fill(store, {'20260101': ['a1']}))
+    # 写了 .jsonl 还没写 .idx 进程就退出了
+    with open(store.day_path('138', datetime(2026, 1, 1)), 'ab') as f:
+        f.write(json.dumps({'time': '2026-01-01 09:30:00', 'sentbyme': True, 'content': 'lost'}).encode() + b'\n')
+    run(store.append('138', False, 'a2', datetime(2026, 1, 1, 10)))
+    assert run(read_all(store, '20260101', '20260101', limit=1)) == [['a1'], ['lost'], ['a2']]
+
+
+@pytest.mark.parametrize('cursor', ['20260101:-1', '../../x:0', '2026010a:1', '20260101:', '20260101', '２０２６０１０１:1'])
+def test_bad_cursor_is_rejected(tmp_path, run, cursor):
+    store = HistoryStore(str(tmp_path))
+    run(fill(store, {'20260101': ['a1']}))
+    with pytest.raises(ValueError):
+        run(store.page('138', '20260101', '20260101', cursor, 1))
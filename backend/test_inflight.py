@@ -0,0 +1,89 @@
+import asyncio
+
+from inflight import InflightReplies
+
+
+class Source:
+    """先给出 chunks，然后一直挂着（模拟还在等上游），记下有没有被关掉"""
+
+    def __init__(self, chunks, hang=True):
+        self.chunks = chunks
+        self.hang = hang
+        self.closed = asyncio.Event()
+
+    async def generate(self):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+            if self.hang:
+                await asyncio.Event().wait()
+        finally:
+            self.closed.set()
+
+
+def test_completes_normally(run):
+    async def scenario():
+        replies = InflightReplies()
+        source = Source([b'1', b'2'], hang=False)
+        chunks = [chunk async for chunk in replies.run('m1', 'u1', source.generate())]
+        return chunks, replies
+
+    chunks, replies = run(scenario())
+    assert chunks == [b'1', b'2']
+    assert replies.stats()['completed'] == 1
+    assert 'm1' not in replies
+
+
+def test_disconnect_cancels_the_pump(run):
+    async def scenario():
+        replies = InflightReplies()
+        source = Source([b'1', b'2'])
+        stream = replies.run('m1', 'u1', source.generate())
+        first = await stream.__anext__()
+        # StreamingResponse 在客户端断开时就是这样关掉生成器的
+        await stream.aclose()
+        await asyncio.wait_for(source.closed.wait(), 1)
+        return first, replies
+
+    first, replies = run(scenario())
+    assert first == b'1'
+    stats = replies.stats()
+    assert stats['disconnected'] == 1
+    assert stats['completed'] == 0
+    assert stats['inflight'] == 0
+
+
+def test_cancel_ends_the_stream_after_queued_chunks(run):
+    async def scenario():
+        replies = InflightReplies()
+        source = Source([b'1', b'2', b'3'])
+        stream = replies.run('m1', 'u1', source.generate())
+        chunks = [await stream.__anext__()]
+        # 让 pump 把剩下的都放进队列，然后挂在上游上
+        await asyncio.sleep(0.01)
+        assert replies.cancel('m1', 'u1')
+        async for chunk in stream:
+            chunks.append(chunk)
+        return chunks, source, replies
+
+    chunks, source, replies = run(scenario())
+    assert chunks == [b'1', b'2', b'3']
+    assert source.closed.is_set()
+    stats = replies.stats()
+    assert stats['cancelled'] == 1
+    assert stats['completed'] == 0
+    assert stats['disconnected'] == 0
+    assert 'm1' not in replies
+
+
+def test_cancel_only_own_reply(run):
+    async def scenario():
+        replies = InflightReplies()
+        stream = replies.run('m1', 'u1', Source([b'1']).generate())
+        await stream.__anext__()
+        other = replies.cancel('m1', 'u2')
+        missing = replies.cancel('m2')
+        await stream.aclose()
+        return other, missing
+
+    assert run(scenario()) == (False, False)
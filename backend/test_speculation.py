@@ -0,0 +1,175 @@
+import asyncio
+import types
+
+import speculation
+from speculation import SpeculativeReplies, StableInterims, normalize
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def gated_chat(gate, sentences=('你好。', '我在。')):
+    """gate set 之前不出第一句，模拟 llm 首句还没回来"""
+    async def chat(user, text):
+        await gate.wait()
+        for sentence in sentences:
+            yield sentence
+    return chat
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_normalize_ignores_punctuation_and_case():
+    assert normalize('Hello, 你好！') == normalize('hello你好')
+    assert normalize(None) == ''
+
+
+def test_hit_when_only_punctuation_differs(run):
+    async def scenario():
+        gate = asyncio.Event()
+        gate.set()
+        replies = SpeculativeReplies(gated_chat(gate))
+        replies.start('u1', '今天天气怎么样')
+        await settle()
+        spec = replies.take('u1', '今天天气怎么样？')
+        sentences = [sentence async for sentence in spec.replay()]
+        return sentences, replies.stats()
+
+    sentences, stats = run(scenario())
+    assert sentences == ['你好。', '我在。']
+    assert stats['hits'] == 1
+    assert stats['hit_rate'] == 1.0
+    assert stats['pending'] == 0
+    assert stats['first_sentence_ready_rate'] == 1.0
+
+
+def test_miss_cancels_the_speculation(run):
+    async def scenario():
+        replies = SpeculativeReplies(gated_chat(asyncio.Event()))
+        spec = replies.start('u1', '今天天气')
+        missed = replies.take('u1', '今天天气怎么样')
+        await settle()
+        return missed, spec, replies.stats()
+
+    missed, spec, stats = run(scenario())
+    assert missed is None
+    assert spec.task.cancelled()
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.0
+
+
+def test_final_text_change_drops_early(run):
+    async def scenario():
+        replies = SpeculativeReplies(gated_chat(asyncio.Event()))
+        replies.start('u1', '打开')
+        replies.final('u1', '打开。')  # 只差标点，留着
+        kept = replies.stats()['pending']
+        replies.final('u1', '打开空调')
+        return kept, replies.take('u1', '打开空调'), replies.stats()
+
+    kept, taken, stats = run(scenario())
+    assert kept == 1
+    assert taken is None
+    assert stats['changed'] == 1
+    assert stats['misses'] == 0
+
+
+def test_new_stable_text_supersedes(run):
+    async def scenario():
+        replies = SpeculativeReplies(gated_chat(asyncio.Event()))
+        first = replies.start('u1', '打开')
+        same = replies.start('u1', '打开！')
+        second = replies.start('u1', '打开空调')
+        await settle()
+        await replies.stop()
+        return first, same, second, replies.stats()
+
+    first, same, second, stats = run(scenario())
+    assert same is first
+    assert first.task.cancelled()
+    assert second is not first
+    assert stats['started'] == 2
+    assert stats['superseded'] == 1
+
+
+def test_saved_ms_is_capped_by_head_start(run, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(speculation, 'time', types.SimpleNamespace(perf_counter=clock))
+
+    async def scenario():
+        gate = asyncio.Event()
+        replies = SpeculativeReplies(gated_chat(gate))
+        replies.start('u1', '讲个笑话')
+        # 提前跑了 0.3 秒正式请求就来了，llm 到 1.0 秒才出第一句：只省下 0.3 秒
+        clock.now += 0.3
+        spec = replies.take('u1', '讲个笑话')
+        clock.now += 0.7
+        gate.set()
+        await asyncio.wait_for(spec.task, 1)
+        return replies.stats()
+
+    assert run(scenario())['saved_ms']['avg'] == 300.0
+
+
+def test_saved_ms_is_capped_by_first_sentence(run, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(speculation, 'time', types.SimpleNamespace(perf_counter=clock))
+
+    async def scenario():
+        gate = asyncio.Event()
+        replies = SpeculativeReplies(gated_chat(gate))
+        spec = replies.start('u1', '讲个笑话')
+        # llm 0.2 秒就出了第一句，正式请求 1.5 秒才来：省下的是 llm 首句那 0.2 秒
+        clock.now += 0.2
+        gate.set()
+        await asyncio.wait_for(spec.task, 1)
+        clock.now += 1.3
+        replies.take('u1', '讲个笑话')
+        return replies.stats()
+
+    assert run(scenario())['saved_ms']['avg'] == 200.0
+
+
+def test_sweep_expires_stale_speculations(run, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(speculation, 'time', types.SimpleNamespace(perf_counter=clock))
+
+    async def scenario():
+        replies = SpeculativeReplies(gated_chat(asyncio.Event()), ttl=15)
+        replies.start('u1', '早')
+        clock.now += 10
+        replies.start('u2', '晚')
+        clock.now += 10
+        expired = replies.sweep()
+        return expired, replies.take('u1', '早'), replies.stats()
+
+    expired, taken, stats = run(scenario())
+    assert expired == 1
+    assert taken is None
+    assert stats['expired'] == 1
+    assert stats['pending'] == 1
+
+
+def test_stable_interims_fire_once_per_text(run):
+    async def scenario():
+        fired = []
+        stable = StableInterims(10, fired.append)
+        stable.update('你好')
+        stable.update('你好吗')
+        await asyncio.sleep(0.03)
+        stable.update('你好吗？')  # 只差标点，不重新计时
+        await asyncio.sleep(0.03)
+        stable.reset()
+        stable.update('你好吗')
+        await asyncio.sleep(0.03)
+        return fired
+
+    assert run(scenario()) == ['你好吗', '你好吗']
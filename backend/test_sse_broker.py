@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from sse_broker import MessageBroker
+
+
+async def collect(broker, msg_id, timeout=1, offset=0):
+    return [item async for item in broker.subscribe(msg_id, timeout, offset)]
+
+
+def test_late_subscriber_replays_buffer(run):
+    async def scenario():
+        broker = MessageBroker()
+        broker.publish('m1', 'a')
+        broker.publish('m1', 'b')
+        broker.close('m1')
+        return await collect(broker, 'm1'), await collect(broker, 'm1', offset=1)
+
+    assert run(scenario()) == (['a', 'b'], ['b'])
+
+
+def test_live_subscribers_all_get_every_message(run):
+    async def scenario():
+        broker = MessageBroker()
+        readers = [asyncio.create_task(collect(broker, 'm1')) for _ in range(2)]
+        await asyncio.sleep(0)
+        for item in ('a', 'b', 'c'):
+            broker.publish('m1', item)
+            await asyncio.sleep(0)
+        broker.close('m1')
+        return await asyncio.gather(*readers), broker
+
+    results, broker = run(scenario())
+    assert results == [['a', 'b', 'c'], ['a', 'b', 'c']]
+    assert broker.closed('m1')
+
+
+def test_publish_after_close_is_dropped(run):
+    async def scenario():
+        broker = MessageBroker()
+        broker.publish('m1', 'a')
+        broker.close('m1')
+        broker.publish('m1', 'late')
+        return await collect(broker, 'm1')
+
+    assert run(scenario()) == ['a']
+
+
+def test_lagging_subscriber_skips_evicted_messages(run):
+    async def scenario():
+        broker = MessageBroker(max_buffer=2)
+        for item in ('a', 'b', 'c'):
+            broker.publish('m1', item)
+        broker.close('m1')
+        return await collect(broker, 'm1'), broker.depth()
+
+    assert run(scenario()) == (['b', 'c'], 2)
+
+
+def test_idle_subscription_times_out(run):
+    async def scenario():
+        broker = MessageBroker()
+        broker.publish('m1', 'a')
+        seen = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for item in broker.subscribe('m1', timeout=0.01):
+                seen.append(item)
+        return seen
+
+    assert run(scenario()) == ['a']
+
+
+def test_discard_ends_subscription_and_forgets_topic(run):
+    async def scenario():
+        broker = MessageBroker()
+        reader = asyncio.create_task(collect(broker, 'm1'))
+        broker.publish('m1', 'a')
+        await asyncio.sleep(0)
+        broker.discard('m1')
+        return await asyncio.wait_for(reader, 1), broker
+
+    items, broker = run(scenario())
+    assert items == ['a']
+    assert 'm1' not in broker
+
+
+def test_sweep_keeps_topics_with_subscribers(run):
+    async def scenario():
+        broker = MessageBroker(ttl=0)
+        broker.publish('idle', 'a')
+        reader = asyncio.create_task(collect(broker, 'busy'))
+        await asyncio.sleep(0.01)
+        expired = broker.sweep()
+        broker.close('busy')
+        await reader
+        return expired, broker
+
+    expired, broker = run(scenario())
+    assert expired == 1
+    assert 'idle' not in broker
+    assert 'busy' in broker
@@ -0,0 +1,177 @@
+import asyncio
+import os
+
+import pytest
+
+from stt_client import FakeTranscriber, TranscriptionError
+from stt_jobs import DONE, FAILED, QUEUED, TranscriptionJobs
+
+
+def audio_file(tmp_path, name='a.m4a'):
+    path = tmp_path / name
+    path.write_bytes(b'\0' * 16)
+    return str(path)
+
+
+def new_jobs(tmp_path, transcribers, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return TranscriptionJobs(str(tmp_path / 'jobs'), transcribers, **kwargs)
+
+
+def test_submit_and_wait(tmp_path, run):
+    fake = FakeTranscriber(delay=0)
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'fake': fake.request})
+        await jobs.start()
+        submitted = await jobs.submit(audio_file(tmp_path), provider='fake', user='138')
+        job = await jobs.wait(submitted['job_id'], timeout=1)
+        await jobs.stop()
+        return submitted, job, jobs
+
+    submitted, job, jobs = run(scenario())
+    assert submitted['status'] == QUEUED
+    assert 'audio_path' not in submitted
+    assert job['status'] == DONE
+    assert job['result'] == f"fake transcript: {submitted['job_id']}.m4a"
+    assert job['user'] == '138'
+    assert job['attempts'] == 1
+    # 复制进来的音频跑完就删，只留状态记录
+    assert os.listdir(jobs.directory) == [submitted['job_id'] + '.json']
+
+
+def test_retryable_failure_is_retried(tmp_path, run):
+    fake = FakeTranscriber(delay=0, fail_times=2)
+    updates = []
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'fake': fake.request}, on_update=lambda job: updates.append(job['status']))
+        await jobs.start()
+        submitted = await jobs.submit(audio_file(tmp_path), provider='fake')
+        job = await jobs.wait(submitted['job_id'], timeout=1)
+        await jobs.stop()
+        return job, jobs.stats()
+
+    job, stats = run(scenario())
+    assert job['status'] == DONE
+    assert job['attempts'] == 3
+    assert job['error'] is None
+    assert stats['retries'] == 2
+    assert updates == ['running', 'queued', 'running', 'queued', 'running', 'done']
+
+
+def test_gives_up_after_max_attempts(tmp_path, run):
+    fake = FakeTranscriber(delay=0, fail_times=10)
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'fake': fake.request}, max_attempts=2)
+        await jobs.start()
+        submitted = await jobs.submit(audio_file(tmp_path), provider='fake')
+        job = await jobs.wait(submitted['job_id'], timeout=1)
+        await jobs.stop()
+        return job, jobs.stats()
+
+    job, stats = run(scenario())
+    assert job['status'] == FAILED
+    assert job['attempts'] == 2
+    assert job['error'] == 'fake failure 2'
+    assert stats['failed'] == 1
+
+
+def test_permanent_failure_is_not_retried(tmp_path, run):
+    async def reject(path):
+        raise TranscriptionError('bad audio', status=400)
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'reject': reject})
+        await jobs.start()
+        submitted = await jobs.submit(audio_file(tmp_path), provider='reject')
+        job = await jobs.wait(submitted['job_id'], timeout=1)
+        await jobs.stop()
+        return job
+
+    job = run(scenario())
+    assert job['status'] == FAILED
+    assert job['attempts'] == 1
+
+
+def test_unknown_provider_is_rejected(tmp_path, run):
+    async def scenario():
+        jobs = new_jobs(tmp_path, {})
+        await jobs.start()
+        try:
+            await jobs.submit(audio_file(tmp_path), provider='nope')
+        finally:
+            await jobs.stop()
+
+    with pytest.raises(ValueError):
+        run(scenario())
+
+
+def test_unfinished_jobs_are_requeued_on_restart(tmp_path, run):
+    async def scenario():
+        running = asyncio.Event()
+
+        async def hang(path):
+            running.set()
+            await asyncio.Event().wait()
+
+        first = new_jobs(tmp_path, {'fake': hang})
+        await first.start()
+        submitted = await first.submit(audio_file(tmp_path), provider='fake', copy=False)
+        await asyncio.wait_for(running.wait(), 1)
+        await first.stop()
+
+        fake = FakeTranscriber(delay=0)
+        second = new_jobs(tmp_path, {'fake': fake.request})
+        await second.start()
+        job = await second.wait(submitted['job_id'], timeout=1)
+        await second.stop()
+        return job
+
+    job = run(scenario())
+    assert job['status'] == DONE
+    assert job['attempts'] == 2
+    # copy=False 引用的是调用方的文件，不删
+    assert os.path.exists(tmp_path / 'a.m4a')
+
+
+def test_wait_times_out(tmp_path, run):
+    async def hang(path):
+        await asyncio.Event().wait()
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'hang': hang})
+        await jobs.start()
+        submitted = await jobs.submit(audio_file(tmp_path), provider='hang')
+        try:
+            await jobs.wait(submitted['job_id'], timeout=0.01)
+        finally:
+            await jobs.stop()
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(scenario())
+
+
+def test_provider_limit_caps_concurrency(tmp_path, run):
+    active = []
+    peak = []
+
+    async def slow(path):
+        active.append(path)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(path)
+        return 'ok'
+
+    async def scenario():
+        jobs = new_jobs(tmp_path, {'slow': slow}, workers=4, provider_limits={'slow': 2})
+        await jobs.start()
+        submitted = [await jobs.submit(audio_file(tmp_path, f'{i}.m4a'), provider='slow') for i in range(6)]
+        results = [await jobs.wait(job['job_id'], timeout=1) for job in submitted]
+        await jobs.stop()
+        return results
+
+    results = run(scenario())
+    assert [job['status'] for job in results] == [DONE] * 6
+    assert max(peak) == 2
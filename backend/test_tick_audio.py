@@ -0,0 +1,95 @@
+import numpy as np
+
+from tick_audio import TickAnalyzer, adts_frames
+
+
+def adts_frame(level, channels=1, payload=9):
+    """一个合成的 adts 帧：7 字节帧头 + payload 字节，payload 全是 level，假解码器把它当幅度"""
+    length = 7 + payload
+    header = bytes([
+        0xFF, 0xF1,
+        (1 << 6) | (4 << 2) | (channels >> 2),
+        ((channels & 0x03) << 6) | (length >> 11),
+        (length >> 3) & 0xFF,
+        ((length & 0x07) << 5) | 0x1F,
+        0xFC,
+    ])
+    return header + bytes([level]) * payload
+
+
+class FakeTranscoder:
+    """按帧头切帧，每帧出 1024 * 声道数个采样，值是 payload 字节 * 100；记下每次解码的字节"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def transcode(self, source, target, source_format=None):
+        assert (target, source_format) == ('s16le', 'aac')
+        self.calls.append(source)
+        pcm = [np.full(samples * channels, source[begin + 7] * 100, dtype=np.int16)
+               for begin, _, samples, channels in adts_frames(source)]
+        return np.concatenate(pcm).tobytes()
+
+
+def test_adts_frames_parses_complete_frames():
+    data = adts_frame(1) + adts_frame(2, channels=2)
+    assert adts_frames(data) == [(0, 16, 1024, 1), (16, 32, 1024, 2)]
+    # 还在录的最后一帧不算
+    assert adts_frames(data + adts_frame(3)[:10]) == [(0, 16, 1024, 1), (16, 32, 1024, 2)]
+    assert adts_frames(data, 16) == [(16, 32, 1024, 2)]
+
+
+def test_adts_frames_rejects_non_adts():
+    assert adts_frames(b'ID3\x04' + bytes(32)) is None
+    assert adts_frames(adts_frame(1) + b'garbage!' * 2) == [(0, 16, 1024, 1)]
+
+
+def test_only_new_frames_are_decoded(run):
+    transcoder = FakeTranscoder()
+    analyzer = TickAnalyzer(overlap_frames=1, transcoder=transcoder)
+    first = adts_frame(1) + adts_frame(5)
+    second = first + adts_frame(2) + adts_frame(3)
+
+    async def scenario():
+        return await analyzer.update('a.aac', first), await analyzer.update('a.aac', second)
+
+    r1, r2 = run(scenario())
+    assert (r1.new_samples, r1.tail_peak, r1.peak) == (2048, 500, 500)
+    # 往前多解一帧（幅度 500）给解码器对齐，输出丢掉，不算进新增部分
+    assert (r2.new_samples, r2.tail_peak, r2.peak) == (2048, 300, 500)
+    assert transcoder.calls == [first, second[16:]]
+    stats = analyzer.stats()
+    assert stats['incremental'] == 2
+    assert stats['full_decodes'] == 0
+    assert stats['bytes_decoded'] == len(first) + len(second) - 16
+
+
+def test_unchanged_file_decodes_nothing(run):
+    transcoder = FakeTranscoder()
+    analyzer = TickAnalyzer(transcoder=transcoder)
+    data = adts_frame(4) + adts_frame(1)[:10]
+
+    async def scenario():
+        return await analyzer.update('a.aac', data), await analyzer.update('a.aac', data)
+
+    r1, r2 = run(scenario())
+    assert (r1.new_samples, r1.peak) == (1024, 400)
+    assert (r2.new_samples, r2.tail_peak, r2.peak) == (0, 0, 400)
+    assert len(transcoder.calls) == 1
+
+
+def test_rewritten_file_is_analysed_again(run):
+    transcoder = FakeTranscoder()
+    analyzer = TickAnalyzer(transcoder=transcoder)
+    old = adts_frame(9) + adts_frame(9)
+    new = adts_frame(2, channels=2)
+
+    async def scenario():
+        await analyzer.update('a.aac', old)
+        return await analyzer.update('a.aac', new)
+
+    result = run(scenario())
+    # 同名文件重新录了，之前的最大幅度不能带过来
+    assert (result.new_samples, result.tail_peak, result.peak) == (1024, 200, 200)
+    assert transcoder.calls[-1] == new
+    assert analyzer.stats()['resets'] == 1
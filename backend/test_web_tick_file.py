@@ -0,0 +1,9 @@
+import importlib
+import sys
+
+
+def test_import(stub_config, monkeypatch):
+    # 模块级的初始化顺序写错了（比如用到还没定义的常量），服务直接起不来
+    monkeypatch.delitem(sys.modules, 'web_tick_file', raising=False)
+    module = importlib.import_module('web_tick_file')
+    assert module.stt_jobs.max_attempts >= 1
@@ -0,0 +1,165 @@
+import asyncio
+
+from ws_sender import SenderStats, TranscriptSender
+
+
+class FakeWebSocket:
+    """记下发出去的消息；gate 没 set 时 send 卡住，模拟收得慢的客户端"""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+
+class BrokenWebSocket(FakeWebSocket):
+    async def send_text(self, text):
+        raise ConnectionError('gone')
+
+
+async def blocked_sender(max_queue=32):
+    """第一条消息已经被发送协程取走、卡在 send 上，后面的都在排队"""
+    websocket = FakeWebSocket()
+    websocket.gate.clear()
+    sender = TranscriptSender(websocket, SenderStats(), max_queue=max_queue, name='test')
+    sender.start()
+    sender.interim('first')
+    await asyncio.sleep(0)
+    return websocket, sender
+
+
+def test_interims_coalesce_while_client_is_slow(run):
+    async def scenario():
+        websocket, sender = await blocked_sender()
+        for text in ('a', 'ab', 'abc'):
+            sender.interim(text)
+        assert sender.depth == 1
+        websocket.gate.set()
+        await sender.close()
+        return websocket.sent, sender.stats.counters
+
+    sent, counters = run(scenario())
+    assert sent == ['first']  # close 时队尾没发的中间结果直接扔
+    assert counters['coalesced'] == 2
+
+
+def test_latest_interim_is_sent(run):
+    async def scenario():
+        websocket, sender = await blocked_sender()
+        for text in ('a', 'ab', 'abc'):
+            sender.interim(text)
+        websocket.gate.set()
+        while sender.depth:
+            await asyncio.sleep(0)
+        await sender.close()
+        return websocket.sent
+
+    assert run(scenario()) == ['first', 'abc']
+
+
+def test_final_supersedes_pending_interim_and_keeps_order(run):
+    async def scenario():
+        websocket, sender = await blocked_sender()
+        sender.interim('一句')
+        sender.final('<|final|>一句话。')
+        sender.interim('第二')
+        sender.final('<|final|>第二句。')
+        websocket.gate.set()
+        await sender.close()
+        return websocket.sent, sender.stats.counters
+
+    sent, counters = run(scenario())
+    assert sent == ['first', '<|final|>一句话。', '<|final|>第二句。']
+    assert counters['superseded'] == 2
+    assert counters['finals_sent'] == 2
+
+
+def test_full_queue_drops_interims_but_never_finals(run):
+    async def scenario():
+        websocket, sender = await blocked_sender(max_queue=2)
+        sender.final('f1')
+        sender.final('f2')
+        sender.interim('dropped')
+        sender.final('f3')
+        websocket.gate.set()
+        await sender.close()
+        return websocket.sent, sender.stats.counters
+
+    sent, counters = run(scenario())
+    assert sent == ['first', 'f1', 'f2', 'f3']
+    assert counters['dropped'] == 1
+    assert counters['overflows'] == 1
+
+
+def test_replies_follow_queued_finals(run):
+    async def scenario():
+        websocket, sender = await blocked_sender()
+        sender.final('<|final|>你好。')
+        sender.reply('<|reply|>你好！')
+        sender.reply(b'mp3')
+        websocket.gate.set()
+        await sender.close()
+        return websocket.sent, sender.stats.counters
+
+    sent, counters = run(scenario())
+    assert sent == ['first', '<|final|>你好。', '<|reply|>你好！', b'mp3']
+    assert counters['reply_bytes'] == 3
+
+
+def test_drop_replies_keeps_transcripts(run):
+    async def scenario():
+        websocket, sender = await blocked_sender()
+        sender.reply(b'old audio')
+        sender.final('<|final|>停。')
+        sender.reply(b'more old audio')
+        sender.drop_replies()
+        sender.reply('<|barge_in|>')
+        websocket.gate.set()
+        await sender.close()
+        return websocket.sent, sender.stats.counters
+
+    sent, counters = run(scenario())
+    assert sent == ['first', '<|final|>停。', '<|barge_in|>']
+    assert counters['replies_dropped'] == 2
+
+
+def test_writable_waits_for_the_client(run):
+    async def scenario():
+        websocket, sender = await blocked_sender(max_queue=2)
+        sender.reply(b'1')
+        sender.reply(b'2')
+        waiter = asyncio.create_task(sender.writable())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        websocket.gate.set()
+        await asyncio.wait_for(waiter, 1)
+        await sender.close()
+        return blocked, sender.stats.counters
+
+    blocked, counters = run(scenario())
+    assert blocked
+    assert counters['reply_waits'] == 1
+
+
+def test_send_error_stops_the_sender(run):
+    async def scenario():
+        sender = TranscriptSender(BrokenWebSocket(), SenderStats(), name='test')
+        sender.start()
+        sender.final('f1')
+        sender.final('f2')
+        await sender.close()
+        sender.final('after close')
+        return sender.depth, sender.stats.counters
+
+    depth, counters = run(scenario())
+    assert depth == 0
+    assert counters['send_errors'] == 1
+    assert counters['finals_sent'] == 0
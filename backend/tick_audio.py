@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from transcoder import get_transcoder
+
+SILENT_THRESHOLD = 1500
+
+
+def adts_frames(data, offset=0):
+    """从 offset 开始解析 adts 帧头，返回 [(起点, 终点, 每声道采样数, 声道数), ...]，
+    最后一个不完整的帧（还在录）不算；offset 处不是帧头返回 None"""
+    frames = []
+    n = len(data)
+    while offset + 7 <= n:
+        if data[offset] != 0xFF or data[offset + 1] & 0xF6 != 0xF0:
+            return frames if frames else None
+        length = ((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+        if length < 7:
+            return frames if frames else None
+        if offset + length > n:
+            break
+        channels = ((data[offset + 2] & 0x01) << 2) | (data[offset + 3] >> 6)
+        samples = ((data[offset + 6] & 0x03) + 1) * 1024
+        frames.append((offset, offset + length, samples, channels or 1))
+        offset += length
+    return frames
+
+
+async def decode_adts(data, transcoder=None):
+    """adts 字节解码成 int16 交错采样，原采样率、原声道数，不重采样。
+    走进程共用的 Transcoder：和其他转码一起限并发、限排队，超时杀掉 ffmpeg"""
+    transcoder = transcoder or get_transcoder()
+    pcm = await transcoder.transcode(bytes(data), 's16le', source_format='aac')
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def extract_audio_data(file_path, target_sr=22050):
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(file_path)
+    audio = audio.set_frame_rate(target_sr)
+    samples = np.array(audio.get_array_of_samples())
+    return samples, audio.frame_rate
+
+
+class StageTimings:
+    """按阶段累计耗时，看每个 tick 的开销是不是随录音变长而变大"""
+
+    def __init__(self, recent=200):
+        self.stages = {}
+        self.recent = recent
+
+    def record(self, stage, ms):
+        stat = self.stages.get(stage)
+        if stat is None:
+            stat = self.stages[stage] = {'count': 0, 'ms_total': 0.0, 'ms_max': 0.0,
+                                         'recent': deque(maxlen=self.recent)}
+        stat['count'] += 1
+        stat['ms_total'] += ms
+        stat['ms_max'] = max(stat['ms_max'], ms)
+        stat['recent'].append(ms)
+
+    def timed(self, stage):
+        return _Timed(self, stage)
+
+    def stats(self):
+        stats = {}
+        for stage, stat in self.stages.items():
+            recent = stat['recent']
+            stats[stage] = {
+                'count': stat['count'],
+                'ms_avg': round(stat['ms_total'] / stat['count'], 2),
+                'ms_recent_avg': round(sum(recent) / len(recent), 2),
+                'ms_max': round(stat['ms_max'], 2),
+            }
+        return stats
+
+
+class _Timed:
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        self.timings.record(self.stage, self.ms)
+        return False
+
+
+class RecordingState:
+    """一个录音文件已经分析过的部分"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = asyncio.Lock()
+        self.adts = None
+        self.head = b''          # 文件开头一小段，对不上说明同名文件是新录的
+        self.offset = 0          # 已分析的完整 adts 帧到哪个字节
+        self.recent_frames = deque()  # 最后几帧 (起点, 每声道采样数, 声道数)，解码新帧时往前多解几帧
+        self.samples = 0         # 非 adts 时已分析的采样数（22050Hz）
+        self.peak = 0            # 整个文件目前为止的最大幅度
+        self.uploads = 0
+        self.updated = time.monotonic()
+
+
+class TickResult:
+    def __init__(self, new_samples, tail_peak, peak):
+        self.new_samples = new_samples  # 这次新增的采样数，0 表示没变长
+        self.tail_peak = tail_peak      # 新增部分的最大幅度
+        self.peak = peak                # 整个文件的最大幅度
+
+
+class TickAnalyzer:
+    """/api_12/upload 每个 tick 上传的是同一个录音从头到现在的完整文件，原来每次都把上一版和这一版
+    整个用 pydub 解码、重采样再比长度，越录越慢。
+
+    这里按文件记住已经分析到哪一帧（adts 的帧边界），每次只解码新增的帧，算新增部分和整个文件的最大幅度；
+    为了让解码器状态对上，往前多解 overlap_frames 帧再把它们的输出丢掉。
+    不是 adts 的文件（解析不了帧头）退回用 pydub 整个解码，但也只解一次、不再解上一版。
+    adts 的解码交给共用的 Transcoder（ffmpeg 子进程），忙或者超时抛 TranscodeError；pydub 解码在线程里跑，
+    都不占事件循环。
+    """
+
+    def __init__(self, overlap_frames=2, max_recordings=1000, transcoder=None):
+        self.overlap_frames = overlap_frames
+        self.transcoder = transcoder  # None 用进程共用的
+        self.max_recordings = max_recordings
+        self.recordings = OrderedDict()
+        self.timings = StageTimings()
+        self.counters = {'uploads': 0, 'incremental': 0, 'full_decodes': 0, 'resets': 0,
+                         'bytes_decoded': 0, 'bytes_uploaded': 0}
+
+    def get(self, path):
+        return self.recordings.get(path)
+
+    def forget(self, path):
+        self.recordings.pop(path, None)
+
+    def _state(self, path):
+        state = self.recordings.get(path)
+        if state is None:
+            state = self.recordings[path] = RecordingState(path)
+            while len(self.recordings) > self.max_recordings:
+                self.recordings.popitem(last=False)
+        else:
+            self.recordings.move_to_end(path)
+        return state
+
+    async def update(self, path, data):
+        """data 是这次上传的完整文件内容（已经存到 path），返回 TickResult"""
+        state = self._state(path)
+        async with state.lock:
+            self.counters['uploads'] += 1
+            self.counters['bytes_uploaded'] += len(data)
+            state.uploads += 1
+            state.updated = time.monotonic()
+            if state.adts is not False:
+                result = await self._update_adts(state, data)
+                if result is not None:
+                    return result
+                state.adts = False
+            return await self._update_full(state, path)
+
+    def _reset(self, state, data):
+        if state.offset:
+            self.counters['resets'] += 1
+            logging.info(f'{state.path} changed from the start, analyse it again')
+        state.offset = 0
+        state.recent_frames.clear()
+        state.peak = 0
+        state.head = bytes(data[:64])
+
+    def _parse(self, state, data):
+        """找出这次新增的完整帧，返回 (帧列表, 从哪个字节开始解码, 要丢掉的重叠采样数)；不是 adts 返回 None"""
+        with self.timings.timed('parse'):
+            if state.offset == 0 or len(data) < state.offset or data[:len(state.head)] != state.head:
+                self._reset(state, data)
+            frames = adts_frames(data, state.offset)
+            if frames is None and state.offset:
+                # 中间对不上帧头，整个重来
+                self._reset(state, data)
+                frames = adts_frames(data, 0)
+            if frames is None:
+                return None
+        start = state.recent_frames[0][0] if state.recent_frames else (frames[0][0] if frames else 0)
+        skip = sum(samples * channels for _, samples, channels in state.recent_frames)
+        return frames, start, skip
+
+    async def _update_adts(self, state, data):
+        parsed = await asyncio.to_thread(self._parse, state, data)
+        if parsed is None:
+            return None
+        frames, start, skip = parsed
+        state.adts = True
+        if not frames:
+            return TickResult(0, 0, state.peak)
+
+        with self.timings.timed('decode'):
+            pcm = await decode_adts(data[start:frames[-1][1]], self.transcoder)
+        self.counters['incremental'] += 1
+        self.counters['bytes_decoded'] += frames[-1][1] - start
+        tail = pcm[skip:]
+        tail_peak = int(np.max(np.abs(tail.astype(np.int32)))) if len(tail) else 0
+
+        state.peak = max(state.peak, tail_peak)
+        state.offset = frames[-1][1]
+        for begin, _, samples, channels in frames[-self.overlap_frames:] if self.overlap_frames else ():
+            state.recent_frames.append((begin, samples, channels))
+        while len(state.recent_frames) > self.overlap_frames:
+            state.recent_frames.popleft()
+        return TickResult(sum(samples for _, _, samples, _ in frames), tail_peak, state.peak)
+
+    async def _update_full(self, state, path):
+        with self.timings.timed('decode'):
+            samples, _ = await asyncio.to_thread(extract_audio_data, path)
+        self.counters['full_decodes'] += 1
+        new = len(samples) - state.samples
+        if new > 0:
+            tail_peak = int(np.max(np.abs(samples[state.samples:].astype(np.int32))))
+        else:
+            tail_peak = 0
+        state.peak = int(np.max(np.abs(samples.astype(np.int32)))) if len(samples) else 0
+        state.samples = len(samples)
+        return TickResult(max(0, new), tail_peak, state.peak)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['recordings'] = len(self.recordings)
+        if self.counters['uploads']:
+            stats['decoded_ratio'] = round(self.counters['bytes_decoded'] / self.counters['bytes_uploaded'], 3)
+        stats['timings'] = self.timings.stats()
+        return stats
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from wav_capture import wav_header
+
+# 目标格式 -> (ffmpeg 输出参数, content type)
+TARGETS = {
+    'mp3': (['-c:a', 'libmp3lame', '-f', 'mp3'], 'audio/mpeg'),
+    'm4a': (['-c:a', 'aac', '-f', 'ipod'], 'audio/mp4'),
+    'wav': (['-c:a', 'pcm_s16le', '-f', 'wav'], 'audio/wav'),
+    'flac': (['-c:a', 'flac', '-f', 'flac'], 'audio/flac'),
+    'pcm': (['-c:a', 'pcm_s16le', '-ac', '1', '-ar', '16000', '-f', 's16le'], 'application/octet-stream'),
+    # 原采样率、原声道数的 int16 交错采样，只看幅度时用，不重采样
+    's16le': (['-c:a', 'pcm_s16le', '-f', 's16le'], 'application/octet-stream'),
+}
+
+# 文件识别接口直接收的容器，第一个是需要转码时的目标格式
+PROVIDER_FORMATS = {
+    'whisper': ['m4a', 'mp3', 'wav', 'flac', 'ogg', 'webm'],
+    'file_stt': ['mp3', 'wav', 'm4a'],
+}
+
+CONTENT_TYPES = {fmt: content_type for fmt, (_, content_type) in TARGETS.items()}
+CONTENT_TYPES.update({'ogg': 'audio/ogg', 'webm': 'audio/webm', 'aac': 'audio/aac'})
+
+
+def sniff(head):
+    """按文件开头的几个字节判断容器，认不出返回 None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return 'aac'  # adts，layer 位是 0
+        if head[1] & 0xE0 == 0xE0:
+            return 'mp3'
+    return None
+
+
+def pcm_to_wav(pcm, sample_rate=16000, channels=1, sampwidth=2):
+    """裸 pcm 加个 wav 头就行，不用起 ffmpeg"""
+    return wav_header(len(pcm), sample_rate, channels, sampwidth) + bytes(pcm)
+
+
+class TranscodeError(Exception):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Transcoder:
+    """进程内共用的转码服务，替代各处直接 ffmpeg-python .run()。
+
+    - 同时最多 max_workers 个 ffmpeg 在跑，其余的排队，排队超过 max_waiting 直接拒绝
+    - 输入输出都走 stdin / stdout 管道，不落中间文件；需要文件的调用方可以给 output 路径
+    - 每个任务有超时，超时杀掉 ffmpeg
+    - prepare() 先看容器，识别服务本来就收的格式原样返回，裸 pcm 转 wav 只加头，都不起 ffmpeg
+    """
+
+    def __init__(self, max_workers=None, max_waiting=100, timeout=30, ffmpeg='ffmpeg', recent=1000):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.ffmpeg = ffmpeg
+        self._semaphore = asyncio.Semaphore(self.max_workers)
+        self.waiting = 0
+        self.running = 0
+        self.counters = {'jobs': 0, 'passthrough': 0, 'in_process': 0, 'errors': 0, 'timeouts': 0,
+                         'rejected': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self._latency_ms = deque(maxlen=recent)
+        self._wait_ms = deque(maxlen=recent)
+
+    def _command(self, target, source_format, output, extra_args):
+        args, _ = TARGETS[target]
+        if target == 'm4a' and source_format == 'aac':
+            # adts 装进 mp4 只换容器，不重新编码
+            args = ['-c:a', 'copy', '-bsf:a', 'aac_adtstoasc', '-f', 'ipod']
+        if target == 'm4a' and output is None:
+            # mp4 写管道不能回头改 moov，用分片的
+            args = args + ['-movflags', 'frag_keyframe+empty_moov']
+        command = [self.ffmpeg, '-nostdin', '-loglevel', 'error']
+        if source_format == 'pcm':
+            command += ['-f', 's16le', '-ar', '16000', '-ac', '1']
+        elif source_format is not None:
+            command += ['-f', source_format]
+        command += ['-i', 'pipe:0', *extra_args, *args]
+        command += ['-y', output] if output is not None else ['pipe:1']
+        return command
+
+    async def transcode(self, source, target, output=None, source_format=None, timeout=None, extra_args=()):
+        """source 是 bytes 或者文件路径；返回转好的 bytes，给了 output 就写到文件、返回 None。
+        source_format 不给就按内容猜，裸 pcm 要写 'pcm'（16k 16bit 单声道）"""
+        if target not in TARGETS:
+            raise ValueError(f'unknown target format {target}')
+        if isinstance(source, str):
+            source = await asyncio.to_thread(_read_file, source)
+        if source_format is None:
+            source_format = sniff(source[:16])
+        if self.waiting >= self.max_waiting:
+            self.counters['rejected'] += 1
+            raise TranscodeError('transcoder busy', retryable=True)
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.running += 1
+            start = time.perf_counter()
+            self._wait_ms.append((start - queued) * 1000)
+            self.counters['jobs'] += 1
+            self.counters['bytes_in'] += len(source)
+            data = await self._run(self._command(target, source_format, output, list(extra_args)), source,
+                                   timeout or self.timeout)
+            self._latency_ms.append((time.perf_counter() - start) * 1000)
+            self.counters['bytes_out'] += len(data)
+            return data if output is None else None
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    async def _run(self, command, source, timeout):
+        process = await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(bytes(source)), timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            process.kill()
+            await process.wait()
+            raise TranscodeError(f'ffmpeg timeout after {timeout}s', retryable=True)
+        except BaseException:
+            # 调用方被取消，别留下 ffmpeg 进程
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        if process.returncode != 0:
+            self.counters['errors'] += 1
+            message = stderr.decode('utf-8', 'replace').strip()
+            logging.error(f'ffmpeg failed ({process.returncode}): {message}')
+            raise TranscodeError(f'ffmpeg failed: {message}')
+        return stdout
+
+    async def prepare(self, source, provider, source_format=None):
+        """把音频变成 provider 直接收的格式，返回 (data, 格式, content type)。
+        已经是收的格式就原样返回，裸 pcm 在进程内加 wav 头（如果收 wav）"""
+        accepted = PROVIDER_FORMATS[provider]
+        if isinstance(source, str):
+            source = await asyncio.to_thread(_read_file, source)
+        if source_format is None:
+            source_format = sniff(source[:16])
+        if source_format in accepted:
+            self.counters['passthrough'] += 1
+            return source, source_format, CONTENT_TYPES[source_format]
+        if source_format == 'pcm' and 'wav' in accepted:
+            self.counters['in_process'] += 1
+            return pcm_to_wav(source), 'wav', CONTENT_TYPES['wav']
+        target = accepted[0]
+        data = await self.transcode(source, target, source_format=source_format)
+        return data, target, CONTENT_TYPES[target]
+
+    async def prepare_file(self, path, provider, data=None):
+        """文件版的 prepare：provider 直接收的话返回原路径（只读文件头判断），否则转成 path.<格式> 返回新路径。
+        data 是文件内容，调用方手上已经有就传进来，省一次读"""
+        accepted = PROVIDER_FORMATS[provider]
+        head = data[:16] if data is not None else await asyncio.to_thread(_read_file, path, 16)
+        source_format = sniff(head)
+        if source_format in accepted:
+            self.counters['passthrough'] += 1
+            return path
+        if data is None:
+            data = await asyncio.to_thread(_read_file, path)
+        target = accepted[0]
+        output = f'{path}.{target}'
+        await self.transcode(data, target, output=output, source_format=source_format)
+        return output
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(max_workers=self.max_workers, running=self.running, waiting=self.waiting)
+        for name, samples in (('ms', self._latency_ms), ('wait_ms', self._wait_ms)):
+            recent = sorted(samples)
+            if recent:
+                stats[name] = {
+                    'avg': round(sum(recent) / len(recent), 1),
+                    'p50': round(recent[len(recent) // 2], 1),
+                    'p99': round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 1),
+                    'max': round(recent[-1], 1),
+                }
+        return stats
+
+
+def _read_file(path, size=-1):
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+_transcoder = None
+
+
+def get_transcoder():
+    """进程内共用一个，ffmpeg 总数按整个进程限"""
+    global _transcoder
+    if _transcoder is None:
+        import config
+        _transcoder = Transcoder(
+            max_workers=getattr(config, 'TRANSCODE_WORKERS', None),
+            max_waiting=getattr(config, 'TRANSCODE_MAX_WAITING', 100),
+            timeout=getattr(config, 'TRANSCODE_TIMEOUT', 30),
+        )
+    return _transcoder
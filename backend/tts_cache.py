@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import aiofiles
+
+SUFFIX = '.mp3'
+PART_SUFFIX = '.part'
+
+
+class _CacheWriter:
+    """一次 cache miss 的写入：先写到独立的 .part 临时文件，完整写完才 rename 成正式文件，
+    中途失败或客户端断开时 abort 删除临时文件，读端永远看不到写了一半的音频。"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = os.path.join(cache.directory, f'{key}.{uuid.uuid4().hex}{PART_SUFFIX}')
+        self.size = 0
+        self.chunks = []
+        self._file = None
+        self._done = False
+
+    async def write(self, data):
+        if self._file is None:
+            self._file = await aiofiles.open(self.tmp_path, 'wb')
+        await self._file.write(data)
+        self.size += len(data)
+        if self.chunks is not None:
+            self.chunks.append(data)
+            if self.size > self.cache.memory_entry_max_bytes:
+                self.chunks = None
+
+    async def commit(self):
+        if self._done:
+            return
+        self._done = True
+        if self._file is None:
+            return
+        await self._file.close()
+        if self.size == 0:
+            os.remove(self.tmp_path)
+            return
+        os.replace(self.tmp_path, self.cache._path(self.key))
+        self.cache._added(self.key, self.size, b''.join(self.chunks) if self.chunks is not None else None)
+
+    async def abort(self):
+        if self._done:
+            return
+        self._done = True
+        self.cache.counters['aborted_fills'] += 1
+        if self._file is not None:
+            await self._file.close()
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+class TTSCache:
+    """按 (text, model, voice) 内容寻址的 tts 音频缓存，磁盘 + 内存两级，都按 LRU 淘汰。"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, memory_max_bytes=32 * 1024 * 1024,
+                 memory_entry_max_bytes=256 * 1024, stale_part_sec=600):
+        self.directory = directory
+        # 几个 worker 共用一个目录时，别的进程正在写的 .part 不能删；超过这么久没动的才算上次没写完的
+        self.stale_part_sec = stale_part_sec
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_entry_max_bytes = memory_entry_max_bytes
+        self._disk = OrderedDict()    # key -> size，最近用过的在末尾
+        self._disk_bytes = 0
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'fills': 0,
+            'aborted_fills': 0,
+            'evictions': 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(text, model, voice):
+        return hashlib.sha256(f'{model}\0{voice}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _load(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(PART_SUFFIX):
+                # 上次进程退出时没写完的
+                try:
+                    if now - entry.stat().st_mtime > self.stale_part_sec:
+                        os.remove(entry.path)
+                except OSError:
+                    pass  # 别的进程刚写完 rename 走了
+            elif entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict()
+        logging.info(f'tts cache loaded, entries={len(self._disk)}, bytes={self._disk_bytes}')
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_entry_max_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def _added(self, key, size, data):
+        if key in self._disk:
+            self._disk_bytes -= self._disk.pop(key)
+        self._disk[key] = size
+        self._disk_bytes += size
+        self.counters['fills'] += 1
+        if data is not None:
+            self._remember(key, data)
+        self._evict()
+
+    def _evict(self):
+        while self._disk_bytes > self.max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self.counters['evictions'] += 1
+
+    async def get(self, key):
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return data
+        if key in self._disk:
+            try:
+                async with aiofiles.open(self._path(key), 'rb') as f:
+                    data = await f.read()
+                os.utime(self._path(key))  # 重启后按 mtime 恢复 LRU 顺序
+            except OSError:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            else:
+                # 读文件的时候这个 key 可能已经被淘汰（或者被别的 get 删掉），数据照样用，只是不再放回 LRU
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                    self._remember(key, data)
+                self.counters['disk_hits'] += 1
+                return data
+        self.counters['misses'] += 1
+        return None
+
+    def writer(self, key):
+        return _CacheWriter(self, key)
+
+    def stats(self):
+        stats = dict(self.counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['entries'] = len(self._disk)
+        stats['bytes'] = self._disk_bytes
+        stats['memory_entries'] = len(self._memory)
+        stats['memory_bytes'] = self._memory_bytes
+        return stats
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+_END = object()
+
+
+async def ordered_prefetch(source, stream_fn, depth):
+    """把 source 里的每一项交给 stream_fn(item) 流式处理，最多同时跑 depth 项，输出仍严格按 source 的顺序。
+
+    source 会被尽快读完（句子文本很小），只有 stream_fn 的并发受 depth 限制；
+    一项的 permit 要等调用方把它的输出全部取走才释放，所以最多缓冲 depth 项的输出。
+    depth <= 1 时等价于逐项串行。
+    """
+    depth = max(1, depth)
+    permits = asyncio.Semaphore(depth)
+    pending = asyncio.Queue()  # source 读出来、还没派发的项
+    slots = asyncio.Queue()    # 已派发项的输出队列，按顺序排好
+    workers = set()
+
+    async def read_source():
+        try:
+            async for item in source:
+                pending.put_nowait(item)
+        finally:
+            pending.put_nowait(_END)
+
+    async def run(item, out):
+        try:
+            async for chunk in stream_fn(item):
+                out.put_nowait(chunk)
+        except Exception:
+            logging.exception('ordered_prefetch: stream failed')
+        finally:
+            out.put_nowait(_END)
+
+    async def dispatch():
+        try:
+            while True:
+                item = await pending.get()
+                if item is _END:
+                    break
+                await permits.acquire()
+                out = asyncio.Queue()
+                worker = asyncio.create_task(run(item, out))
+                workers.add(worker)
+                worker.add_done_callback(workers.discard)
+                slots.put_nowait(out)
+        finally:
+            slots.put_nowait(_END)
+
+    reader = asyncio.create_task(read_source())
+    dispatcher = asyncio.create_task(dispatch())
+    try:
+        while True:
+            out = await slots.get()
+            if out is _END:
+                break
+            while True:
+                chunk = await out.get()
+                if chunk is _END:
+                    break
+                yield chunk
+            permits.release()
+        await reader
+    finally:
+        for task in (reader, dispatcher, *workers):
+            task.cancel()
+        await asyncio.gather(reader, dispatcher, *workers, return_exceptions=True)
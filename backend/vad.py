@@ -0,0 +1,182 @@
+import numpy as np
+
+FULL_SCALE = 32768.0
+
+# 进程内所有 gate 的累计，给 stats 接口用
+totals = {'bytes_in': 0, 'bytes_sent': 0, 'utterances': 0}
+
+
+class VoiceActivityDetector:
+    """16bit 单声道 pcm 的流式 vad，整批帧一起用 numpy 算，没有逐帧的 python 循环。
+
+    每帧（默认 20ms）算能量（dBFS）和过零率：能量高于 threshold_db，并且过零率不高（排除底噪、嘶嘶声）
+    或者能量比阈值高出 loud_db，就算有声音。连续 onset_frames 帧有声音才算开始说话，
+    最后一帧有声音之后再延续 hangover_frames 帧才算结束，免得字和字之间的短停顿被切开。
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, threshold_db=-45.0, zcr_max=0.35, loud_db=15.0,
+                 onset_frames=2, hangover_frames=15):
+        self.frame_ms = frame_ms
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_size * 2
+        self.threshold_db = threshold_db
+        self.zcr_max = zcr_max
+        self.loud_db = loud_db
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+        self._threshold = 10 ** (threshold_db / 10)
+        self._loud = 10 ** ((threshold_db + loud_db) / 10)
+        self._crossings_max = zcr_max * (self.frame_size - 1)
+        self._rest = b''
+        self._recent = np.zeros(max(0, onset_frames - 1), dtype=bool)  # 上一批最后几帧的原始判断
+        self._since_speech = 1 << 30  # 距离上一个有声音的帧过了几帧
+        self.active = False
+        self.frames = 0
+        self.speech_frames = 0
+
+    def features(self, samples):
+        """samples 是 int16 数组，长度是帧长的整数倍；返回每帧的 (dBFS, 过零率)"""
+        power, crossings = self._features(samples)
+        return 10 * np.log10(power + 1e-12), crossings / (self.frame_size - 1)
+
+    def _features(self, samples):
+        x = samples.reshape(-1, self.frame_size).astype(np.float32)
+        power = np.einsum('ij,ij->i', x, x) / (self.frame_size * FULL_SCALE * FULL_SCALE)
+        signs = np.signbit(x)
+        crossings = (signs[:, 1:] != signs[:, :-1]).sum(axis=1)
+        return power, crossings
+
+    def classify(self, samples):
+        """每帧的原始判断，不带 onset / hangover"""
+        # 阈值换算成线性功率和过零次数再比，省掉逐帧的 log
+        power, crossings = self._features(samples)
+        return (power > self._threshold) & ((crossings <= self._crossings_max) | (power > self._loud))
+
+    def process(self, pcm):
+        """喂一段 pcm（bytes 或 bytearray，长度随意），返回 (flags, data)：
+        flags 是这次凑齐的每一帧是否在说话（已经做了 onset 和 hangover），data 是这些帧的原始字节；
+        不够一帧的尾巴留到下次"""
+        data = self._rest + bytes(pcm) if self._rest else bytes(pcm)
+        n = len(data) // self.frame_bytes
+        self._rest = data[n * self.frame_bytes:]
+        if n == 0:
+            return np.zeros(0, dtype=bool), b''
+        data = data[:n * self.frame_bytes]
+        raw = self.classify(np.frombuffer(data, dtype=np.int16))
+
+        k = self.onset_frames
+        if k > 1:
+            # 以每帧结尾的 k 帧都有声音才确认
+            ext = np.concatenate((self._recent, raw))
+            confirmed = ext[k - 1:].copy()
+            for j in range(1, k):
+                confirmed &= ext[k - 1 - j:len(ext) - j]
+            self._recent = ext[len(ext) - (k - 1):]
+        else:
+            confirmed = raw
+
+        # 每帧离最近一个确认有声音的帧有多远，接上一批的状态
+        idx = np.arange(n)
+        last = np.maximum.accumulate(np.where(confirmed, idx, -self._since_speech))
+        flags = idx - last <= self.hangover_frames
+        self._since_speech = int(n - last[-1])
+        self.active = bool(flags[-1])
+        self.frames += n
+        self.speech_frames += int(np.count_nonzero(flags))
+        return flags, data
+
+    def has_speech(self, pcm):
+        """整段音频里有没有一处确认的说话"""
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        samples = samples[:len(samples) // self.frame_size * self.frame_size]
+        if not len(samples):
+            return False
+        raw = self.classify(samples)
+        confirmed = raw.copy()
+        for j in range(1, self.onset_frames):
+            confirmed[j:] &= raw[:len(raw) - j]
+            confirmed[:j] = False
+        return bool(confirmed.any())
+
+
+class VadGate:
+    """放在识别前面：只把说话的部分（带 preroll_ms 的前导，免得开头第一个字被切掉）往上游发，
+    静音不发就不计费；说话结束时 feed() 返回 ended=True，由调用方结束这一句。"""
+
+    def __init__(self, vad: VoiceActivityDetector, preroll_ms=300):
+        self.vad = vad
+        self.preroll_bytes = preroll_ms // vad.frame_ms * vad.frame_bytes
+        self._preroll = bytearray()
+        self._speaking = False
+        self.bytes_in = 0
+        self.bytes_sent = 0
+        self.utterances = 0
+
+    def feed(self, pcm):
+        """返回 [(voiced, ended), ...]，按顺序：先发 voiced，ended 为 True 时这一句到此结束。
+        大部分时候是空列表或者只有一项，一条消息里说完一句又开始下一句时会有两项"""
+        self.bytes_in += len(pcm)
+        totals['bytes_in'] += len(pcm)
+        flags, data = self.vad.process(pcm)
+        segments = []
+        if not len(flags):
+            return segments
+        fb = self.vad.frame_bytes
+        voiced = bytearray()
+        # 按连续相同状态的区间处理
+        bounds = np.concatenate(([0], np.flatnonzero(flags[1:] != flags[:-1]) + 1, [len(flags)]))
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            chunk = data[begin * fb:end * fb]
+            if flags[begin]:
+                if not self._speaking:
+                    self._speaking = True
+                    self.utterances += 1
+                    totals['utterances'] += 1
+                    voiced += self._preroll
+                    self._preroll.clear()
+                voiced += chunk
+            else:
+                if self._speaking:
+                    self._speaking = False
+                    segments.append((voiced, True))
+                    self.bytes_sent += len(voiced)
+                    totals['bytes_sent'] += len(voiced)
+                    voiced = bytearray()
+                self._preroll += chunk
+                if len(self._preroll) > self.preroll_bytes:
+                    del self._preroll[:len(self._preroll) - self.preroll_bytes]
+        if voiced:
+            segments.append((voiced, False))
+            self.bytes_sent += len(voiced)
+            totals['bytes_sent'] += len(voiced)
+        return segments
+
+    @property
+    def speaking(self):
+        return self._speaking
+
+    def stats(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_sent': self.bytes_sent,
+            'utterances': self.utterances,
+            'sent_ratio': round(self.bytes_sent / self.bytes_in, 3) if self.bytes_in else None,
+        }
+
+
+def totals_stats():
+    stats = dict(totals)
+    stats['sent_ratio'] = round(totals['bytes_sent'] / totals['bytes_in'], 3) if totals['bytes_in'] else None
+    return stats
+
+
+def gate_from_config(config, sample_rate=16000):
+    """按 config 里的 VAD_* 建一个 gate；VAD_ENABLED = False 时返回 None，音频原样发"""
+    if not getattr(config, 'VAD_ENABLED', True):
+        return None
+    vad = VoiceActivityDetector(
+        sample_rate=sample_rate,
+        threshold_db=getattr(config, 'VAD_THRESHOLD_DB', -45.0),
+        hangover_frames=getattr(config, 'VAD_HANGOVER_MS', 300) // 20,
+    )
+    return VadGate(vad, preroll_ms=getattr(config, 'VAD_PREROLL_MS', 300))
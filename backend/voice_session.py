@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import metrics
+from metrics import TRACER
+from speculation import StableInterims, normalize
+from tts_pipeline import ordered_prefetch
+
+# 下行消息：识别结果沿用 stt websocket 的格式（中间结果是纯文本，最终结果带 <|final|>），
+# 回复的句子带 <|reply|>，一轮回复结束 <|reply_end|>，被用户打断 <|barge_in|>，tts 语音是二进制帧（mp3）
+REPLY_PREFIX = '<|reply|>'
+REPLY_END = '<|reply_end|>'
+BARGE_IN = '<|barge_in|>'
+
+
+class VoiceStats:
+    """所有语音会话的统计：每轮从最终识别结果到第一句回复文本 / 第一帧语音的延迟"""
+
+    def __init__(self, recent=1000):
+        self.counters = {'sessions': 0, 'turns': 0, 'completed': 0, 'barge_ins': 0, 'speculative_hits': 0,
+                         'errors': 0}
+        self.first_text_ms = deque(maxlen=recent)
+        self.first_audio_ms = deque(maxlen=recent)
+
+    def stats(self):
+        stats = dict(self.counters)
+        for name in ('first_text_ms', 'first_audio_ms'):
+            recent = sorted(getattr(self, name))
+            if recent:
+                stats[name] = {
+                    'avg': round(sum(recent) / len(recent), 1),
+                    'p50': round(recent[len(recent) // 2], 1),
+                    'p99': round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 1),
+                }
+        return stats
+
+
+class VoiceSession:
+    """一个全双工语音会话：麦克风 pcm 上行由 StreamingEngine 识别，这里接它的 interim / final 回调。
+
+    每个最终结果开一轮回复：chat_fn(user, text) 出句子，句子文本马上下发，
+    同时 speech_fn(user, sentence) 提前合成（最多 lookahead 句并发），语音按句子顺序下发。
+    上一轮还没说完用户又开口了（有了非空的中间结果）就打断：取消 llm 和 tts，发 <|barge_in|>。
+    给了 speculative 时，中间结果稳定 stable_ms 毫秒就提前开始回复，最终结果一致就直接用。
+    下行都经引擎的 TranscriptSender（serve 的 on_open=attach 交过来），回复排在识别结果后面，语音受队列反压。
+    """
+
+    def __init__(self, user, chat_fn, speech_fn, lookahead=3, stats: VoiceStats = None,
+                 speculative=None, stable_ms=400, on_turn=None, trace_id=None):
+        self.sender = None
+        self.user = user
+        self.chat_fn = chat_fn
+        self.speech_fn = speech_fn
+        self.lookahead = lookahead
+        self.stats = stats or VoiceStats()
+        self.speculative = speculative
+        self.stable = StableInterims(stable_ms, lambda text: speculative.start(user, text)) \
+            if speculative is not None else None
+        self.on_turn = on_turn  # async fn(text, sentences)，一轮结束（包括被打断）时保存记录
+        self.trace_id = trace_id or user  # 每轮的 trace_id 是 {trace_id}:{轮次}
+        self.turn = 0
+        self._reply = None
+        self._tasks = set()
+        self.stats.counters['sessions'] += 1
+
+    def attach(self, sender):
+        self.sender = sender
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @property
+    def replying(self):
+        return self._reply is not None and not self._reply.done()
+
+    def interim(self, text):
+        if not normalize(text):
+            return
+        if self.replying:
+            self.barge_in()
+        if self.stable is not None:
+            self.stable.update(text)
+
+    async def final(self, text):
+        if self.stable is not None:
+            self.stable.reset()
+            self.speculative.final(self.user, text)
+        if not normalize(text):
+            return
+        if self.replying:
+            self.barge_in()
+        self.turn += 1
+        self.stats.counters['turns'] += 1
+        self._reply = asyncio.create_task(self._run(self.turn, text, time.perf_counter()))
+
+    def barge_in(self):
+        self._reply.cancel()
+        self.stats.counters['barge_ins'] += 1
+        logging.info(f'{self.user} - barge in, turn {self.turn} cancelled')
+        # 上一轮还没发出去的文本和语音不要了
+        self.sender.drop_replies()
+        self.sender.reply(BARGE_IN)
+
+    async def _run(self, turn, text, started):
+        trace = TRACER.start(f'{self.trace_id}:{turn}', 'voice_turn', self.user)
+        spec = self.speculative.take(self.user, text) if self.speculative is not None else None
+        hit = 'yes' if spec is not None else 'no'
+        speech_fn = lambda sentence: self.speech_fn(self.user, sentence)
+        if spec is not None:
+            self.stats.counters['speculative_hits'] += 1
+            chat = spec.replay()
+            speech_fn = spec.speech(speech_fn)
+        else:
+            chat = self.chat_fn(self.user, text)
+        sentences = []
+
+        async def texts():
+            async for sentence in chat:
+                if not sentences:
+                    self.stats.first_text_ms.append((time.perf_counter() - started) * 1000)
+                    metrics.TURN_FIRST_TEXT.observe(time.perf_counter() - started, api='voice', speculative=hit)
+                sentences.append(sentence)
+                self.sender.reply(REPLY_PREFIX + sentence)
+                yield sentence
+
+        first_audio = True
+        outcome = 'cancelled'
+        try:
+            async for data in ordered_prefetch(texts(), speech_fn, self.lookahead):
+                if first_audio:
+                    first_audio = False
+                    self.stats.first_audio_ms.append((time.perf_counter() - started) * 1000)
+                    metrics.TURN_FIRST_AUDIO.observe(time.perf_counter() - started, api='voice', speculative=hit)
+                    metrics.mark('first_audio')
+                self.sender.reply(data)
+                await self.sender.writable()
+            self.sender.reply(REPLY_END)
+            self.stats.counters['completed'] += 1
+            outcome = 'completed'
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            outcome = 'error'
+            self.stats.counters['errors'] += 1
+            logging.exception(f'{self.user} - reply turn {turn}')
+        finally:
+            metrics.TURN_SECONDS.observe(time.perf_counter() - started, api='voice')
+            metrics.TURNS.inc(api='voice', outcome=outcome)
+            TRACER.finish(trace, outcome)
+            if spec is not None:
+                spec.cancel()
+            if self.on_turn is not None:
+                # 被打断时也要保存已经说出去的部分，不能在取消中的任务里 await
+                self._spawn(self.on_turn(text, sentences))
+
+    async def close(self):
+        if self.stable is not None:
+            self.stable.reset()
+        tasks = [task for task in (self._reply,) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=1.0)
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import struct
+
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(data_bytes, sample_rate=16000, channels=1, sampwidth=2):
+    byte_rate = sample_rate * channels * sampwidth
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_bytes, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, byte_rate, channels * sampwidth, sampwidth * 8,
+                       b'data', data_bytes)
+
+
+class WavFile:
+    """边写边追加的 pcm wav 文件，patch() 把头里的长度改成当前写入的长度，之后文件就是一个完整的 wav"""
+
+    def __init__(self, path, sample_rate=16000, channels=1, sampwidth=2):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.data_bytes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._f = open(path, 'wb')
+        self._f.write(wav_header(0, sample_rate, channels, sampwidth))
+
+    def write(self, data):
+        self._f.write(data)
+        self.data_bytes += len(data)
+
+    def patch(self):
+        self._f.seek(4)
+        self._f.write(struct.pack('<I', 36 + self.data_bytes))
+        self._f.seek(40)
+        self._f.write(struct.pack('<I', self.data_bytes))
+        self._f.seek(0, os.SEEK_END)
+        self._f.flush()
+
+    def close(self):
+        if not self._f.closed:
+            self.patch()
+            self._f.close()
+
+
+class AudioCapture:
+    """一个连接的录音：收到的 pcm 先攒在内存里，超过 memory_max_bytes 就在线程里追加到 wav 文件，
+    内存里最多只留这么多，不管说多久。
+
+    checkpoint() 把攒着的写下去并修正 wav 头，文件立即可读；在句子结束时调用。
+    segment_path 不为空时（比如 'static/p/p_m_{}.wav'）同时按句子切分段文件，cut_segment() 结束当前段，
+    下一句写到新的段文件里。
+    """
+
+    def __init__(self, path, segment_path=None, sample_rate=16000, channels=1, sampwidth=2,
+                 memory_max_bytes=64 * 1024):
+        self.path = path
+        self.segment_path = segment_path
+        self.format = (sample_rate, channels, sampwidth)
+        self.memory_max_bytes = memory_max_bytes
+        self._pending = bytearray()
+        self._lock = asyncio.Lock()
+        self._file = None
+        self._segment = None
+        self.segments = []
+        self.peak_pending = 0
+
+    @property
+    def data_bytes(self):
+        return (self._file.data_bytes if self._file else 0) + len(self._pending)
+
+    async def write(self, data):
+        self._pending.extend(data)
+        self.peak_pending = max(self.peak_pending, len(self._pending))
+        if len(self._pending) >= self.memory_max_bytes:
+            # 等写完再返回，接收方收得比磁盘写得快时自然被拖慢，内存不会涨
+            await self._flush()
+
+    def _write_sync(self, chunk):
+        if self._file is None:
+            self._file = WavFile(self.path, *self.format)
+        self._file.write(chunk)
+        if self.segment_path is not None:
+            if self._segment is None:
+                self._segment = WavFile(self.segment_path.format(len(self.segments) + 1), *self.format)
+            self._segment.write(chunk)
+
+    async def _flush(self, after=None):
+        async with self._lock:
+            chunk, self._pending = self._pending, bytearray()
+
+            def run():
+                if chunk:
+                    self._write_sync(chunk)
+                if after is not None:
+                    return after()
+
+            return await asyncio.to_thread(run)
+
+    def _patch(self):
+        if self._file is not None:
+            self._file.patch()
+
+    async def checkpoint(self):
+        await self._flush(self._patch)
+        return self.path if self._file is not None else None
+
+    async def snapshot(self):
+        """到目前为止的录音，返回 (路径, None) 或者 (None, wav bytes)：
+        已经写过文件就 checkpoint 后给文件；录音很短、全在内存里时直接拼成 wav，不落盘"""
+        if self._file is None:
+            async with self._lock:
+                if self._file is None:
+                    return None, wav_header(len(self._pending), *self.format) + bytes(self._pending)
+        return await self.checkpoint(), None
+
+    def _cut(self):
+        self._patch()
+        segment, self._segment = self._segment, None
+        if segment is None or not segment.data_bytes:
+            return None
+        segment.close()
+        self.segments.append(segment.path)
+        return segment.path
+
+    async def cut_segment(self):
+        """结束当前段，返回段文件路径（这段没有声音时返回 None）"""
+        return await self._flush(self._cut)
+
+    def _close(self):
+        if self._segment is not None:
+            self._cut()
+        if self._file is not None:
+            self._file.close()
+
+    async def close(self):
+        try:
+            await self._flush(self._close)
+        except Exception:
+            logging.exception(f'close capture {self.path}')
@@ -1,15 +1,12 @@
 from typing import List
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form, Depends, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form, Depends, BackgroundTasks, WebSocket, Request
+from fastapi.responses import StreamingResponse, Response
 import logging
 import aiohttp
 import time
 from datetime import datetime
 import os
-from queue import Queue, Empty
 import json
-import shutil
-import requests
 import aiofiles
 import asyncio
 
@@ -17,7 +14,7 @@ from pydantic import BaseModel
 
 import config
 from login import router as login_router
-from login import verify_token
+from login import verify_token, verify_token_optional
 
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(funcName)s - %(message)s",
@@ -44,56 +41,132 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-message_dict = {} # sse消息队列
+from sse_broker import MessageBroker
+from tts_pipeline import ordered_prefetch
+from http_pool import HttpPool
+from tts_cache import TTSCache
+from segmenter import SentenceSegmenter, SEPERATORS
+from history_store import HistoryStore, valid_date
+from stt_client import WhisperClient, FakeTranscriber
+from stt_jobs import TranscriptionJobs
+from speculation import SpeculativeReplies
+from inflight import InflightReplies
+import metrics
+from metrics import REGISTRY, TRACER
+from stt_engine import StreamingEngine, ProviderRouter
+from stt_providers import providers_from_config
+from vad import gate_from_config
+from ws_sender import SenderStats
+from voice_session import VoiceSession, VoiceStats
+message_dict = MessageBroker() # sse消息队列, 按 message_id 发布/订阅
+inflight = InflightReplies() # 正在回传的回复，按 message_id 取消
+
 END_SENTENCE = ''
 
-def msg_from_file(phone):
-    now_obj = datetime.now()
-    date = now_obj.strftime("%Y%m%d")
-    ym = now_obj.strftime("%Y%m")
-    t = now_obj.strftime('%Y-%m-%d %H:%M:%S')
+# chat 和 tts 上游共用的连接池
+http_pool = HttpPool(
+    limit_per_host=getattr(config, 'HTTP_LIMIT_PER_HOST', 20),
+    connect_timeout=getattr(config, 'HTTP_CONNECT_TIMEOUT', 10),
+    sock_read_timeout=getattr(config, 'HTTP_READ_TIMEOUT', 60),
+)
+
+REGISTRY.configure(getattr(config, 'METRICS_MODE', 'light'))
+METRICS_TOKEN = getattr(config, 'METRICS_TOKEN', None)  # prometheus 抓取带的 bearer token，不配只允许本机抓取
+stats_guard = metrics.scrape_guard(METRICS_TOKEN)  # 各个统计接口和 /metrics 一样的访问控制
+REGISTRY.gauge('sse_channels', 'Open SSE channels in message_dict', lambda: len(message_dict))
+REGISTRY.gauge('sse_buffered_messages', 'Messages buffered across SSE channels', lambda: message_dict.depth())
+REGISTRY.gauge('replies_inflight', 'Replies currently streaming', lambda: len(inflight))
+CHAT_FIRST_SENTENCE = REGISTRY.histogram('chat_first_sentence_seconds',
+                                         'From the chat upstream request to the first sentence', ('model',))
+CHAT_SENTENCES = REGISTRY.counter('chat_sentences_total', 'Sentences received from the chat upstream')
+CHAT_ERRORS = REGISTRY.counter('chat_errors_total', 'Chat upstream failures')
+TTS_FIRST_BYTE = REGISTRY.histogram('tts_first_byte_seconds', 'Per sentence TTS time to first byte', ('cache',))
+TTS_ERRORS = REGISTRY.counter('tts_errors_total', 'TTS upstream failures')
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not metrics.scrape_allowed(request, METRICS_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api_12/traces")
+async def get_traces(trace_id: str = None, phone: str = Depends(verify_token)):
+    # METRICS_MODE = 'full' 时才有，只能看自己的
+    return [record for record in TRACER.recent(trace_id) if record['user'] == phone]
+
+
+@app.on_event("startup")
+async def startup():
+    message_dict.start()
+    stt_job_events.start()
+    speculative.start_sweeper()
+    await http_pool.start()
+    await voice_engine.start()
+    await stt_jobs.start()
+
 
-    os.makedirs(os.path.join(STATIC_FOLDER_PATH, phone, ym), exist_ok=True)
-    file_path = os.path.join(STATIC_FOLDER_PATH, phone, ym, date + '.json')
-    msgs = []
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding='utf-8') as f:
-            msgs = json.load(f)
-    return msgs, file_path, t
+@app.on_event("shutdown")
+async def shutdown():
+    await stt_jobs.stop()
+    await voice_engine.stop()
+    await speculative.stop()
+    await message_dict.stop()
+    await stt_job_events.stop()
+    await http_pool.close()
 
-def msg_to_file(phone, sentbyme, sentences):
-    msgs, file_path, t = msg_from_file(phone)
-    msgs.append({'time':t, 'sentbyme':sentbyme, 'content': ' '.join(sentences)}) # 这里也加个空格
-    with open(file_path, "w", encoding='utf-8') as f:
-        json.dump(msgs, f, indent=2, ensure_ascii=False)
+
+@app.get("/api_12/http_pool", dependencies=[Depends(stats_guard)])
+async def get_http_pool_stats():
+    return http_pool.stats()
+
+history_store = HistoryStore(STATIC_FOLDER_PATH)
+save_tasks = set()
+
+
+async def msg_to_file(phone, sentbyme, sentences):
+    await history_store.append(phone, sentbyme, ' '.join(sentences)) # 这里也加个空格
+
+
+def msg_to_file_later(phone, sentbyme, sentences):
+    # 不能 await 的地方（比如生成器的 finally）用；留着引用，任务跑完前不会被回收
+    task = asyncio.create_task(msg_to_file(phone, sentbyme, sentences))
+    save_tasks.add(task)
+    task.add_done_callback(save_tasks.discard)
 
 
 @app.get("/api_12/sse/{msg_id}")
 async def get_msg_status(msg_id: str, phone: str = Depends(verify_token)):
-    def event_stream():
+    async def event_stream():
         sentences = []
-        if msg_id not in message_dict:
-            message_dict[msg_id] = Queue()
-        while True:
+        finished = False
+        try:
             try:
-                sentence = message_dict[msg_id].get(timeout=60)  # 等待60秒来获取新消息
-                if sentence == END_SENTENCE:
-                    break
-                logging.info(f'msg_id={msg_id}, new message={sentence}')
-                sentences.append(sentence)
-                text = f"data: {sentence} \n\n" # 这里加个空格
-                logging.info(f'yield {text}')
-                yield text
-            except Empty:
+                async for sentence in message_dict.subscribe(msg_id, timeout=60):  # 等待60秒来获取新消息
+                    logging.info(f'msg_id={msg_id}, new message={sentence}')
+                    sentences.append(sentence)
+                    text = f"data: {sentence} \n\n" # 这里加个空格
+                    logging.info(f'yield {text}')
+                    yield text
+            except asyncio.TimeoutError:
                 # yield_text = f"data: ...Oops! 超时了\n\n"
                 logging.info(f'oops 超时了')
                 # yield yield_text
-                break
-        yield_text = f"data: done\n\n"
-        logging.info(f'yield {yield_text}')
-        del message_dict[msg_id]
-        msg_to_file(phone, False, sentences)
-        yield yield_text
+            finished = True
+            yield_text = f"data: done\n\n"
+            logging.info(f'yield {yield_text}')
+            message_dict.discard(msg_id)
+            await msg_to_file(phone, False, sentences)
+            yield yield_text
+        finally:
+            if not finished:
+                # 客户端断开了：停掉还在生成的回复，通道马上释放，不等超时
+                logging.info(f'msg_id={msg_id}, sse client gone')
+                inflight.cancel(msg_id, phone)
+                message_dict.discard(msg_id)
+                if sentences:
+                    msg_to_file_later(phone, False, sentences)
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 import jwt
@@ -116,35 +189,256 @@ async def get_think_and_reply(token:str=Query(...), message:str=Query(...), mess
     except jwt.InvalidTokenError:
         return {}
     logging.info(f'user={phone}, message_id={message_id}')
-    msg_to_file(phone, True, [message,])
-    return StreamingResponse(piped_generator(phone, message, message_id), media_type='audio/mpeg')
+    await msg_to_file(phone, True, [message,])
+    # 客户端断开或者调用 /api_12/cancel 时，chat 和 tts 的上游请求立即取消
+    return StreamingResponse(inflight.run(message_id, phone, piped_generator(phone, message, message_id)),
+                             media_type='audio/mpeg')
+
+
+@app.post("/api_12/cancel/{message_id}")
+async def cancel_reply(message_id: str, phone: str = Depends(verify_token)):
+    # 用户打断时客户端调用：停止生成和合成，sse 收到 done，语音流发完已经缓冲的部分后结束。
+    # 只能取消自己的回复；回复已经结束的话 sse 通道也已经关了，不用再动
+    return {'cancelled': inflight.cancel(message_id, phone)}
 
 
-async def piped_generator(user, message, message_id):
-    async for sentence in proxy_chat_generator(user, message, message_id, "gpt-4"):
-        logging.info(f'sentence={sentence}')
-        if sentence == END_SENTENCE:
-            break
-        async for voice_data in proxy_speech_generator(user, message_id, sentence):
+@app.get("/api_12/inflight", dependencies=[Depends(stats_guard)])
+async def get_inflight_stats():
+    stats = inflight.stats()
+    stats['channels'] = len(message_dict)
+    return stats
+
+
+# 同时在合成的句子数，1 表示逐句串行
+TTS_LOOKAHEAD = getattr(config, 'TTS_LOOKAHEAD', 3)
+
+
+CHAT_MODEL = "gpt-4"
+
+
+async def piped_generator(user, message, message_id, lookahead=TTS_LOOKAHEAD):
+    speech_fn = lambda sentence: proxy_speech_generator(user, message_id, sentence)
+    spec = speculative.take(user, message)
+    if spec is not None:
+        # stt 中间结果稳定时已经按同样的文本提前开始了，接着用它的句子和第一句语音
+        logging.info(f'user={user}, message_id={message_id}, speculation hit, {len(spec.sentences)} sentences ready')
+        chat = speculative_chat_generator(spec, message_id)
+        speech_fn = spec.speech(speech_fn)
+    else:
+        chat = proxy_chat_generator(user, message, message_id, CHAT_MODEL)
+
+    async def sentences():
+        first = True
+        async for sentence in chat:
+            logging.info(f'sentence={sentence}')
+            if sentence == END_SENTENCE:
+                break
+            if first:
+                first = False
+                metrics.TURN_FIRST_TEXT.observe(time.perf_counter() - started, api='think_and_reply',
+                                                speculative=hit)
+            yield sentence
+
+    # trace_id 就是 message_id，chat / tts 里 metrics.mark() 记到这一轮上
+    started = time.perf_counter()
+    trace = TRACER.start(message_id, 'turn', user)
+    hit = 'yes' if spec is not None else 'no'
+    outcome = 'cancelled'
+    first = True
+    try:
+        # 后面几句的 tts 提前并发请求，语音字节仍按句子顺序回传
+        async for voice_data in ordered_prefetch(sentences(), speech_fn, lookahead):
+            if first:
+                first = False
+                metrics.TURN_FIRST_AUDIO.observe(time.perf_counter() - started, api='think_and_reply',
+                                                 speculative=hit)
+                metrics.mark('first_audio')
             yield voice_data
+        outcome = 'completed'
+    finally:
+        metrics.TURN_SECONDS.observe(time.perf_counter() - started, api='think_and_reply')
+        metrics.TURNS.inc(api='think_and_reply', outcome=outcome)
+        TRACER.finish(trace, outcome)
+
+
+async def speculative_chat_generator(spec, message_id):
+    try:
+        async for sentence in spec.replay():
+            message_dict.publish(message_id, sentence)
+            yield sentence
+    finally:
+        spec.cancel()  # 客户端中途断开时不再跑下去
+        message_dict.close(message_id)
+
+
+# 推测时还不知道 message_id，句子先攒着，命中后再发到 sse
+speculative = SpeculativeReplies(
+    lambda user, text: proxy_chat_generator(user, text, None, CHAT_MODEL),
+    (lambda user, sentence: proxy_speech_generator(user, None, sentence))
+    if getattr(config, 'SPECULATIVE_TTS', True) else None,
+    ttl=getattr(config, 'SPECULATIVE_TTL', 15),
+    max_pending=getattr(config, 'SPECULATIVE_MAX_PENDING', 100),
+)
+
+
+class SpeculateRequest(BaseModel):
+    token: str
+    text: str
+    final: bool = False
+
+
+@app.post("/api_12/speculate")
+async def post_speculate(request: SpeculateRequest):
+    # stt 服务调用：中间结果稳定了就提前开始回复，最终结果出来时再报一次，文本变了就取消
+    try:
+        payload = jwt.decode(request.token, config.JWT_SECRET_KEY, algorithms=[ALGORITHM])
+        phone = payload.get("sub")
+    except jwt.PyJWTError:
+        phone = None
+    if phone is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if request.final:
+        speculative.final(phone, request.text)
+        return {'started': False}
+    if not getattr(config, 'SPECULATIVE_REPLY', True):
+        return {'started': False}
+    return {'started': speculative.start(phone, request.text) is not None}
+
+
+@app.get("/api_12/speculation", dependencies=[Depends(stats_guard)])
+async def get_speculation_stats():
+    return speculative.stats()
+
+
+# 全双工语音会话：一个 websocket 上行麦克风 pcm，下行识别结果、回复文本和 tts 语音，
+# 不再需要 stt websocket + sse + think_and_reply 三个连接靠 message_id 配合
+# 默认不开：VOICE_STT_PROVIDERS = ['aliyun'] 这样配了才建识别服务（阿里云的 token 刷新等都在 startup 里起来）
+voice_providers = providers_from_config(config, names=getattr(config, 'VOICE_STT_PROVIDERS', []))
+voice_engine = StreamingEngine(
+    voice_providers,
+    ProviderRouter(
+        voice_providers,
+        routes=getattr(config, 'STT_ROUTES', {}),
+        default=getattr(config, 'STT_DEFAULT_PROVIDER', None),
+        strategy=getattr(config, 'STT_ROUTE_STRATEGY', 'cheapest'),
+    ),
+    gate_factory=lambda: gate_from_config(config),
+    sender_stats=SenderStats(),
+    send_max_queue=getattr(config, 'SEND_MAX_QUEUE', 32),
+    packet_gap=1,
+)
+voice_stats = VoiceStats()
+REGISTRY.gauge('voice_sessions_active', 'Open voice session websockets', lambda: voice_engine.connections)
+
+
+@app.websocket("/api_12/voice/{msg_id}")
+async def voice_websocket(websocket: WebSocket, msg_id: str, provider: str = None, language: str = None):
+    await websocket.accept()
+    if not voice_providers:
+        await websocket.send_text("VOICE_UNAVAILABLE")
+        await websocket.close(code=1013)
+        return
+    try:
+        token = await websocket.receive_text()
+        payload = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[ALGORITHM])
+        phone = payload.get("sub")
+    except jwt.PyJWTError:
+        phone = None
+    if phone is None:
+        await websocket.send_text("TOKEN_INVALID")
+        await websocket.close()
+        return
+    logging.info(f'voice session, user={phone}, msg_id={msg_id}, provider={provider}, language={language}')
+
+    async def save_turn(text, sentences):
+        await msg_to_file(phone, True, [text,])
+        if sentences:
+            await msg_to_file(phone, False, sentences)
+
+    session = VoiceSession(
+        phone,
+        chat_fn=lambda user, text: proxy_chat_generator(user, text, None, CHAT_MODEL),
+        speech_fn=lambda user, sentence: proxy_speech_generator(user, None, sentence),
+        lookahead=TTS_LOOKAHEAD,
+        stats=voice_stats,
+        speculative=speculative if getattr(config, 'SPECULATIVE_REPLY', True) else None,
+        stable_ms=getattr(config, 'SPECULATE_STABLE_MS', 400),
+        on_turn=save_turn,
+        trace_id=msg_id,
+    )
+    try:
+        await voice_engine.serve(websocket, phone, provider=provider, language=language,
+                                 on_interim=session.interim, on_final=session.final, on_open=session.attach,
+                                 trace_id=msg_id)
+    finally:
+        await session.close()
+
+
+@app.get("/api_12/voice_stats", dependencies=[Depends(stats_guard)])
+async def get_voice_stats():
+    stats = voice_stats.stats()
+    stats['engine'] = voice_engine.stats()
+    return stats
+
+
+TTS_MODEL = 'tts-1'
+TTS_VOICE = 'shimmer'
+tts_cache = TTSCache(
+    getattr(config, 'TTS_CACHE_DIR', 'tts_cache'),
+    max_bytes=getattr(config, 'TTS_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+    memory_max_bytes=getattr(config, 'TTS_CACHE_MEMORY_BYTES', 32 * 1024 * 1024),
+)
+
+
+@app.get("/api_12/tts_cache", dependencies=[Depends(stats_guard)])
+async def get_tts_cache_stats():
+    return tts_cache.stats()
 
 
 async def proxy_speech_generator(user, msgid, sentence: str):
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers={
-                'Authorization': f'Bearer sk-{config.API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            async with session.post('https://api.openai.com/v1/audio/speech', 
-                                    headers = headers,
-                                    json={"input":sentence, "model": "tts-1", "voice": "shimmer"}) as response:
-                logging.info(f'proxy speech start: {sentence}')
-                async for data in response.content.iter_any():
-                    yield data
-                logging.info(f'proxy speech done: {sentence}')
-        except Exception as e:
-            logging.exception('speech_generator: something wrong')
+    started = time.perf_counter()
+    key = tts_cache.key(sentence, TTS_MODEL, TTS_VOICE)
+    cached = await tts_cache.get(key)
+    if cached is not None:
+        logging.info(f'proxy speech cache hit: {sentence}')
+        TTS_FIRST_BYTE.observe(time.perf_counter() - started, cache='hit')
+        metrics.mark('tts_first_byte')
+        yield cached
+        return
+
+    session = await http_pool.get_session()
+    writer = None
+    try:
+        headers={
+            'Authorization': f'Bearer sk-{config.API_KEY}',
+            'Content-Type': 'application/json'
+        }
+        async with session.post('https://api.openai.com/v1/audio/speech', 
+                                headers = headers,
+                                json={"input":sentence, "model": TTS_MODEL, "voice": TTS_VOICE}) as response:
+            logging.info(f'proxy speech start: {sentence}')
+            if response.status == 200:
+                writer = tts_cache.writer(key) # 边回传边写缓存，完整写完才生效
+            else:
+                TTS_ERRORS.inc()
+            first = True
+            async for data in response.content.iter_any():
+                if first:
+                    first = False
+                    TTS_FIRST_BYTE.observe(time.perf_counter() - started, cache='miss')
+                    metrics.mark('tts_first_byte')
+                if writer:
+                    await writer.write(data)
+                yield data
+            if writer:
+                await writer.commit()
+            logging.info(f'proxy speech done: {sentence}')
+    except Exception as e:
+        TTS_ERRORS.inc()
+        logging.exception('speech_generator: something wrong')
+    finally:
+        if writer:
+            await writer.abort()
 
 
 # -----------------------------------
@@ -152,62 +446,53 @@ async def proxy_speech_generator(user, msgid, sentence: str):
 CHAT_URL = f'{config.PROXY_CHAT_HOST_PORT}/api_13/chat'
 
 
-SEPERATORS = [
-    "\n",
-    "。","！","？",
-    ".", "!", "?",
-    "；", ";",
-    "，", ","
-]
-
-def contains_sep(text):
-    if len(text.strip()) == 1:
-        return False, None, None
-    left_size = len(text)
-    left = ''
-    for SEP in SEPERATORS:
-        if SEP in text:
-            arr = text.split(SEP, 1)
-            if left_size > len(arr[0]):
-                left = arr[0] + SEP
-                right = arr[1]
-                left_size = len(arr[0])
-    if left:
-        return True, left, right
-    return False, None, None
+# 去掉空白后短于这个长度的句子并到下一句，避免 tts 收到碎片
+SENTENCE_MIN_LENGTH = getattr(config, 'SENTENCE_MIN_LENGTH', 2)
 
 
 async def proxy_chat_generator(user: str, prompt: str, message_id:str, model: str):
-    async with aiohttp.ClientSession() as session:
-        try:
-            if message_id not in message_dict:
-                message_dict[message_id] = Queue()
-            async with session.post(CHAT_URL, json={"prompt":prompt, "user": user, "user_group": "zzs", "model": model}) as response:
-                remains = ''
-                async for bytes in response.content.iter_any():
-                    data = bytes.decode('utf-8')
-                    data = data.replace('\n\n', '\n') # \n\n conflict with SSE
-                    data = remains + data
-                    # logging.info(f'data before sentence={data}')
-                    exist,left,right = contains_sep(data)
-                    while exist:
-                        sentence = left
-                        if sentence.strip():
-                            sentence = sentence.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
-                            message_dict[message_id].put(sentence)
-                            yield sentence
-                        data = right
-                        exist,left,right = contains_sep(data)
-                    remains = data
-                if remains.strip():
-                    remains = remains.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
-                    message_dict[message_id].put(remains)
-                    yield remains
-                message_dict[message_id].put(END_SENTENCE)
-                logging.info(f'sentences done')
-        except:
-            logging.exception('chat_generator: something wrong')
-            #yield f'Exception: {e}'
+    started = time.perf_counter()
+    count = 0
+
+    def record():
+        nonlocal count
+        count += 1
+        CHAT_SENTENCES.inc()
+        if count == 1:
+            CHAT_FIRST_SENTENCE.observe(time.perf_counter() - started, model=model)
+            metrics.mark('first_sentence')
+
+    session = await http_pool.get_session()
+    try:
+        async with session.post(CHAT_URL, json={"prompt":prompt, "user": user, "user_group": "zzs", "model": model}) as response:
+            segmenter = SentenceSegmenter(SEPERATORS, min_length=SENTENCE_MIN_LENGTH)
+            async for bytes in response.content.iter_any():
+                for sentence in segmenter.feed(bytes):
+                    if sentence.strip():
+                        sentence = sentence.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
+                        if message_id is not None:
+                            message_dict.publish(message_id, sentence)
+                        record()
+                        yield sentence
+            remains = segmenter.flush()
+            if remains.strip():
+                remains = remains.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
+                if message_id is not None:
+                    message_dict.publish(message_id, remains)
+                record()
+                yield remains
+            metrics.mark('chat_done')
+            logging.info(f'sentences done')
+    except asyncio.CancelledError:
+        logging.info(f'chat_generator: cancelled, message_id={message_id}')
+        raise
+    except:
+        CHAT_ERRORS.inc()
+        logging.exception('chat_generator: something wrong')
+        #yield f'Exception: {e}'
+    finally:
+        if message_id is not None:
+            message_dict.close(message_id)
 
 class HistoryResponse(BaseModel):
     content: str
@@ -215,40 +500,136 @@ class HistoryResponse(BaseModel):
     time: str
 
 
-@app.get("/api_12/history", response_model=List[HistoryResponse])
-def get_chat_history(phone: str = Depends(verify_token)):
-    msgs, _, _ = msg_from_file(phone)
-    return [HistoryResponse(**item) for item in msgs]
-
-
-def _audio_to_script(local_file_path):
-    headers = {
-        'Authorization': f'Bearer sk-{config.API_KEY}',
-    }
-    data = {
-        'model': 'whisper-1',
-        'temperature': '0.7',
-        'prompt': '我说简体中文，I also speek English.',
-    }
-    files = {
-        'file': open(local_file_path, 'rb'),
-    }
-    response = requests.post('https://api.openai.com/v1/audio/transcriptions', headers=headers, data=data, files=files)
-    dict1 = response.json()
-    logging.info(f'response={dict1}')
-    if response.status_code == 200:
-        return dict1['text']
-    else:
-        return dict1['error']['message']
+def _check_date(date):
+    if not valid_date(date):
+        raise HTTPException(status_code=400, detail=f"Invalid date: {date}")
+    return date
+
+
+# 响应是流式写出的，不经 response_model 校验，这里只给文档用
+@app.get("/api_12/history", responses={
+    200: {
+        'model': List[HistoryResponse],
+        'description': 'format=json 时是消息数组，format=ndjson 时一行一条消息；还有下一页时响应头带 X-Next-Cursor',
+        'content': {'application/x-ndjson': {}},
+    },
+})
+async def get_chat_history(phone: str = Depends(verify_token),
+                           start: str = Query(None, description="YYYYMMDD，默认今天"),
+                           end: str = Query(None, description="YYYYMMDD，默认等于 start"),
+                           cursor: str = Query(None, description="上一页响应头里的 X-Next-Cursor"),
+                           limit: int = Query(None, ge=1, le=1000),
+                           order: str = Query('asc', pattern='^(asc|desc)$'),
+                           format: str = Query('json', pattern='^(json|ndjson)$')):
+    # 不带参数时和以前一样返回今天的全部消息
+    start = _check_date(start or datetime.now().strftime("%Y%m%d"))
+    end = _check_date(end or start)
+    try:
+        page = await history_store.page(phone, start, end, cursor, limit, order)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    headers = {'X-Next-Cursor': page.next_cursor} if page.next_cursor else {}
+
+    async def ndjson_stream():
+        async for line in history_store.iter_page(phone, page):
+            yield line + '\n'
+
+    async def json_stream():
+        sep = '['
+        async for line in history_store.iter_page(phone, page):
+            yield sep + line
+            sep = ','
+        yield '[]' if sep == '[' else ']'
+
+    if format == 'ndjson':
+        return StreamingResponse(ndjson_stream(), media_type='application/x-ndjson', headers=headers)
+    return StreamingResponse(json_stream(), media_type='application/json', headers=headers)
+
+
+whisper_client = WhisperClient(
+    http_pool, config.API_KEY,
+    max_concurrency=getattr(config, 'STT_MAX_CONCURRENCY', 4),
+    timeout=getattr(config, 'STT_TIMEOUT', 60),
+    prompt='我说简体中文，I also speek English.',
+)
+
+transcribers = {'whisper': whisper_client.request}
+if getattr(config, 'STT_FAKE', False):
+    transcribers['fake'] = FakeTranscriber().request
+
+
+stt_job_events = MessageBroker()
+
+
+def publish_stt_job(job):
+    # 任务结束时把结果推到以 job_id 为 key 的 sse 通道；和 message_dict 分开，/api_12/sse 订阅不到转写结果
+    if TranscriptionJobs.finished(job):
+        stt_job_events.publish(job['job_id'], json.dumps(job, ensure_ascii=False))
+        stt_job_events.close(job['job_id'])
+
+
+stt_jobs = TranscriptionJobs(
+    getattr(config, 'STT_JOBS_DIR', 'stt_jobs'),
+    transcribers,
+    workers=getattr(config, 'STT_WORKERS', 4),
+    provider_limits=getattr(config, 'STT_PROVIDER_LIMITS', {'whisper': 4}),
+    on_update=publish_stt_job,
+)
 
 
 @app.post(f"/api_12/file_stt")
-async def post_file_stt(file: UploadFile = File(...)):
+async def post_file_stt(file: UploadFile = File(...), job: bool = Query(False), provider: str = Query('whisper'),
+                        phone: str = Depends(verify_token_optional)):
+    # job=true 时只提交任务，立刻返回 job_id，结果用 /api_12/stt_jobs/{job_id} 轮询或者 sse 接收；
+    # 任务要带 token 提交，只有提交的人能查结果
     logging.info(f"/file_stt")
-    temp_file_path = os.path.join(STATIC_FOLDER_PATH, file.filename)
-    with open(temp_file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"text": _audio_to_script(temp_file_path)}
+    try:
+        if job:
+            if phone is None:
+                raise HTTPException(status_code=401, detail="Not authenticated")
+            try:
+                return await stt_jobs.submit(file.file, file.filename, provider=provider, user=phone)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        text = await whisper_client.transcribe(file.file, file.filename, file.content_type or 'application/octet-stream')
+    finally:
+        await file.close()
+    return {"text": text}
+
+
+def own_stt_job(job_id, phone):
+    # 别人的任务和不存在的一样回 404，不暴露 job_id 是否存在
+    job = stt_jobs.get(job_id)
+    if job is None or job.get('user') != phone:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api_12/stt_jobs/{job_id}")
+async def get_stt_job(job_id: str, phone: str = Depends(verify_token)):
+    return own_stt_job(job_id, phone)
+
+
+@app.get("/api_12/stt_jobs/{job_id}/sse")
+async def get_stt_job_sse(job_id: str, phone: str = Depends(verify_token)):
+    job = own_stt_job(job_id, phone)
+
+    async def event_stream():
+        if TranscriptionJobs.finished(job):
+            yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+        else:
+            try:
+                async for text in stt_job_events.subscribe(job_id, timeout=300):
+                    yield f"data: {text}\n\n"
+            except asyncio.TimeoutError:
+                logging.info(f'stt job {job_id} sse timeout')
+        yield f"data: done\n\n"
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.get("/api_12/stt_jobs", dependencies=[Depends(stats_guard)])
+async def get_stt_jobs_stats():
+    return stt_jobs.stats()
 
 
 if __name__ == "__main__":
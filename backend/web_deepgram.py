@@ -1,12 +1,14 @@
-from fastapi import FastAPI, File, UploadFile, Form, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException, Depends
 import asyncio
-import os
-import httpx
+import json
+import time
 from sse_starlette.sse import EventSourceResponse
 import logging
-from deepgram import DeepgramClient, LiveTranscriptionEvents, LiveOptions
-import os
+
+from recognizer_manager import CapacityError
+from sse_broker import MessageBroker
+from stt_providers import DeepgramProvider
+import metrics
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s",
@@ -17,70 +19,222 @@ app = FastAPI()
 
 # 初始化 Deepgram 客户端
 DEEPGRAM_API_KEY = 'b14aa702d2e2a9d811619ab15aaf0f02abeb220f'
-deepgram = DeepgramClient(DEEPGRAM_API_KEY)
-
-# 存储用户转录结果的字典
-transcriptions = {}
-
-dg_connection = deepgram.listen.live.v("1")
-def on_message(self, result, **kwargs):
-    sentence = result.channel.alternatives[0].transcript
-    if len(sentence) > 0:
-        key = f"{user_id}:{msg_id}"
-        if key not in transcriptions:
-            transcriptions[key] = []
-        transcriptions[key].append(sentence)
-        logging.info(f'transript={sentence}')
-def on_metadata(self, metadata, **kwargs):
-    print(f"\n\n{metadata}\n\n")
-def on_error(self, error, **kwargs):
-    print(f"\n\n{error}\n\n")
-dg_connection.on(LiveTranscriptionEvents.Transcript, on_message)
-dg_connection.on(LiveTranscriptionEvents.Metadata, on_metadata)
-dg_connection.on(LiveTranscriptionEvents.Error, on_error)
-options = LiveOptions(
-    model="nova-2",
-#        language="en-US",
-    smart_format=True,
-)
-dg_connection.start(options)
+MAX_SESSIONS = 20         # 同时最多开多少个 deepgram 实时连接
+ADMIT_TIMEOUT = 5         # 名额满了最多等几秒
+IDLE_TIMEOUT = 8          # 多久没有上传就关掉会话，deepgram 10 秒收不到音频会自己断开
+UPLOAD_CHUNK = 32 * 1024  # 上传的文件按这个大小边读边发
+SSE_TIMEOUT = 60
+METRICS_TOKEN = None       # 统计接口：配了要带 Authorization: Bearer {token}，不配只允许本机访问
+stats_guard = metrics.scrape_guard(METRICS_TOKEN)
+
+
+class BrokerEmitter:
+    """DeepgramSession 交回的识别结果推到 key 对应的 sse 通道"""
+
+    def __init__(self, broker: MessageBroker, key):
+        self.broker = broker
+        self.key = key
+
+    def interim(self, text):
+        self.broker.publish(self.key, {"event": "interim", "data": json.dumps({"transcription": text})})
+
+    def final(self, text):
+        self.broker.publish(self.key, {"event": "transcription", "data": json.dumps({"transcription": text})})
+
+
+class LiveSession:
+    __slots__ = ('session', 'touched', 'lock')
+
+    def __init__(self, session):
+        self.session = session
+        self.touched = time.monotonic()
+        self.lock = asyncio.Lock()  # 同一个 key 的几次上传按顺序发
+
+
+class LiveSessions:
+    """每个 (user_id, msg_id) 一个 deepgram 实时会话，最多 max_sessions 个。
+
+    第一次上传时打开，超过 idle_timeout 没有新的上传就关掉，关掉时 sse 通道也结束。
+    """
+
+    def __init__(self, provider: DeepgramProvider, broker: MessageBroker, max_sessions=20, admit_timeout=5,
+                 idle_timeout=8):
+        self.provider = provider
+        self.broker = broker
+        self.admit_timeout = admit_timeout
+        self.idle_timeout = idle_timeout
+        self._slots = asyncio.Semaphore(max_sessions)
+        self._sessions = {}
+        self._opening = {}
+        self._reaper = None
+        self.counters = {'opened': 0, 'closed': 0, 'idle_closed': 0, 'rejected': 0, 'errors': 0, 'bytes': 0}
+
+    async def get(self, key) -> LiveSession:
+        live = self._sessions.get(key)
+        if live is not None:
+            live.touched = time.monotonic()
+            return live
+        # 同一个 key 同时来了几次上传，只开一个会话
+        task = self._opening.get(key)
+        if task is None:
+            task = self._opening[key] = asyncio.create_task(self._open(key))
+            task.add_done_callback(lambda _: self._opening.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _open(self, key):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.admit_timeout)
+        except asyncio.TimeoutError:
+            self.counters['rejected'] += 1
+            raise CapacityError(f'{len(self._sessions)} deepgram sessions busy')
+        try:
+            if self.broker.closed(key):
+                # 上一个会话已经结束，这个 key 重新开始
+                self.broker.discard(key)
+            session = await self.provider.open(BrokerEmitter(self.broker, key), key)
+        except Exception:
+            self._slots.release()
+            self.counters['errors'] += 1
+            raise
+        live = self._sessions[key] = LiveSession(session)
+        self.counters['opened'] += 1
+        self.provider.acquire()
+        logging.info(f'{key} - deepgram session opened, sessions={len(self._sessions)}')
+        return live
+
+    async def send_upload(self, key, upload: UploadFile, chunk_size=UPLOAD_CHUNK):
+        live = await self.get(key)
+        try:
+            async with live.lock:
+                while True:
+                    chunk = await upload.read(chunk_size)
+                    if not chunk:
+                        break
+                    live.touched = time.monotonic()
+                    self.counters['bytes'] += len(chunk)
+                    await live.session.send(chunk)
+                # 这次上传发完了，让 deepgram 马上出结果
+                await live.session.end_utterance()
+                live.touched = time.monotonic()
+        except Exception:
+            # 会话多半已经断了，关掉它，下一次上传重新开
+            self.counters['errors'] += 1
+            logging.exception(f'{key} - send to deepgram')
+            if self._sessions.get(key) is live:
+                await self.close(key)
+            raise
+
+    async def close(self, key):
+        live = self._sessions.pop(key, None)
+        if live is None:
+            return
+        try:
+            async with live.lock:
+                await live.session.close()
+        except Exception:
+            self.counters['errors'] += 1
+            logging.exception(f'{key} - close deepgram session')
+        finally:
+            self._slots.release()
+            self.provider.release()
+            self.broker.close(key)
+            self.counters['closed'] += 1
+            logging.info(f'{key} - deepgram session closed, sessions={len(self._sessions)}')
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            idle = [key for key, live in self._sessions.items()
+                    if not live.lock.locked() and now - live.touched > self.idle_timeout]
+            for key in idle:
+                self.counters['idle_closed'] += 1
+                await self.close(key)
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_forever())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        for key in list(self._sessions):
+            await self.close(key)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['sessions'] = len(self._sessions)
+        stats['opening'] = len(self._opening)
+        return stats
+
+
+# 上传的是 m4a/mp3 等文件，不指定 encoding，deepgram 自己识别格式
+provider = DeepgramProvider(DEEPGRAM_API_KEY, default_language='en', max_sessions=MAX_SESSIONS, encoding=None)
+broker = MessageBroker()
+sessions = LiveSessions(provider, broker, max_sessions=MAX_SESSIONS, admit_timeout=ADMIT_TIMEOUT,
+                        idle_timeout=IDLE_TIMEOUT)
+
+
+@app.on_event("startup")
+async def startup():
+    broker.start()
+    sessions.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sessions.stop()
+    await broker.stop()
+
 
 @app.post("/api_12/audio")
-async def receive_audio(audio: UploadFile = File(...), user_id: str = Form(...), msg_id: str = Form(...)):
-    logging.info('/audio received')
-    content = await audio.read()
-    chunk_size = 1024*1000
-    idx = 0
-    for i in range(0, len(content), chunk_size):
-        logging.info(f'chunk {idx}')
-        idx += 1
-        chunk = content[i:i+chunk_size]
-        if chunk:
-            logging.info(f'chunk size={len(chunk)}')
-            dg_connection.send(chunk)
+async def receive_audio(audio: UploadFile = File(...), user_id: str = Form(...), msg_id: str = Form(...),
+                        last: bool = Form(False)):
+    key = f"{user_id}:{msg_id}"
+    logging.info(f'{key} - /audio received, last={last}')
+    try:
+        await sessions.send_upload(key, audio)
+    except CapacityError as e:
+        logging.warning(f'{key} - reject: {e}')
+        raise HTTPException(status_code=503, detail="SERVER_BUSY")
+    except Exception:
+        raise HTTPException(status_code=502, detail="STT_ERROR")
+    if last:
+        # 这条消息说完了，关掉会话，剩下的结果发完 sse 就结束
+        await sessions.close(key)
     return {"message": "Audio received and processing started"}
 
+
 @app.get("/transcriptions")
 async def get_transcriptions(request: Request, user_id: str, msg_id: str):
+    key = f"{user_id}:{msg_id}"
+
     async def event_generator():
-        key = f"{user_id}:{msg_id}"
-        while True:
-            if key in transcriptions and transcriptions[key]:
-                yield {
-                    "event": "transcription",
-                    "data": {"transcription": transcriptions[key].pop(0)}
-                }
-            if await request.is_disconnected():
-                break
-            await asyncio.sleep(0.1)
+        # 有新结果时 broker 唤醒，不轮询；客户端断开时 EventSourceResponse 取消这个生成器
+        try:
+            async for item in broker.subscribe(key, timeout=SSE_TIMEOUT):
+                yield item
+        except asyncio.TimeoutError:
+            logging.info(f'{key} - transcriptions sse timeout')
 
     return EventSourceResponse(event_generator())
 
+
+@app.get("/api_12/deepgram_sessions", dependencies=[Depends(stats_guard)])
+async def get_sessions():
+    stats = sessions.stats()
+    stats['provider'] = provider.stats()
+    stats['channels'] = len(broker)
+    return stats
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
-# pip install sse_starlette 
+# pip install sse_starlette
 # pip install deepgram-sdk==3.*
 
 # nohup uvicorn web2:app --reload --host 0.0.0.0 --port 5012 >> nohup.out &
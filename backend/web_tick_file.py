@@ -1,11 +1,11 @@
-from fastapi import FastAPI, Query, UploadFile, File, Form
+from fastapi import FastAPI, Query, UploadFile, File, Form, Depends
 from fastapi.responses import StreamingResponse
 import logging
 import aiohttp
+import asyncio
 import time
 from datetime import datetime
 import os
-import requests
 
 import config
 
@@ -31,6 +31,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+import metrics
+# 统计接口只给带 METRICS_TOKEN 的或者本机访问
+stats_guard = metrics.scrape_guard(getattr(config, 'METRICS_TOKEN', None))
+
+from http_pool import HttpPool
+http_pool = HttpPool(
+    limit_per_host=getattr(config, 'HTTP_LIMIT_PER_HOST', 20),
+    connect_timeout=getattr(config, 'HTTP_CONNECT_TIMEOUT', 10),
+    sock_read_timeout=getattr(config, 'HTTP_READ_TIMEOUT', 60),
+)
+
+
+from stt_client import WhisperClient
+from stt_jobs import TranscriptionJobs
+STT_TIMEOUT = getattr(config, 'STT_TIMEOUT', 60)
+whisper_client = WhisperClient(
+    http_pool, config.API_KEY,
+    max_concurrency=getattr(config, 'STT_MAX_CONCURRENCY', 4),
+    timeout=STT_TIMEOUT,
+    temperature='0.01',
+)
+stt_jobs = TranscriptionJobs(
+    # 和 web.py 的任务目录分开，两个服务各自恢复自己没做完的任务
+    getattr(config, 'TICK_STT_JOBS_DIR', 'stt_jobs_tick'),
+    {'whisper': whisper_client.request},
+    workers=getattr(config, 'STT_WORKERS', 4),
+    provider_limits=getattr(config, 'STT_PROVIDER_LIMITS', {'whisper': 4}),
+)
+
+
+@app.on_event("startup")
+async def startup():
+    await http_pool.start()
+    await stt_jobs.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stt_jobs.stop()
+    await http_pool.close()
+
+
+@app.get("/api_12/http_pool", dependencies=[Depends(stats_guard)])
+async def get_http_pool_stats():
+    return http_pool.stats()
+
+
 message_dict = {}
 MSG_INIT = -1
 MSG_DONE = -2
@@ -100,76 +147,23 @@ async def get_speech(text: str = Query(...)):
     logging.info("/speech")
     return await proxy_speech(text)
 
-import shutil
-def del_file(file_to_delete):
-    try:
-        os.remove(file_to_delete)
-        print(f"文件 {file_to_delete} 删除成功。")
-    except OSError as e:
-        print(f"Warning: 文件 {file_to_delete} 删除失败 - {e}")
-
-from pydub import AudioSegment
-import numpy as np
-
-SILENT_THRESHOLD = 1500
-
-def extract_audio_data0(file_path):
-    audio = AudioSegment.from_file(file_path)
-    samples = np.array(audio.get_array_of_samples())
-    return samples, audio.frame_rate
-
-def extract_audio_data(file_path, target_sr=22050):
-    audio = AudioSegment.from_file(file_path)
-    audio = audio.set_frame_rate(target_sr)
-    samples = np.array(audio.get_array_of_samples())
-    return samples, audio.frame_rate
-
-def check_silence(audio_segment, threshold=SILENT_THRESHOLD):
-    max_amplitude = np.max(np.abs(audio_segment))
-    logging.info(f'Max amplitude of the segment: {max_amplitude}')
-    return max_amplitude < threshold
-
-# def check_silence_all(audio, sr, chunk_duration_ms=100):
-#     chunk_size = int((chunk_duration_ms / 1000) * sr)
-#     num_chunks = len(audio) // chunk_size
-#     for i in range(num_chunks):
-#         chunk = audio[i * chunk_size:(i + 1) * chunk_size]
-#         if not check_silence(chunk):
-#             logging.info(f'Chunk {i} is not silent')
-#             return False
-#     remainder = audio[num_chunks * chunk_size:]
-#     if len(remainder) > 0 and not check_silence(remainder):
-#         logging.info('Remainder is not silent')
-#         return False
-#     logging.info('File is silent')
-#     return True
-
-def has_extended_content(base_file, extended_file):
-    logging.info('Start comparing')
-
-    base_audio, base_sr = extract_audio_data(base_file)
-    extended_audio, extended_sr = extract_audio_data(extended_file)
-    
-    base_length = len(base_audio)
-    extended_length = len(extended_audio)
-    
-    if extended_length > base_length:
-        extra_audio = extended_audio[base_length:extended_length]
-        has_content = not check_silence(extra_audio)
-        #has_content = not check_silence_all(extra_audio, base_sr)
-        logging.info(f'Comparison done, has extend content={has_content}')
-        return has_content
-    else:
-        logging.info('Extended file is not longer than the base file')
-        return True
-
-def is_file_silent(file_path):
-    logging.info('Checking if the file is silent')
-    audio, sr = extract_audio_data(file_path)
-    is_silent = check_silence(audio)
-    #is_silent = check_silence_all(audio, sr)
-    logging.info(f'File {file_path} is {"silent" if is_silent else "not silent"}')
-    return is_silent
+from tick_audio import TickAnalyzer, SILENT_THRESHOLD
+from transcoder import TranscodeError, get_transcoder
+tick_audio = TickAnalyzer()
+transcoder = get_transcoder()
+
+
+def save_file(file_path, content):
+    with open(file_path, "wb") as f:
+        f.write(content)
+
+
+@app.get("/api_12/tick_stats", dependencies=[Depends(stats_guard)])
+async def get_tick_stats():
+    stats = tick_audio.stats()
+    stats['transcoder'] = transcoder.stats()
+    return stats
+
 
 @app.post("/api_12/upload")
 async def upload_file(file: UploadFile = File(...), user: str = Form(...), tick: str = Form(...)):
@@ -181,66 +175,62 @@ async def upload_file(file: UploadFile = File(...), user: str = Form(...), tick:
     os.makedirs(os.path.join(STATIC_FOLDER_PATH, user, dir1), exist_ok=True)
     file_path = os.path.join(STATIC_FOLDER_PATH, user, dir1, file.filename)
 
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    content = await file.read()
+    with tick_audio.timings.timed('save'):
+        await asyncio.to_thread(save_file, file_path, content)
 
     process_next = True
-    recent_file = file_path + ".recent"
-    if os.path.exists(recent_file):
+    state = tick_audio.get(file_path)
+    try:
+        result = await tick_audio.update(file_path, content)
+    except TranscodeError as e:
+        # ffmpeg 忙或者超时，判断不了有没有新声音，照常识别
+        logging.warning(f'tick analyse failed, file={file_path}: {e}')
+        state = result = None
+    if file_tick==tick:
+        # 最后一个 tick，之后不会再传这个文件了
+        tick_audio.forget(file_path)
+    if state is not None:
         if file_tick==tick:
-            del_file(recent_file)
-            if is_file_silent(file_path):
+            # 整个文件都没声音就不识别
+            if result.peak < SILENT_THRESHOLD:
                 process_next = False
-        else:
-            if not has_extended_content(recent_file, file_path):
-                process_next = False
-    shutil.copy(file_path, recent_file)
+        elif result.new_samples and result.tail_peak < SILENT_THRESHOLD:
+            # 比上一版只多了静音
+            process_next = False
+    if result is not None:
+        logging.info(f'tick analysed, new samples={result.new_samples}, tail peak={result.tail_peak}, peak={result.peak}')
     if not process_next:
-        logging.info(f'no change detected, file={recent_file}')
+        logging.info(f'no change detected, file={file_path}')
         return {"text": ""}
 
     try:
-        # convert to m4a
-        file_m4a = file_path + ".m4a"
-        if os.path.exists(file_m4a):
-            os.remove(file_m4a)
-        convert_aac_to_m4a(file_path, file_m4a)
-        file_path = file_m4a
-    except:
+        # whisper 不收裸 aac，换成 m4a 容器（只换容器不重新编码）；已经是它收的格式就直接用
+        with tick_audio.timings.timed('convert'):
+            file_path = await transcoder.prepare_file(file_path, 'whisper', data=content)
+    except TranscodeError as e:
+        logging.error(f'convert failed, file={file_path}: {e}')
         return {"text": ""}
 
-    # audio to text
+    # audio to text, 走任务队列：限制并发，失败自动重试
     logging.info(f'upload={file_path}')
-    return {"text": _audio_to_script(file_path)}
-
-
-import ffmpeg
-def convert_aac_to_mp3(aac_file, mp3_file):
-    ffmpeg.input(aac_file).output(mp3_file, acodec='libmp3lame').global_args('-loglevel', 'error').run()
-
-def convert_aac_to_m4a(aac_file, m4a_file):
-    ffmpeg.input(aac_file).output(m4a_file, c='copy').global_args('-loglevel', 'error').run()
-
-
-def _audio_to_script(local_file_path):
-    headers = {
-        'Authorization': f'Bearer sk-{config.API_KEY}',
-    }
-    data = {
-        'model': 'whisper-1',
-        'temperature': '0.01'
-    }
-    files = {
-        'file': open(local_file_path, 'rb'),
-    }
-    response = requests.post('https://api.openai.com/v1/audio/transcriptions', headers=headers, data=data, files=files)
-    dict1 = response.json()
-    logging.info(f'response={dict1}')
-    if response.status_code == 200:
-        return dict1['text']
-    else:
-        return dict1['error']['message']
+    with tick_audio.timings.timed('stt'):
+        job = await stt_jobs.submit(file_path, copy=False)
+        try:
+            # 每次尝试最多 STT_TIMEOUT 秒
+            job = await stt_jobs.wait(job['job_id'], timeout=STT_TIMEOUT * stt_jobs.max_attempts)
+        except asyncio.TimeoutError:
+            logging.error(f'stt timeout, job_id={job["job_id"]}, file={file_path}')
+            return {"text": ""}
+    return {"text": job['result'] if job['status'] == 'done' else ''}
+
+
+async def convert_aac_to_mp3(aac_file, mp3_file):
+    await transcoder.transcode(aac_file, 'mp3', output=mp3_file)
+
+async def convert_aac_to_m4a(aac_file, m4a_file):
+    await transcoder.transcode(aac_file, 'm4a', output=m4a_file)
+
 
 # -----------------------------------
 
@@ -249,21 +239,21 @@ async def proxy_speech(text) -> StreamingResponse:
     return StreamingResponse(generator, media_type='audio/mpeg')
 
 async def proxy_speech_generator(text: str):
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers={
-                'Authorization': f'Bearer sk-{config.API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            async with session.post('https://api.openai.com/v1/audio/speech', 
-                                    headers = headers,
-                                    json={"input":text, "model": "tts-1", "voice": "alloy"}) as response:
-                logging.info(f'proxy speech start: {text}')
-                async for data in response.content.iter_any():
-                    yield data
-                logging.info(f'proxy speech done: {text}')
-        except Exception as e:
-            yield f'Exception: {e}'
+    session = await http_pool.get_session()
+    try:
+        headers={
+            'Authorization': f'Bearer sk-{config.API_KEY}',
+            'Content-Type': 'application/json'
+        }
+        async with session.post('https://api.openai.com/v1/audio/speech', 
+                                headers = headers,
+                                json={"input":text, "model": "tts-1", "voice": "alloy"}) as response:
+            logging.info(f'proxy speech start: {text}')
+            async for data in response.content.iter_any():
+                yield data
+            logging.info(f'proxy speech done: {text}')
+    except Exception as e:
+        yield f'Exception: {e}'
 
 
 # -----------------------------------
@@ -290,33 +280,33 @@ def contains_sep(text):
 
 
 async def proxy_chat_generator(user: str, prompt: str, message_id:str, model: str):
-    async with aiohttp.ClientSession() as session:
-        try:
-            sentences = []
-            message_dict[message_id] = sentences
-            async with session.post(URL, json={"prompt":prompt, "user": user, "user_group": "zzs", "model": model}) as response:
-                sentence = ''
-                async for bytes in response.content.iter_any():
-                    data = bytes.decode('utf-8')
-                    data = data.replace('\n\n', '\n') # \n\n conflict with SSE
-                    exist,left,right = contains_sep(data)
-                    if exist:
-                        sentence += left
-                        yield sentence
-                        sentence = sentence.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
-                        sentences.append(sentence)
-                        sentence = right
-                    else:
-                        sentence += data
-                if sentence:
+    session = await http_pool.get_session()
+    try:
+        sentences = []
+        message_dict[message_id] = sentences
+        async with session.post(URL, json={"prompt":prompt, "user": user, "user_group": "zzs", "model": model}) as response:
+            sentence = ''
+            async for bytes in response.content.iter_any():
+                data = bytes.decode('utf-8')
+                data = data.replace('\n\n', '\n') # \n\n conflict with SSE
+                exist,left,right = contains_sep(data)
+                if exist:
+                    sentence += left
                     yield sentence
                     sentence = sentence.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
                     sentences.append(sentence)
-                sentences.append(END_SENTENCE)
-                logging.info(f'sentences={sentences}')
-
-        except Exception as e:
-            yield f'Exception: {e}'
+                    sentence = right
+                else:
+                    sentence += data
+            if sentence:
+                yield sentence
+                sentence = sentence.replace('\n', '  ') # I dont know why swift's SSE cant handle \n
+                sentences.append(sentence)
+            sentences.append(END_SENTENCE)
+            logging.info(f'sentences={sentences}')
+
+    except Exception as e:
+        yield f'Exception: {e}'
 
 # sudo apt-get install ffmpeg
 # ffmpeg -version
@@ -327,9 +317,11 @@ async def proxy_chat_generator(user: str, prompt: str, message_id:str, model: st
 
 
 if __name__ == '__main__':
-    path = '/opt/disk2/gpt-voice/static/202407/'
-    logging.info('converting from aac to mp3')
-    convert_aac_to_mp3(path + 'record_5.aac', path + 'record_5.aac.a.mp3')
-    logging.info('has converted from aac to mp3, starting convert aac to m4a')
-    convert_aac_to_m4a(path + 'record_5.aac', path + 'record_5.aac.a.m4a')
-    logging.info('has converted from aac to m4a')
\ No newline at end of file
+    async def _main():
+        path = '/opt/disk2/gpt-voice/static/202407/'
+        logging.info('converting from aac to mp3')
+        await convert_aac_to_mp3(path + 'record_5.aac', path + 'record_5.aac.a.mp3')
+        logging.info('has converted from aac to mp3, starting convert aac to m4a')
+        await convert_aac_to_m4a(path + 'record_5.aac', path + 'record_5.aac.a.m4a')
+        logging.info('has converted from aac to m4a')
+    asyncio.run(_main())
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+INTERIM = 0
+FINAL = 1
+REPLY = 2
+
+
+class SenderStats:
+    """进程内所有连接的发送统计：合并 / 丢弃了多少中间结果，消息从入队到发完的延迟"""
+
+    def __init__(self, recent=1000):
+        self.counters = {
+            'interims': 0,         # 收到的中间结果
+            'interims_sent': 0,
+            'coalesced': 0,        # 还没发出去就被更新的中间结果替换掉
+            'superseded': 0,       # 还没发出去这句就结束了，由 final 代替
+            'dropped': 0,          # 队列满了丢掉的中间结果
+            'finals': 0,
+            'finals_sent': 0,
+            'overflows': 0,        # 队列满了还得放 final（final 不丢）
+            'replies': 0,          # 回复的文本和语音帧
+            'replies_sent': 0,
+            'reply_bytes': 0,      # 发出去的语音字节数
+            'reply_waits': 0,      # 队列满了，回复等客户端收走一些再继续
+            'replies_dropped': 0,  # 被打断，还没发的回复直接扔掉
+            'send_errors': 0,
+            'max_depth': 0,
+        }
+        self._lag_ms = {INTERIM: deque(maxlen=recent), FINAL: deque(maxlen=recent), REPLY: deque(maxlen=recent)}
+
+    def record_lag(self, kind, ms):
+        self._lag_ms[kind].append(ms)
+
+    def stats(self):
+        stats = dict(self.counters)
+        for kind, name in ((INTERIM, 'interim_lag_ms'), (FINAL, 'final_lag_ms'), (REPLY, 'reply_lag_ms')):
+            recent = sorted(self._lag_ms[kind])
+            if recent:
+                stats[name] = {
+                    'avg': round(sum(recent) / len(recent), 1),
+                    'p50': round(recent[len(recent) // 2], 1),
+                    'p99': round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 1),
+                    'max': round(recent[-1], 1),
+                }
+        return stats
+
+
+class TranscriptSender:
+    """一个 websocket 连接的下行通道，识别回调只管往里放，由一个协程按顺序发。
+
+    - 中间结果只保留最新的一条：还没发出去就来了新的，直接替换
+    - final 按到达顺序全部送达，从不丢；排在它前面、同一句还没发的中间结果被它代替
+    - 队列最多 max_queue 条，满了新的中间结果直接丢，客户端慢也不会拖住识别线程
+    - reply() 放回复的文本或语音（bytes），和 final 一样按顺序送达；生产方 await writable() 等队列有空位
+    - interim() / final() / reply() 不阻塞，必须在事件循环线程里调；sdk 线程里用 call_soon_threadsafe 转过来
+    """
+
+    def __init__(self, websocket, stats: SenderStats, max_queue=32, name=''):
+        self.websocket = websocket
+        self.stats = stats
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = deque()  # [kind, text 或 bytes, 入队时间]
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()  # 发出去一条就 set，writable() 等它
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def interim(self, text):
+        counters = self.stats.counters
+        counters['interims'] += 1
+        if self._closed:
+            return
+        if self._queue and self._queue[-1][0] == INTERIM:
+            # 保留原来的入队时间，延迟按最早没发出去的那条算
+            self._queue[-1][1] = text
+            counters['coalesced'] += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            counters['dropped'] += 1
+            return
+        self._put([INTERIM, text, time.perf_counter()])
+
+    def final(self, text):
+        counters = self.stats.counters
+        counters['finals'] += 1
+        if self._closed:
+            return
+        if self._queue and self._queue[-1][0] == INTERIM:
+            self._queue.pop()
+            counters['superseded'] += 1
+        if len(self._queue) >= self.max_queue:
+            counters['overflows'] += 1
+            if counters['overflows'] == 1 or counters['overflows'] % 100 == 0:
+                logging.warning(f'{self.name} - client is slow, {len(self._queue)} messages queued')
+        self._put([FINAL, text, time.perf_counter()])
+
+    def reply(self, data):
+        """回复的文本（str）或语音帧（bytes），排在已经入队的识别结果后面，从不丢"""
+        self.stats.counters['replies'] += 1
+        if self._closed:
+            return
+        self._put([REPLY, data, time.perf_counter()])
+
+    def drop_replies(self):
+        """扔掉还没发的回复（用户打断时），识别结果照发"""
+        kept = deque(item for item in self._queue if item[0] != REPLY)
+        self.stats.counters['replies_dropped'] += len(self._queue) - len(kept)
+        self._queue = kept
+        self._space.set()
+
+    async def writable(self):
+        """队列满了等客户端收走一些，tts 比客户端快时在这里反压"""
+        if len(self._queue) < self.max_queue or self._closed:
+            return
+        self.stats.counters['reply_waits'] += 1
+        while len(self._queue) >= self.max_queue and not self._closed:
+            self._space.clear()
+            await self._space.wait()
+
+    def _put(self, item):
+        self._queue.append(item)
+        self.stats.counters['max_depth'] = max(self.stats.counters['max_depth'], len(self._queue))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            kind, data, queued = self._queue.popleft()
+            self._space.set()
+            try:
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+            except Exception as e:
+                # 连接断了，后面的也发不出去
+                self.stats.counters['send_errors'] += 1
+                logging.info(f'{self.name} - send failed, drop {len(self._queue)} queued: {e!r}')
+                self._closed = True
+                self._queue.clear()
+                self._space.set()
+                return
+            self.stats.record_lag(kind, (time.perf_counter() - queued) * 1000)
+            counters = self.stats.counters
+            if kind == REPLY:
+                counters['replies_sent'] += 1
+                if isinstance(data, bytes):
+                    counters['reply_bytes'] += len(data)
+            else:
+                counters['finals_sent' if kind == FINAL else 'interims_sent'] += 1
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    async def close(self, timeout=1.0):
+        """停止接收新消息，剩下的 final 尽量在 timeout 内发完"""
+        self._closed = True
+        self._space.set()
+        while self._queue and self._queue[-1][0] == INTERIM:
+            self._queue.pop()
+        if self._task is None:
+            return
+        self._wakeup.set()
+        done, _ = await asyncio.wait([self._task], timeout=timeout)
+        if not done:
+            logging.info(f'{self.name} - close with {len(self._queue)} messages unsent')
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)